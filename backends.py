@@ -0,0 +1,198 @@
+import threading
+import time
+from typing import Any, Iterable, Optional
+
+from policy import CircuitBreaker, CircuitOpenError
+
+# Weight of the newest sample in the moving latency and error estimates
+SMOOTHING = 0.3
+# Seconds for an unused backend's latency estimate to halve, so it is re-measured eventually
+STALE_HALF_LIFE = 300
+# Latency samples a backend gets before it is ranked; the first includes connection setup
+MIN_SAMPLES = 3
+# Cap on the error rate used for routing, so a failing backend still has a finite cost
+MAX_ERROR_RATE = 0.9
+# Expected ms charged at an error rate of 1 to a backend too new to have a latency estimate
+FAILURE_PENALTY_MS = 5000
+
+class Backend:
+  """One OpenAI-compatible endpoint and model, with moving estimates of how it performs.
+
+  latency_ms follows the time to the first token of streamed answers and
+  the whole call otherwise; error_rate follows the share of calls that
+  failed in a way the server may recover from. Each backend has its own
+  circuit breaker. Fallback backends are only routed to when every other
+  backend's breaker is open.
+  """
+
+  def __init__(self, name: str, base_url: str, api_key: str, model: str, fallback: bool = False,
+               openai_params: bool = True) -> None:
+    self.name = name
+    self.base_url = base_url
+    self.api_key = api_key
+    self.model = model
+    self.fallback = fallback
+    self.openai_params = openai_params
+    self.breaker = CircuitBreaker(name)
+    self.lock = threading.Lock()
+    self.latency_ms: Optional[float] = None
+    self.samples = 0
+    self.error_rate = 0.0
+    self.measured_at = 0.0
+    self.requests = 0
+    self.failures = 0
+
+  @property
+  def endpoint(self) -> tuple:
+    """What the backend connects to and asks for; backends with equal endpoints are interchangeable."""
+    return self.name, self.base_url, self.api_key, self.model, self.fallback, self.openai_params
+
+  def record(self, success: bool, latency_ms: Optional[float] = None) -> None:
+    """Report a finished call: whether the backend was healthy and, if known, how fast it was."""
+    self.breaker.record(success)
+    with self.lock:
+      self.requests += 1
+      self.failures += not success
+      self.error_rate += SMOOTHING * ((not success) - self.error_rate)
+      self.measured_at = time.monotonic()
+    if latency_ms is not None:
+      self.observe(latency_ms)
+
+  def release(self) -> None:
+    """Report a call that was cancelled before it had an outcome."""
+    self.breaker.release()
+
+  def observe(self, latency_ms: float) -> None:
+    """Fold a latency sample into the moving estimate (a plain mean until it has enough samples)."""
+    with self.lock:
+      self.samples += 1
+      if self.latency_ms is None:
+        self.latency_ms = latency_ms
+      else:
+        self.latency_ms += max(SMOOTHING, 1 / self.samples) * (latency_ms - self.latency_ms)
+      self.measured_at = time.monotonic()
+
+  def cost(self) -> float:
+    """Expected ms to a good answer.
+
+    Until it has MIN_SAMPLES latencies a backend costs nothing, so every
+    backend gets tried, unless it has been failing: then it is charged
+    FAILURE_PENALTY_MS scaled by its error rate, which fades like a stale
+    latency so it is tried again later.
+    """
+    with self.lock:
+      if self.latency_ms is None or self.samples < MIN_SAMPLES:
+        latency = FAILURE_PENALTY_MS * self.error_rate
+      else:
+        latency = self.latency_ms
+      age = time.monotonic() - self.measured_at
+      latency *= 0.5 ** (age / STALE_HALF_LIFE)
+      return latency / (1 - min(self.error_rate, MAX_ERROR_RATE))
+
+  def stats(self) -> dict[str, Any]:
+    with self.lock:
+      return {
+        'model': self.model,
+        'state': self.breaker.state,
+        'requests': self.requests,
+        'failures': self.failures,
+        'latency_ms': None if self.latency_ms is None else round(self.latency_ms, 1),
+        'error_rate': round(self.error_rate, 3)
+      }
+
+class Router:
+  """Sends each request to the backend expected to answer it first.
+
+  Backends are ranked by cost and the first whose breaker lets a request
+  through is used. Variants (the same endpoint with another model, for
+  hedging) are tracked alongside but never routed to on their own.
+  """
+
+  def __init__(self, backends: Iterable[Backend]) -> None:
+    self.lock = threading.Lock()
+    self.backends: list[Backend] = []
+    self.variants: dict[tuple[str, str], Backend] = {}
+    self.update(backends)
+
+  def update(self, backends: Iterable[Backend]) -> None:
+    """Swap in a new backend list, keeping the estimates of backends that did not change."""
+    with self.lock:
+      current = {backend.endpoint: backend for backend in self.backends}
+      self.backends = [current.get(backend.endpoint, backend) for backend in backends]
+      self.variants.clear()
+
+  def tune(self, threshold: int, cooldown: float) -> None:
+    """Apply circuit breaker settings to every backend."""
+    with self.lock:
+      for backend in (*self.backends, *self.variants.values()):
+        backend.breaker.threshold = threshold
+        backend.breaker.cooldown = cooldown
+
+  def choose(self, avoid: Optional[Backend] = None) -> Backend:
+    """Return the cheapest backend that may be called now, trying avoid last.
+
+    Raises CircuitOpenError when every backend, fallbacks included, is open.
+    """
+    with self.lock:
+      backends = list(self.backends)
+    ranked = sorted((backend for backend in backends if not backend.fallback),
+                    key=lambda backend: (backend is avoid, backend.cost()))
+    for backend in ranked + [backend for backend in backends if backend.fallback]:
+      if backend.breaker.allow():
+        if backend.fallback:
+          print(f"Every backend is failing, sending to {backend.name}")
+        return backend
+
+    names = ', '.join(backend.name for backend in backends)
+    wait = min(backend.breaker.retry_in() for backend in backends)
+    raise CircuitOpenError(f"{names} {'is' if len(backends) == 1 else 'are'} failing; requests resume in {wait:.0f}s", wait)
+
+  def runner_up(self, primary: Backend) -> Optional[Backend]:
+    """Return the cheapest healthy backend other than primary, or None."""
+    with self.lock:
+      others = [backend for backend in self.backends
+                if backend is not primary and not backend.fallback and backend.breaker.state == 'closed']
+    return min(others, key=Backend.cost, default=None)
+
+  def variant(self, backend: Backend, model: str) -> Backend:
+    """Return backend's endpoint asking for model instead, tracked under its own name."""
+    if model == backend.model:
+      return backend
+    with self.lock:
+      key = (backend.name, model)
+      if key not in self.variants:
+        variant = self.variants[key] = Backend(f'{backend.name}:{model}', backend.base_url, backend.api_key, model,
+                                               openai_params=backend.openai_params)
+        variant.breaker.threshold = backend.breaker.threshold
+        variant.breaker.cooldown = backend.breaker.cooldown
+      return self.variants[key]
+
+  def stats(self) -> dict[str, dict[str, Any]]:
+    """Return each backend's model, breaker state, counters and estimates."""
+    with self.lock:
+      backends = [*self.backends, *self.variants.values()]
+    return {backend.name: backend.stats() for backend in backends}
+
+def configured_backends(settings: Any) -> list[Backend]:
+  """Build the backend list for a Settings snapshot.
+
+  [openai] is always the first backend; each [backend:NAME] section adds
+  one, taking unset fields from [openai]. The [openai] key is only sent to
+  the [openai] endpoint: a backend with its own base_url and no api_key
+  (e.g. a local server) gets a placeholder, and is not sent OpenAI-only
+  parameters unless its section sets openai_params. [policy]
+  fallback_model adds a fallback backend on the [openai] endpoint.
+  """
+  options = settings.openai
+  backends = [Backend('openai', options.base_url, options.api_key, options.model, openai_params=options.openai_params)]
+  for backend in settings.backends:
+    api_key = backend.api_key or (options.api_key if not backend.base_url else 'none')
+    openai_params = backend.openai_params if backend.base_url else options.openai_params
+    backends.append(Backend(backend.name, backend.base_url or options.base_url, api_key, backend.model or options.model,
+                            openai_params=openai_params))
+
+  fallback = settings.policy.fallback_model
+  if fallback:
+    backends.append(Backend(f'openai:{fallback}', options.base_url, options.api_key, fallback, fallback=True,
+                            openai_params=options.openai_params))
+  return backends
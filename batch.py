@@ -0,0 +1,153 @@
+"""Answer a file of questions with the daemon's prompt settings.
+
+  python main.py --batch questions.jsonl --out answers.jsonl [--concurrency 4] [--rate 2]
+
+Each input line is a JSON string or an object with a "question" field; any
+other fields (an "id", say) are copied to the output line, which gains an
+"answer" or an "error". A blank question is not sent and its line is
+marked "skipped". Lines are read as slots free up and written in input
+order as soon as every earlier line is done, so memory stays bounded however
+large the file is.
+"""
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Callable, Iterator
+
+from policy import CircuitOpenError, retry_after
+
+class TokenBucket:
+  """Client-side rate limiter allowing `rate` requests per second in bursts of up to `burst`."""
+
+  def __init__(self, rate: float, burst: float = 1) -> None:
+    self.rate = rate
+    self.capacity = max(1.0, burst)
+    self.tokens = self.capacity
+    self.updated = time.monotonic()
+    self.lock = asyncio.Lock()
+
+  async def acquire(self) -> None:
+    """Wait until a request may be sent. A rate of 0 never waits."""
+    if self.rate <= 0:
+      return
+
+    async with self.lock:
+      while True:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens -= 1
+          return
+        await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def read_questions(path: str) -> Iterator[dict[str, Any]]:
+  """Yield one record per non-empty input line; unusable lines carry an 'error'."""
+  with open(path, encoding='utf-8') as f:
+    for number, line in enumerate(f, 1):
+      line = line.strip()
+      if not line:
+        continue
+
+      try:
+        item = json.loads(line)
+      except json.JSONDecodeError as e:
+        yield {'line': number, 'error': f"invalid JSON: {e}"}
+        continue
+
+      if isinstance(item, str):
+        item = {'question': item}
+      elif not isinstance(item, dict) or not isinstance(item.get('question'), str):
+        yield {'line': number, 'error': "expected a string or an object with a 'question' string"}
+        continue
+      if not item['question'].strip():
+        item['skipped'] = "empty question"
+      yield item
+
+def retry_delay(error: Exception, attempt: int) -> float:
+  """Seconds to wait before retrying a rate-limited request or one refused by an open circuit breaker."""
+  if isinstance(error, CircuitOpenError):
+    # Spread the waiting requests over a moment after the breaker lets a probe through
+    return error.retry_in + random.uniform(0.1, 1.0)
+  delay = retry_after(error)
+  if delay is not None:
+    return delay
+  # Exponential backoff with jitter so parallel retries spread out
+  return min(60.0, 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def should_retry(error: Exception) -> bool:
+  """Whether a failed question is worth asking again: rate limited, or refused while a breaker is open."""
+  return getattr(error, 'status_code', None) == 429 or isinstance(error, CircuitOpenError)
+
+async def answer_all(generate: Callable[[str], str], questions: Iterator[dict[str, Any]], out: IO[str],
+                     concurrency: int, bucket: TokenBucket, retries: int,
+                     retryable: Callable[[Exception], bool] = should_retry) -> dict[str, int]:
+  """Answer every question with at most `concurrency` requests in flight, retrying errors retryable accepts."""
+  loop = asyncio.get_running_loop()
+  executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='batch')
+  running = asyncio.Semaphore(concurrency)
+  # Lines read but not yet written; bounds the reorder buffer behind a slow answer
+  window = asyncio.Semaphore(concurrency * 4)
+  finished: dict[int, dict[str, Any]] = {}
+  counts = {'questions': 0, 'answered': 0, 'failed': 0, 'skipped': 0, 'retries': 0}
+  next_write = 0
+
+  async def ask(question: str) -> dict[str, str]:
+    for attempt in range(retries + 1):
+      await bucket.acquire()
+      try:
+        return {'answer': await loop.run_in_executor(executor, generate, question)}
+      except Exception as e:
+        if not retryable(e) or attempt == retries:
+          return {'error': str(e)}
+        counts['retries'] += 1
+        await asyncio.sleep(retry_delay(e, attempt))
+    return {'error': "retries exhausted"}
+
+  async def answer(index: int, item: dict[str, Any]) -> None:
+    nonlocal next_write
+    if 'error' not in item and 'skipped' not in item:
+      async with running:
+        item.update(await ask(item['question']))
+    counts['failed' if 'error' in item else 'skipped' if 'skipped' in item else 'answered'] += 1
+
+    finished[index] = item
+    while next_write in finished:
+      out.write(json.dumps(finished.pop(next_write), ensure_ascii=False) + '\n')
+      next_write += 1
+      window.release()
+    out.flush()
+
+  tasks: set[asyncio.Task] = set()
+  try:
+    for index, item in enumerate(questions):
+      await window.acquire()
+      counts['questions'] += 1
+      task = asyncio.create_task(answer(index, item))
+      tasks.add(task)
+      task.add_done_callback(tasks.discard)
+    await asyncio.gather(*tasks)
+  finally:
+    executor.shutdown(wait=False, cancel_futures=True)
+  return counts
+
+def run_batch(generate: Callable[[str], str], input_path: str, out_path: str, concurrency: int = 4,
+              rate: float = 0, burst: float = 1, retries: int = 5,
+              retryable: Callable[[Exception], bool] = should_retry) -> dict[str, int]:
+  """Answer input_path into out_path and print the throughput.
+
+  generate should not retry on its own: each failure retryable accepts is
+  retried here, after a wait, up to retries times.
+  """
+  started = time.perf_counter()
+  with open(out_path, 'w', encoding='utf-8') as out:
+    counts = asyncio.run(answer_all(generate, read_questions(input_path), out, max(1, concurrency),
+                                    TokenBucket(rate, burst), retries, retryable))
+
+  elapsed = time.perf_counter() - started
+  print(f"Answered {counts['answered']} of {counts['questions']} questions in {elapsed:.1f}s "
+        f"({counts['questions'] / max(elapsed, 1e-9):.2f} questions/s), {counts['failed']} failed, "
+        f"{counts['skipped']} skipped as empty, {counts['retries']} retries")
+  return counts
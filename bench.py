@@ -0,0 +1,1019 @@
+"""Benchmarks for Joker's hot paths.
+
+  python bench.py keys [--count 200000]
+  python bench.py e2e [--iterations 50] [--latency 200] [--token-rate 50] [--no-stream]
+  python bench.py route [--requests 100] [--latencies 50,200,400] [--error-rates 0,0,0]
+  python bench.py similar [--questions history.jsonl] [--thresholds 0.6,0.7,0.8,0.9]
+  python bench.py replay [TRACE | --synthetic 20000 --rate 2000] [--speed 1] [--strict]
+  python bench.py download [--size 32] [--connections 4] [--drop-rate 0] [--rate 0]
+  python bench.py serve [--port 8000] [--latency 200]
+
+`e2e` starts a local OpenAI-compatible stand-in server, points the client at
+it and drives the hotkey path headlessly. `route` starts one stand-in per
+latency as separate backends and reports where requests were routed.
+`similar` replays recorded questions through the near-duplicate index and
+reports its hit and false-positive rates per threshold. `replay` feeds a
+trace recorded with `main.py --record` (or a synthetic one) through the
+listener callbacks against a stub clipboard and backend. `download` runs
+download.py against a local file server: a ranged download, a resume after
+an interruption, the fallback for servers without Range support and a
+digest mismatch, exiting 1 if any of them misbehaves.
+`serve` runs the stand-in alone so main.py can be pointed at it with
+`base_url`. Results are printed as JSON so
+runs can be compared across versions.
+"""
+import argparse
+import collections
+import contextlib
+import dataclasses
+import hashlib
+import io
+import json
+import math
+import os
+import platform
+import queue
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional
+
+from pynput import keyboard
+import download
+import main
+from cache import normalize_message
+from eventtrace import decode_button, decode_key, encode_key, read_trace
+from settings import BackendSettings
+from similar import NearDuplicateIndex
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+  """Answers /chat/completions like the OpenAI API, with scripted timing."""
+
+  protocol_version = 'HTTP/1.1'
+  # Send each small write at once; Nagle plus delayed ACKs adds ~40 ms per response
+  disable_nagle_algorithm = True
+  server: 'FakeOpenAIServer'
+
+  def log_message(self, format: str, *args: Any) -> None:
+    pass
+
+  def do_HEAD(self) -> None:
+    self.send_response(200)
+    self.send_header('Content-Length', '0')
+    self.end_headers()
+
+  def do_GET(self) -> None:
+    if self.path.rstrip('/').endswith('/models'):
+      self.send_json(200, {'object': 'list', 'data': [{'id': self.server.model, 'object': 'model'}]})
+    else:
+      self.send_json(404, {'error': {'message': 'not found'}})
+
+  def do_POST(self) -> None:
+    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+    with self.server.lock:
+      self.server.requests += 1
+
+    if not self.path.rstrip('/').endswith('/chat/completions'):
+      self.send_json(404, {'error': {'message': 'not found'}})
+      return
+
+    time.sleep(self.server.latency + random.uniform(0, self.server.jitter))
+    if random.random() < self.server.error_rate:
+      self.send_json(self.server.error_status, {'error': {'message': 'scripted failure', 'type': 'server_error'}})
+      return
+
+    tokens = [f"tok{i} " for i in range(self.server.tokens)]
+    model = body.get('model', self.server.model)
+    if body.get('stream'):
+      self.stream_tokens(model, tokens)
+    else:
+      time.sleep(len(tokens) / self.server.token_rate)
+      self.send_json(200, {
+        'id': 'chatcmpl-bench', 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+        'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens)}, 'finish_reason': 'stop'}]
+      })
+
+  def stream_tokens(self, model: str, tokens: list[str]) -> None:
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/event-stream')
+    self.send_header('Transfer-Encoding', 'chunked')
+    self.end_headers()
+
+    step = max(1, self.server.chunk_tokens)
+    try:
+      for i in range(0, len(tokens), step):
+        chunk = {
+          'id': 'chatcmpl-bench', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+          'choices': [{'index': 0, 'delta': {'content': ''.join(tokens[i:i + step])}, 'finish_reason': None}]
+        }
+        self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        time.sleep(step / self.server.token_rate)
+      self.write_chunk(b"data: [DONE]\n\n")
+      self.wfile.write(b"0\r\n\r\n")
+    except (BrokenPipeError, ConnectionResetError):
+      with self.server.lock:
+        self.server.aborted += 1
+
+  def write_chunk(self, data: bytes) -> None:
+    self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+    self.wfile.flush()
+
+  def send_json(self, status: int, payload: dict) -> None:
+    data = json.dumps(payload).encode()
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+  """Local OpenAI-compatible stand-in with configurable latency and token rate.
+
+  latency/jitter are seconds before the first byte, token_rate is tokens per
+  second, and error_rate is the fraction of requests answered with
+  error_status instead.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, port: int = 0, latency: float = 0.2, jitter: float = 0.0, token_rate: float = 50,
+               tokens: int = 40, chunk_tokens: int = 1, error_rate: float = 0.0, error_status: int = 500,
+               model: str = 'bench-model') -> None:
+    super().__init__(('127.0.0.1', port), FakeOpenAIHandler)
+    self.latency = latency
+    self.jitter = jitter
+    self.token_rate = token_rate
+    self.tokens = tokens
+    self.chunk_tokens = chunk_tokens
+    self.error_rate = error_rate
+    self.error_status = error_status
+    self.model = model
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.aborted = 0
+
+  def handle_error(self, request: Any, client_address: Any) -> None:
+    # Clients dropping idle or cancelled connections is expected here
+    pass
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+  def start(self) -> 'FakeOpenAIServer':
+    threading.Thread(target=self.serve_forever, name='fake-openai', daemon=True).start()
+    return self
+
+class FakeFileHandler(BaseHTTPRequestHandler):
+  """Serves the server's payload at any path, answering a Range request with 206 when ranges are on."""
+
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+  server: 'FakeFileServer'
+
+  def log_message(self, format: str, *args: Any) -> None:
+    pass
+
+  def do_GET(self) -> None:
+    payload = self.server.payload
+    start, end = 0, len(payload) - 1
+    requested = self.headers.get('Range', '')
+    ranged = self.server.ranges and requested.startswith('bytes=')
+    if ranged:
+      first, _, last = requested[6:].partition('-')
+      start = int(first or 0)
+      end = min(int(last), end) if last else end
+    body = payload[start:end + 1]
+    with self.server.lock:
+      self.server.requests += 1
+
+    self.send_response(206 if ranged else 200)
+    self.send_header('Content-Type', 'application/octet-stream')
+    self.send_header('Content-Length', str(len(body)))
+    self.send_header('Accept-Ranges', 'bytes' if self.server.ranges else 'none')
+    if ranged:
+      self.send_header('Content-Range', f"bytes {start}-{end}/{len(payload)}")
+    self.end_headers()
+
+    # A scripted drop closes the connection partway through the body
+    cut = len(body)
+    if len(body) > 1 and random.random() < self.server.drop_rate:
+      cut = random.randrange(1, len(body))
+      self.close_connection = True
+    try:
+      for offset in range(0, cut, 64 * 1024):
+        block = body[offset:min(offset + 64 * 1024, cut)]
+        self.wfile.write(block)
+        with self.server.lock:
+          self.server.sent += len(block)
+        if self.server.rate:
+          time.sleep(len(block) / self.server.rate)
+    except (BrokenPipeError, ConnectionResetError):
+      pass
+    if cut < len(body):
+      with self.server.lock:
+        self.server.dropped += 1
+
+class FakeFileServer(ThreadingHTTPServer):
+  """Local release-asset host for download.py.
+
+  ranges turns Range support on or off, drop_rate is the fraction of
+  responses cut off partway, and rate caps each response in bytes per
+  second (0 = unthrottled). sent counts body bytes written.
+  """
+
+  daemon_threads = True
+
+  def __init__(self, payload: bytes, ranges: bool = True, drop_rate: float = 0.0, rate: float = 0.0,
+               port: int = 0) -> None:
+    super().__init__(('127.0.0.1', port), FakeFileHandler)
+    self.payload = payload
+    self.ranges = ranges
+    self.drop_rate = drop_rate
+    self.rate = rate
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.sent = 0
+    self.dropped = 0
+
+  def handle_error(self, request: Any, client_address: Any) -> None:
+    # The downloader closes the range probe's connection without reading a full body
+    pass
+
+  @property
+  def url(self) -> str:
+    return f"http://127.0.0.1:{self.server_address[1]}/joker.exe"
+
+  def start(self) -> 'FakeFileServer':
+    threading.Thread(target=self.serve_forever, name='fake-files', daemon=True).start()
+    return self
+
+class BenchClipboard:
+  """Clipboard stand-in serving the next benchmark question."""
+
+  def __init__(self) -> None:
+    self.text = ''
+
+  def paste(self) -> str:
+    return self.text
+
+  def copy(self, text: str) -> None:
+    self.text = text
+
+def percentiles(samples: list[float]) -> Optional[dict[str, float]]:
+  """Summarize samples (ms) as nearest-rank p50/p95/p99 plus mean and count."""
+  if not samples:
+    return None
+
+  ordered = sorted(samples)
+  def rank(q: float) -> float:
+    return round(ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))], 2)
+
+  return {
+    'p50': rank(0.50),
+    'p95': rank(0.95),
+    'p99': rank(0.99),
+    'mean': round(sum(ordered) / len(ordered), 2),
+    'n': len(ordered)
+  }
+
+def key_for(action: Any) -> Any:
+  """Find an unmodified key bound to action in the current hotkey table."""
+  for char, entries in main.hotkeys.chars.items():
+    if entries.get(0) is action:
+      return keyboard.KeyCode.from_char(char)
+  for key, entries in main.hotkeys.specials.items():
+    if entries.get(0) is action:
+      return key
+  raise ValueError("No unmodified key is bound to this action in [key]")
+
+def start_renderer() -> Optional['queue.Queue[tuple[str, queue.Queue]]']:
+  """Run a real PopupWindow on its own thread; None when no display is available."""
+  requests: 'queue.Queue[tuple[str, queue.Queue]]' = queue.Queue()
+  ready: 'queue.Queue[bool]' = queue.Queue()
+
+  def render_loop() -> None:
+    try:
+      window = main.PopupWindow()
+    except Exception:
+      ready.put(False)
+      return
+    ready.put(True)
+    while True:
+      answer, reply = requests.get()
+      started = time.perf_counter()
+      window.show(answer)
+      window.root.update()
+      reply.put((time.perf_counter() - started) * 1000)
+      window.hide()
+
+  threading.Thread(target=render_loop, name='bench-ui', daemon=True).start()
+  return requests if ready.get() else None
+
+def bench_e2e(iterations: int, stream: bool, server: FakeOpenAIServer) -> dict[str, Any]:
+  """Drive the hotkey path and generate_response against the stand-in server."""
+  settings = main.load_config(main.config_name)
+  main.settings = dataclasses.replace(
+    settings, openai=dataclasses.replace(settings.openai, api_key='bench', base_url=server.url, stream=stream)
+  )
+  main.cache = None
+  main.clients.clear()
+  main.router = None
+  main.hotkeys = main.HotkeyTable(main.settings.keys)
+  main.dispatcher = main.Dispatcher(main.process_message, workers=1, queue_size=4)
+  main.get_client()
+
+  clipboard = BenchClipboard()
+  main.pyperclip = clipboard
+  renderer = start_renderer()
+  pop_key = key_for(main.pop_clipboard)
+
+  # Capture the job each key press creates and when the UI first hears of it
+  jobs: 'queue.Queue[main.Job]' = queue.Queue()
+  submit = main.dispatcher.submit
+  def capture_submit(message: str, supersede: bool = True) -> Optional[main.Job]:
+    job = submit(message, supersede)
+    jobs.put(job)
+    return job
+  main.dispatcher.submit = capture_submit
+
+  first_ui: 'queue.Queue[float]' = queue.Queue()
+  main.post_ui = lambda item: first_ui.put(time.perf_counter())
+
+  paste = clipboard.paste
+  paste_ms: list[float] = []
+  def timed_paste() -> str:
+    started = time.perf_counter()
+    text = paste()
+    paste_ms.append((time.perf_counter() - started) * 1000)
+    return text
+  clipboard.paste = timed_paste
+
+  stages: dict[str, list[float]] = {
+    'clipboard_read': paste_ms, 'request': [], 'first_token': [], 'full_response': [], 'popup_render': []
+  }
+  direct: dict[str, list[float]] = {'first_token': [], 'full_response': []}
+
+  for i in range(iterations):
+    clipboard.copy(f"Benchmark question {i}: which option is correct? A) one B) two")
+
+    pressed = time.perf_counter()
+    main.on_key_press(pop_key)
+    main.on_key_release(pop_key)
+    job = jobs.get()
+    answer = job.future.result(timeout=60)
+    finished = time.perf_counter()
+
+    stages['first_token'].append((first_ui.get(timeout=1) - pressed) * 1000)
+    stages['full_response'].append((finished - pressed) * 1000)
+    stages['request'].append(main.connection_stats.stats()['last']['headers_ms'])
+    if renderer is not None:
+      reply: 'queue.Queue[float]' = queue.Queue()
+      renderer.put((answer, reply))
+      stages['popup_render'].append(reply.get())
+
+    # The same request without the dispatcher, clipboard or UI in the way
+    started = time.perf_counter()
+    first: list[float] = []
+    main.generate_response(f"Direct question {i}", lambda token: first or first.append(time.perf_counter()))
+    direct['full_response'].append((time.perf_counter() - started) * 1000)
+    if first:
+      direct['first_token'].append((first[0] - started) * 1000)
+
+  return {
+    'benchmark': 'e2e',
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'iterations': iterations,
+    'stream': stream,
+    'server': {
+      'latency_ms': server.latency * 1000,
+      'jitter_ms': server.jitter * 1000,
+      'token_rate': server.token_rate,
+      'tokens': server.tokens,
+      'chunk_tokens': server.chunk_tokens
+    },
+    'hotkey_ms': {name: percentiles(samples) for name, samples in stages.items()},
+    'direct_ms': {name: percentiles(samples) for name, samples in direct.items()},
+    'popup_render': 'measured' if renderer is not None else 'skipped (no display)',
+    'connections': main.connection_stats.stats(),
+    'dispatcher': main.dispatcher.stats()
+  }
+
+def bench_route(requests: int, latencies: list[float], error_rates: list[float]) -> dict[str, Any]:
+  """Route requests across one stand-in server per latency (ms) and count which one answered."""
+  servers = [FakeOpenAIServer(latency=latency / 1000, token_rate=1000, tokens=5, error_rate=error_rate).start()
+             for latency, error_rate in zip(latencies, error_rates)]
+  settings = main.load_config(main.config_name)
+  first, *others = servers
+  main.settings = dataclasses.replace(
+    settings,
+    openai=dataclasses.replace(settings.openai, api_key='bench', base_url=first.url, stream=True, hedge_delay=0),
+    backends=tuple(BackendSettings(name=f'stub{i}', base_url=server.url) for i, server in enumerate(others, 1)),
+    policy=dataclasses.replace(settings.policy, fallback_model='')
+  )
+  main.cache = None
+  main.clients.clear()
+  main.router = None
+
+  samples: list[float] = []
+  for i in range(requests):
+    started = time.perf_counter()
+    main.generate_response(f"Routing question {i}", cancellation=main.Cancellation())
+    samples.append((time.perf_counter() - started) * 1000)
+
+  return {
+    'benchmark': 'route',
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'requests': requests,
+    'servers': [{'latency_ms': latency, 'error_rate': error_rate, 'requests': server.requests}
+                for latency, error_rate, server in zip(latencies, error_rates, servers)],
+    'response_ms': percentiles(samples),
+    'backends': main.router.stats()
+  }
+
+class QuietProgress(download.Progress):
+  """Progress that counts bytes without printing, so the report stays clean JSON."""
+
+  def _print(self, now: float) -> None:
+    pass
+
+  def finish(self) -> None:
+    pass
+
+class Interrupted(Exception):
+  """Raised by StopAt to abort a download the way a crash or Ctrl+C would."""
+
+def stop_at(fraction: float) -> Callable[[int, int], download.Progress]:
+  """A progress factory that interrupts the download once fraction of it is done."""
+  class StopAt(QuietProgress):
+    def add(self, count: int) -> None:
+      super().add(count)
+      if self.done >= self.total * fraction:
+        raise Interrupted(f"interrupted at {self.done:,} bytes")
+  return StopAt
+
+def bench_download(size_mb: float, connections: int, drop_rate: float, rate_mb: float) -> dict[str, Any]:
+  """Run download.py against a local file server in each scenario and check the outcome."""
+  payload = random.Random(0).randbytes(int(size_mb * 1024 * 1024))
+  digest = 'sha256:' + hashlib.sha256(payload).hexdigest()
+  wrong = 'sha256:' + hashlib.sha256(b'not the payload').hexdigest()
+  folder = tempfile.mkdtemp(prefix='joker-bench-')
+  scenarios: dict[str, dict[str, Any]] = {}
+
+  def serve(ranges: bool = True) -> FakeFileServer:
+    return FakeFileServer(payload, ranges, drop_rate, rate_mb * 1024 * 1024).start()
+
+  def fetch(name: str, server: FakeFileServer, expected: str, progress: Any = QuietProgress) -> dict[str, Any]:
+    path = os.path.join(folder, f'{name}.exe')
+    sent, requests, dropped = server.sent, server.requests, server.dropped
+    started = time.perf_counter()
+    error = None
+    try:
+      with contextlib.redirect_stdout(io.StringIO()):
+        download.download(server.url, path, expected, connections=connections, progress=progress)
+    except (download.DownloadError, Interrupted) as e:
+      error = str(e)
+    elapsed = time.perf_counter() - started
+    intact = os.path.exists(path) and download.file_digest(path, 'sha256') == digest[7:]
+    return {
+      'seconds': round(elapsed, 3),
+      'mb_per_s': round(len(payload) / 1048576 / max(elapsed, 1e-9), 1) if error is None else None,
+      'requests': server.requests - requests,
+      'bytes_sent': server.sent - sent,
+      'dropped': server.dropped - dropped,
+      'error': error,
+      'intact': intact,
+      'part_left': os.path.exists(path + '.part')
+    }
+
+  try:
+    server = serve()
+    result = fetch('ranges', server, digest)
+    result['ok'] = result['intact'] and result['error'] is None and result['requests'] > connections
+    scenarios['ranges'] = result
+
+    # Interrupt halfway, then rerun: only the missing half should be fetched again
+    server = serve()
+    first = fetch('resume', server, digest, stop_at(0.5))
+    saved = first['part_left'] and os.path.exists(os.path.join(folder, 'resume.exe.part.json'))
+    second = fetch('resume', server, digest)
+    scenarios['resume'] = {
+      'interrupted': first['error'],
+      'state_saved': saved,
+      **second,
+      'ok': first['error'] is not None and saved and second['intact'] and second['bytes_sent'] < len(payload) * 0.75
+    }
+
+    server = serve(ranges=False)
+    result = fetch('fallback', server, digest)
+    result['ok'] = result['intact'] and result['error'] is None
+    scenarios['fallback'] = result
+
+    server = serve()
+    result = fetch('mismatch', server, wrong)
+    result['ok'] = (result['error'] or '').startswith('Checksum mismatch') and not result['intact'] and not result['part_left']
+    scenarios['mismatch'] = result
+  finally:
+    shutil.rmtree(folder, ignore_errors=True)
+
+  return {
+    'benchmark': 'download',
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'size_mb': size_mb,
+    'connections': connections,
+    'drop_rate': drop_rate,
+    'rate_mb_per_connection': rate_mb,
+    'scenarios': scenarios
+  }
+
+# Text that right-click auto-copy tends to pick up after the question
+COPY_JUNK = ['Copy', 'Select all', 'Share\nReport', 'Next question »', '(1 point)', 'Submit']
+
+def perturb(question: str, rng: random.Random) -> str:
+  """Reformat a question the way repeated copies of it differ: spacing, bullets, option order, junk."""
+  lines = [line.strip() for line in question.splitlines() if line.strip()]
+  head, options = lines[:1], lines[1:]
+  marker = rng.choice(['- ', '• ', '* ', '', None])
+  if marker is not None:
+    options = [marker + strip_label(line) for line in options]
+  rng.shuffle(options)
+  text = rng.choice(['\n', '\n\n', '\n  ']).join(head + options)
+  if rng.random() < 0.5:
+    text = '  ' + text.replace(' ', '  ', 2)
+  if rng.random() < 0.7:
+    text += '\n' + rng.choice(COPY_JUNK)
+  return text
+
+def strip_label(line: str) -> str:
+  """An answer option without its label, e.g. 'b) Paris' -> 'Paris'."""
+  label, _, rest = line.partition(' ')
+  return rest if rest and len(label) <= 3 and label.rstrip('.):').lstrip('(').isalnum() else line
+
+def load_questions(path: str) -> list[tuple[str, str]]:
+  """Read (question, answer) pairs from a history log; later copies of a question are dropped."""
+  pairs: dict[str, tuple[str, str]] = {}
+  with open(path, 'rb') as f:
+    for line in f:
+      try:
+        entry = json.loads(line)
+      except ValueError:
+        continue
+      pairs.setdefault(normalize_message(entry['question']), (entry['question'], entry.get('answer', '')))
+  return list(pairs.values())
+
+def bench_similar(questions: list[tuple[str, str]], thresholds: list[float], variants: int) -> dict[str, Any]:
+  """Measure the near-duplicate index on recorded questions at each threshold.
+
+  Hit rate: reformatted copies (see perturb) that find their original.
+  False positives: reformatted copies that find a different question, and
+  recorded questions that match an earlier, different one whose recorded
+  answer differs (looked up before each is added, as the cache would).
+  """
+  rng = random.Random(1)
+  probes = [(i, perturb(question, rng)) for i, (question, _) in enumerate(questions) for _ in range(variants)]
+  answers = [' '.join(answer.split()).lower() for _, answer in questions]
+  results = []
+  for threshold in thresholds:
+    tracemalloc.start()
+    index = NearDuplicateIndex(threshold, max_entries=len(questions))
+    replay = {'matches': 0, 'conflicting': 0}
+    for i, (question, _) in enumerate(questions):
+      match = index.find(question)
+      if match is not None:
+        replay['matches'] += 1
+        replay['conflicting'] += answers[int(match[0])] != answers[i]
+      index.add(str(i), question)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    hits = wrong = 0
+    samples = []
+    for i, probe in probes:
+      started = time.perf_counter()
+      match = index.find(probe)
+      samples.append((time.perf_counter() - started) * 1000)
+      if match is not None:
+        hits += match[0] == str(i)
+        wrong += match[0] != str(i)
+
+    results.append({
+      'threshold': threshold,
+      'hit_rate': round(hits / max(1, len(probes)), 4),
+      'false_positive_rate': round(wrong / max(1, len(probes)), 4),
+      'recorded_matches': replay['matches'],
+      'recorded_conflicting_answers': replay['conflicting'],
+      'lookup_ms': percentiles(samples),
+      'index_bytes': memory
+    })
+
+  return {
+    'benchmark': 'similar',
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'questions': len(questions),
+    'probes': len(probes),
+    'results': results
+  }
+
+class StubController:
+  """keyboard.Controller stand-in: replayed right-clicks send their copy keystrokes nowhere."""
+
+  def press(self, key: Any) -> None:
+    pass
+
+  def release(self, key: Any) -> None:
+    pass
+
+  @contextlib.contextmanager
+  def pressed(self, *keys: Any) -> Any:
+    yield
+
+class ActionCounter:
+  """Takes main.recorder's place during replay to count the actions that fire."""
+
+  def __init__(self) -> None:
+    self.counts: 'collections.Counter[str]' = collections.Counter()
+
+  def action(self, name: str) -> None:
+    self.counts[name] += 1
+
+  def shown(self) -> None:
+    pass
+
+def stub_backend(latency: float, tokens: int) -> Any:
+  """A generate_response stand-in answering after latency seconds, honouring cancellation."""
+  def generate(message: str, on_token: Any = None, cancellation: Any = None, **options: Any) -> str:
+    if cancellation is not None:
+      if cancellation.event.wait(latency):
+        return ''
+    else:
+      time.sleep(latency)
+    parts = []
+    for i in range(tokens):
+      parts.append(f"tok{i} ")
+      if on_token is not None:
+        on_token(parts[-1])
+    return ''.join(parts)
+  return generate
+
+def synthetic_trace(keystrokes: int, rate: float, pop_every: int) -> tuple[list[tuple[str, str]], list[list]]:
+  """Steady typing at rate keys per second with a right-click copy and key_pop every pop_every keys."""
+  settings = main.load_config(main.config_name)
+  main.hotkeys = main.HotkeyTable(settings.keys)
+  pop_key = encode_key(key_for(main.pop_clipboard))
+  typing = [encode_key(keyboard.KeyCode.from_char(c)) for c in 'the quick brown fox jumps over the lazy dog'
+            if not main.hotkeys.bound(keyboard.KeyCode.from_char(c))]
+  typing += ['Key.space', 'Key.backspace']
+
+  step = 1000 / rate
+  events: list[list] = []
+  for i in range(keystrokes):
+    t = round(i * step, 3)
+    if pop_every and i and i % pop_every == 0:
+      events.append([t, 'c', f"Synthetic question {i}: which option is correct? A) one B) two"])
+      events.append([t, 'm', 500, 400, 'right', True, 0])
+      events.append([t, 'm', 500, 400, 'right', False, 0])
+      events.append([t, 'a', 'pop'])
+      key = pop_key
+    else:
+      key = typing[i % len(typing)]
+    events.append([t, 'p', key, 0])
+    events.append([round(t + step / 2, 3), 'r', key, 0])
+  return list(settings.keys), events
+
+def bench_replay(keys: list[tuple[str, str]], events: list[list], speed: float, latency_ms: float, tokens: int,
+                 late_ms: float, hook_timeout_ms: float) -> dict[str, Any]:
+  """Feed a trace through the listener callbacks and time them.
+
+  A source thread releases events on the trace's schedule (speed times as
+  fast; 0 as fast as possible) into a queue drained by one listener thread,
+  as pynput does. Delivery is how long an event waited for the listener;
+  it is late past late_ms and counted as dropped when it was not handled
+  within hook_timeout_ms, after which Windows stops waiting for a
+  low-level hook. Popup and answer times run from the key press that
+  queued a request. Clipboard events are applied by the source thread.
+  """
+  settings = main.load_config(main.config_name)
+  main.settings = dataclasses.replace(settings, keys=tuple(keys))
+  main.hotkeys = main.HotkeyTable(main.settings.keys)
+  main.cache = None
+  main.history = None
+  main.latest = ''
+  main.disable = False
+  main.generate_response = stub_backend(latency_ms / 1000, tokens)
+  clipboard = BenchClipboard()
+  main.pyperclip = clipboard
+  counter = ActionCounter()
+  main.recorder = counter
+  main.dispatcher = main.Dispatcher(main.process_message, workers=settings.dispatch.workers,
+                                    queue_size=settings.dispatch.queue_size)
+  main.prefetcher = main.Prefetcher(settings.prefetch.wait) if settings.prefetch.enabled else None
+  controller = keyboard.Controller
+  keyboard.Controller = StubController
+
+  callbacks = {'p': ('press', main.on_key_press), 'r': ('release', main.on_key_release), 'm': ('click', main.on_mouse_click)}
+  schedule: list[tuple[float, str, Any]] = []
+  recorded: 'collections.Counter[str]' = collections.Counter()
+  recorded_us: dict[str, list[float]] = {'press': [], 'release': [], 'click': []}
+  for event in sorted(events, key=lambda event: event[0]):
+    t, kind = event[0], event[1]
+    if kind in ('p', 'r'):
+      schedule.append((t, kind, (decode_key(event[2]),)))
+    elif kind == 'm':
+      schedule.append((t, kind, (event[2], event[3], decode_button(event[4]), event[5])))
+    elif kind == 'c':
+      schedule.append((t, kind, event[2]))
+    elif kind == 'a':
+      recorded[event[2]] += 1
+    elif kind == 'u':
+      recorded['(popups)'] += 1
+    if kind in callbacks and event[-1]:
+      recorded_us[callbacks[kind][0]].append(event[-1])
+
+  inputs: 'queue.Queue[Optional[tuple[float, str, tuple]]]' = queue.Queue()
+  lock = threading.Lock()
+  callback_us: dict[str, list[float]] = {'press': [], 'release': [], 'click': []}
+  delivery_ms: list[float] = []
+  popup_ms: list[float] = []
+  answer_ms: list[float] = []
+  # Job.queued_at -> when the key press that submitted it arrived
+  requested: dict[float, float] = {}
+  counts = {'late': 0, 'dropped': 0, 'popups': 0}
+  handling = [0.0]
+
+  def listen() -> None:
+    while True:
+      item = inputs.get()
+      if item is None:
+        return
+      arrived, kind, args = item
+      name, callback = callbacks[kind]
+      started = time.perf_counter()
+      handling[0] = arrived
+      callback(*args)
+      finished = time.perf_counter()
+      callback_us[name].append((finished - started) * 1e6)
+      delivery_ms.append((started - arrived) * 1000)
+      counts['late'] += (started - arrived) * 1000 > late_ms
+      counts['dropped'] += (finished - arrived) * 1000 > hook_timeout_ms
+
+  listener = threading.Thread(target=listen, name='replay-listener', daemon=True)
+
+  submit = main.dispatcher.submit
+  def tracked_submit(message: str, supersede: bool = True, hidden: bool = False) -> Optional[main.Job]:
+    job = submit(message, supersede, hidden)
+    if job is not None and job.callers == 1 and threading.current_thread() is listener:
+      arrived = handling[0]
+      with lock:
+        requested[job.queued_at] = arrived
+      def done(future: Any) -> None:
+        if not future.cancelled() and future.exception() is None:
+          answer_ms.append((time.perf_counter() - arrived) * 1000)
+      job.future.add_done_callback(done)
+    return job
+  main.dispatcher.submit = tracked_submit
+
+  def post_ui(item: Any) -> None:
+    now = time.perf_counter()
+    with lock:
+      counts['popups'] += 1
+      if threading.current_thread() is listener:
+        arrived = handling[0]
+      else:
+        arrived = requested.pop(item[1], None) if isinstance(item, tuple) else None
+    if arrived is not None:
+      popup_ms.append((now - arrived) * 1000)
+  main.post_ui = post_ui
+
+  try:
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+      listener.start()
+      first = schedule[0][0] if schedule else 0
+      started = time.perf_counter()
+      for t, kind, args in schedule:
+        if speed > 0:
+          delay = started + (t - first) / 1000 / speed - time.perf_counter()
+          if delay > 0.001:
+            time.sleep(delay)
+        if kind == 'c':
+          clipboard.copy(args)
+        else:
+          inputs.put((time.perf_counter(), kind, args))
+      inputs.put(None)
+      listener.join()
+      elapsed = time.perf_counter() - started
+
+      # Let requests still in flight finish so their times are counted
+      deadline = time.monotonic() + latency_ms / 1000 * 4 + 5
+      while time.monotonic() < deadline and (main.dispatcher.stats()['inflight'] or main.dispatcher.stats()['depth']):
+        time.sleep(0.01)
+  finally:
+    keyboard.Controller = controller
+    main.recorder = None
+
+  inputs_count = sum(len(samples) for samples in callback_us.values())
+  names = sorted((set(recorded) | set(counter.counts)) - {'(popups)'})
+  return {
+    'benchmark': 'replay',
+    'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    'python': platform.python_version(),
+    'platform': platform.platform(),
+    'speed': speed or 'max',
+    'events': {name: len(samples) for name, samples in callback_us.items()},
+    'trace_seconds': round((schedule[-1][0] - schedule[0][0]) / 1000, 3) if schedule else 0,
+    'replay_seconds': round(elapsed, 3),
+    'events_per_second': round(inputs_count / max(elapsed, 1e-9)),
+    'callback_us': {name: percentiles(samples) for name, samples in callback_us.items()},
+    'recorded_callback_us': {name: percentiles(samples) for name, samples in recorded_us.items() if samples},
+    'delivery_ms': percentiles(delivery_ms),
+    'late': counts['late'],
+    'late_ms': late_ms,
+    'dropped': counts['dropped'],
+    'hook_timeout_ms': hook_timeout_ms,
+    'actions': {name: {'recorded': recorded[name], 'replayed': counter.counts[name]} for name in names},
+    'popups': {'recorded': recorded['(popups)'], 'replayed': counts['popups']},
+    'popup_ms': percentiles(popup_ms),
+    'answer_ms': percentiles(answer_ms),
+    'dispatcher': main.dispatcher.stats()
+  }
+
+def bench_keys(count: int) -> dict[str, Any]:
+  """Measure listener callback cost per keystroke against the configured [key] table.
+
+  Bound actions are swapped for a counter so only dispatch itself is timed.
+  """
+  main.settings = main.load_config(main.config_name)
+  main.hotkeys = main.HotkeyTable(main.settings.keys)
+
+  fired = 0
+  def noop() -> None:
+    nonlocal fired
+    fired += 1
+
+  table = main.hotkeys
+  for entries in (*table.chars.values(), *table.vks.values(), *table.specials.values()):
+    for mask in entries:
+      entries[mask] = noop
+
+  # Mostly ordinary typing, with the occasional modifier chord
+  typing = [keyboard.KeyCode.from_char(c) for c in 'the quick brown fox jumps over the lazy dog']
+  typing += [keyboard.Key.space, keyboard.Key.backspace, keyboard.Key.enter]
+  chord = [keyboard.Key.ctrl_l, keyboard.Key.shift, keyboard.KeyCode.from_char('1')]
+
+  def run(keys: list, rounds: int) -> tuple[float, float]:
+    press_ns = release_ns = 0
+    for _ in range(rounds):
+      for key in keys:
+        started = time.perf_counter_ns()
+        main.on_key_press(key)
+        press_ns += time.perf_counter_ns() - started
+      for key in reversed(keys):
+        started = time.perf_counter_ns()
+        main.on_key_release(key)
+        release_ns += time.perf_counter_ns() - started
+    total = rounds * len(keys)
+    return press_ns / total, release_ns / total
+
+  rounds = max(1, count // len(typing))
+  run(typing, 10)
+  typing_press, typing_release = run(typing, rounds)
+  chord_press, chord_release = run(chord, max(1, count // len(chord)))
+
+  # Unbound keys should not allocate at all
+  tracemalloc.start()
+  before = tracemalloc.take_snapshot()
+  for key in typing * 100:
+    main.on_key_press(key)
+    main.on_key_release(key)
+  after = tracemalloc.take_snapshot()
+  tracemalloc.stop()
+  allocated = sum(stat.size_diff for stat in after.compare_to(before, 'filename')
+                  if stat.traceback[0].filename == main.__file__)
+
+  return {
+    'benchmark': 'keys',
+    'keystrokes': rounds * len(typing),
+    'typing_press_ns': round(typing_press, 1),
+    'typing_release_ns': round(typing_release, 1),
+    'chord_press_ns': round(chord_press, 1),
+    'chord_release_ns': round(chord_release, 1),
+    'unbound_bytes_allocated': allocated,
+    'actions_fired': fired
+  }
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+  parser.add_argument('--latency', type=float, default=200, help="ms before the first byte")
+  parser.add_argument('--jitter', type=float, default=0, help="extra random ms added to latency")
+  parser.add_argument('--token-rate', type=float, default=50, help="tokens per second")
+  parser.add_argument('--tokens', type=int, default=40, help="tokens per answer")
+  parser.add_argument('--chunk-tokens', type=int, default=1, help="tokens per streamed chunk")
+  parser.add_argument('--error-rate', type=float, default=0, help="fraction of requests that fail")
+  parser.add_argument('--error-status', type=int, default=500, help="HTTP status for failed requests")
+
+def server_from(args: argparse.Namespace, port: int = 0) -> FakeOpenAIServer:
+  return FakeOpenAIServer(
+    port=port, latency=args.latency / 1000, jitter=args.jitter / 1000, token_rate=args.token_rate,
+    tokens=args.tokens, chunk_tokens=args.chunk_tokens, error_rate=args.error_rate, error_status=args.error_status
+  )
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Joker benchmarks")
+  commands = parser.add_subparsers(dest='command', required=True)
+
+  keys_parser = commands.add_parser('keys', help="listener callback cost per keystroke")
+  keys_parser.add_argument('--count', type=int, default=200000, help="keystrokes to simulate")
+
+  e2e_parser = commands.add_parser('e2e', help="end-to-end latency against a local stand-in server")
+  e2e_parser.add_argument('--iterations', type=int, default=50, help="key presses to simulate")
+  e2e_parser.add_argument('--no-stream', action='store_true', help="request whole answers instead of streams")
+  e2e_parser.add_argument('--out', help="also write the JSON report to this file")
+  add_server_arguments(e2e_parser)
+
+  route_parser = commands.add_parser('route', help="latency-based routing across several stand-in servers")
+  route_parser.add_argument('--requests', type=int, default=100, help="requests to send")
+  route_parser.add_argument('--latencies', default='50,200,400', help="comma-separated ms before the first byte, one per server")
+  route_parser.add_argument('--error-rates', default='', help="comma-separated fraction of failing requests, one per server")
+
+  similar_parser = commands.add_parser('similar', help="near-duplicate cache hit and false-positive rates")
+  similar_parser.add_argument('--questions', help="history log to replay (default: [history] path)")
+  similar_parser.add_argument('--thresholds', default='0.6,0.7,0.8,0.9', help="comma-separated similarity thresholds")
+  similar_parser.add_argument('--variants', type=int, default=3, help="reformatted copies looked up per question")
+
+  replay_parser = commands.add_parser('replay', help="replay a recorded input trace through the listener callbacks")
+  replay_parser.add_argument('trace', nargs='?', help="trace from main.py --record")
+  replay_parser.add_argument('--synthetic', type=int, default=0, help="replay this many generated keystrokes instead")
+  replay_parser.add_argument('--rate', type=float, default=2000, help="keystrokes per second in the generated trace")
+  replay_parser.add_argument('--pop-every', type=int, default=500, help="right-click copy and key_pop every N generated keystrokes")
+  replay_parser.add_argument('--speed', type=float, default=1, help="replay speed multiplier (0 = as fast as possible)")
+  replay_parser.add_argument('--latency', type=float, default=200, help="stub backend ms before answering")
+  replay_parser.add_argument('--tokens', type=int, default=20, help="tokens per stub answer")
+  replay_parser.add_argument('--late-ms', type=float, default=10, help="delivery delay counted as late")
+  replay_parser.add_argument('--hook-timeout', type=float, default=300, help="ms after which an unhandled event counts as dropped")
+  replay_parser.add_argument('--strict', action='store_true', help="exit 1 if events were dropped or actions differ from the trace")
+  replay_parser.add_argument('--out', help="also write the JSON report to this file")
+
+  download_parser = commands.add_parser('download', help="download.py against a local range-capable file server")
+  download_parser.add_argument('--size', type=float, default=32, help="payload size in MB")
+  download_parser.add_argument('--connections', type=int, default=4, help="parallel range requests")
+  download_parser.add_argument('--drop-rate', type=float, default=0, help="fraction of responses cut off partway")
+  download_parser.add_argument('--rate', type=float, default=0, help="MB/s cap per response (0 = unthrottled)")
+
+  serve_parser = commands.add_parser('serve', help="run the stand-in server until interrupted")
+  serve_parser.add_argument('--port', type=int, default=8000, help="port to listen on")
+  add_server_arguments(serve_parser)
+
+  args = parser.parse_args()
+  if args.command == 'keys':
+    print(json.dumps(bench_keys(args.count), indent=2))
+  elif args.command == 'e2e':
+    report = json.dumps(bench_e2e(args.iterations, not args.no_stream, server_from(args).start()), indent=2)
+    print(report)
+    if args.out:
+      with open(args.out, 'w') as f:
+        f.write(report + '\n')
+  elif args.command == 'route':
+    latencies = [float(value) for value in args.latencies.split(',')]
+    error_rates = [float(value) for value in args.error_rates.split(',')] if args.error_rates else []
+    error_rates += [0.0] * (len(latencies) - len(error_rates))
+    print(json.dumps(bench_route(args.requests, latencies, error_rates), indent=2))
+  elif args.command == 'similar':
+    path = args.questions or main.cache_path(main.config_name, main.load_config(main.config_name).history.path)
+    thresholds = [float(value) for value in args.thresholds.split(',')]
+    print(json.dumps(bench_similar(load_questions(path), thresholds, args.variants), indent=2))
+  elif args.command == 'replay':
+    if args.synthetic:
+      keys, events = synthetic_trace(args.synthetic, args.rate, args.pop_every)
+    elif args.trace:
+      keys, events = read_trace(args.trace)
+    else:
+      parser.error("replay needs a trace file or --synthetic N")
+    result = bench_replay(keys, events, args.speed, args.latency, args.tokens, args.late_ms, args.hook_timeout)
+    report = json.dumps(result, indent=2)
+    print(report)
+    if args.out:
+      with open(args.out, 'w') as f:
+        f.write(report + '\n')
+    mismatched = [name for name, count in result['actions'].items() if count['recorded'] != count['replayed']]
+    if args.strict and (result['dropped'] or mismatched):
+      print(f"Replay check failed: {result['dropped']} dropped, actions differing: {', '.join(mismatched) or 'none'}")
+      sys.exit(1)
+  elif args.command == 'download':
+    result = bench_download(args.size, args.connections, args.drop_rate, args.rate)
+    print(json.dumps(result, indent=2))
+    failed = [name for name, scenario in result['scenarios'].items() if not scenario['ok']]
+    if failed:
+      print(f"Download check failed: {', '.join(failed)}")
+      sys.exit(1)
+  elif args.command == 'serve':
+    server = server_from(args, args.port)
+    print(f"Stand-in OpenAI server on {server.url} (set base_url to this)")
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional
+
+from similar import NearDuplicateIndex
+
+if TYPE_CHECKING:
+  import sqlite3
+
+def normalize_message(message: str) -> str:
+  """Collapse all whitespace runs so reformatted copies share a cache key."""
+  return ' '.join(message.split())
+
+def make_key(model: str, prompt_system: str, prompt_user: str, message: str) -> str:
+  """Build a cache key from everything that shapes the answer."""
+  payload = json.dumps([model, prompt_system, prompt_user, normalize_message(message)])
+  return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class ResponseCache:
+  """Two-tier answer cache: an in-memory LRU plus an optional SQLite file.
+
+  Both tiers honour the same entry, byte and TTL limits. Memory hits are
+  served without touching the disk; disk hits are promoted into memory.
+  With similarity above 0, questions stored since startup are also
+  indexed, and a question that nearly matches one of them (Jaccard
+  similarity of its word shingles at least similarity) gets its answer.
+  """
+
+  def __init__(self, max_entries: int = 256, max_bytes: int = 1048576, ttl: float = 86400,
+               path: Optional[str] = None, similarity: float = 0) -> None:
+    self.max_entries = max_entries
+    self.max_bytes = max_bytes
+    self.ttl = ttl
+    self.entries: 'OrderedDict[str, tuple[str, float]]' = OrderedDict()
+    self.size = 0
+    self.lock = threading.Lock()
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+    self.evictions = 0
+    self.near_hits = 0
+    self.similar = NearDuplicateIndex(similarity, max_entries) if similarity > 0 else None
+    self.db: 'Optional[sqlite3.Connection]' = None
+
+    if path:
+      # Imported here: sqlite3 costs ~13 ms of startup and is only needed to persist
+      import sqlite3 as sqlite
+      self.db = sqlite.connect(path, check_same_thread=False)
+      self.db.execute(
+        'CREATE TABLE IF NOT EXISTS answers ('
+        'key TEXT PRIMARY KEY, answer TEXT NOT NULL, size INTEGER NOT NULL, '
+        'stored_at REAL NOT NULL, used_at REAL NOT NULL)'
+      )
+      self.db.execute('CREATE INDEX IF NOT EXISTS answers_used_at ON answers (used_at)')
+      self._trim_disk(time.time())
+      self.db.commit()
+
+  def get(self, key: str, message: Optional[str] = None, context: str = '') -> Optional[str]:
+    """Return the cached answer for key, or None on a miss or expiry.
+
+    Given the message (and context, everything else key was made from),
+    a near-duplicate question answered in the same context also hits.
+    """
+    with self.lock:
+      answer = self._lookup(key)
+      if answer is None and message is not None and self.similar is not None:
+        match = self.similar.find(message, context)
+        if match is not None and match[0] != key:
+          answer = self._lookup(match[0], near=True)
+          if answer is None:
+            # Its answer expired or was evicted from both tiers
+            self.similar.discard(match[0])
+      if answer is None:
+        self.misses += 1
+      return answer
+
+  def put(self, key: str, answer: str, message: Optional[str] = None, context: str = '') -> None:
+    """Store an answer in both tiers, evicting the least recently used.
+
+    Given the message and context, the question is also indexed for near-duplicate lookups.
+    """
+    if len(answer.encode('utf-8')) > self.max_bytes:
+      return
+
+    if message is not None and self.similar is not None:
+      self.similar.add(key, message, context)
+
+    now = time.time()
+    with self.lock:
+      self._insert(key, answer, now)
+      if self.db is not None:
+        self.db.execute(
+          'INSERT OR REPLACE INTO answers (key, answer, size, stored_at, used_at) VALUES (?, ?, ?, ?, ?)',
+          (key, answer, len(answer.encode('utf-8')), now, now)
+        )
+        self._trim_disk(now)
+        self.db.commit()
+
+  def stats(self) -> dict[str, int]:
+    """Return hit/miss counters and current memory usage."""
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'disk_hits': self.disk_hits,
+        'near_hits': self.near_hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'entries': len(self.entries),
+        'bytes': self.size
+      }
+
+  def close(self) -> None:
+    """Close the on-disk tier, if any."""
+    with self.lock:
+      if self.db is not None:
+        self.db.close()
+        self.db = None
+
+  def _lookup(self, key: str, near: bool = False) -> Optional[str]:
+    now = time.time()
+    entry = self.entries.get(key)
+    if entry is not None:
+      answer, stored_at = entry
+      if self._fresh(stored_at, now):
+        self.entries.move_to_end(key)
+        if near:
+          self.near_hits += 1
+        else:
+          self.hits += 1
+        return answer
+      self._remove(key)
+
+    if self.db is not None:
+      row = self.db.execute('SELECT answer, stored_at FROM answers WHERE key = ?', (key,)).fetchone()
+      if row is not None and self._fresh(row[1], now):
+        self.db.execute('UPDATE answers SET used_at = ? WHERE key = ?', (now, key))
+        self.db.commit()
+        self._insert(key, row[0], row[1])
+        if near:
+          self.near_hits += 1
+        else:
+          self.disk_hits += 1
+        return row[0]
+    return None
+
+  def _fresh(self, stored_at: float, now: float) -> bool:
+    return self.ttl <= 0 or now - stored_at < self.ttl
+
+  def _insert(self, key: str, answer: str, stored_at: float) -> None:
+    if key in self.entries:
+      self._remove(key)
+
+    size = len(answer.encode('utf-8'))
+    if size > self.max_bytes:
+      return
+
+    self.entries[key] = (answer, stored_at)
+    self.size += size
+    while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+      self._remove(next(iter(self.entries)))
+      self.evictions += 1
+
+  def _remove(self, key: str) -> None:
+    answer, _ = self.entries.pop(key)
+    self.size -= len(answer.encode('utf-8'))
+
+  def _trim_disk(self, now: float) -> None:
+    if self.ttl > 0:
+      self.db.execute('DELETE FROM answers WHERE stored_at <= ?', (now - self.ttl,))
+
+    # Drop least recently used rows until both limits hold
+    self.db.execute(
+      'DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY used_at DESC LIMIT -1 OFFSET ?)',
+      (self.max_entries,)
+    )
+    total = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM answers').fetchone()[0]
+    while total > self.max_bytes:
+      row = self.db.execute('SELECT key, size FROM answers ORDER BY used_at LIMIT 1').fetchone()
+      if row is None:
+        break
+      self.db.execute('DELETE FROM answers WHERE key = ?', (row[0],))
+      total -= row[1]
+
+def cache_path(config_file: str, name: str) -> str:
+  """Resolve a data file name (cache, logs) relative to the config file's folder."""
+  if os.path.isabs(name):
+    return name
+  return os.path.join(os.path.dirname(os.path.abspath(config_file)), name)
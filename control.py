@@ -0,0 +1,205 @@
+"""Local control channel to the running instance.
+
+  python control.py ask "Which option is correct? A) ... B) ..." [--stream] [--show]
+  python control.py repop | toggle | stats | reload
+
+The instance listens on 127.0.0.1 and writes "pid port token" to its lock
+file. Each connection sends one JSON request line carrying that token and
+gets JSON reply lines back: zero or more {"delta": ...} while an answer
+streams, then {"ok": true, "result": ...} or {"ok": false, "error": ...}.
+This module only needs the standard library, so a launcher importing it
+starts in milliseconds and reuses the instance's warm client and cache.
+"""
+import argparse
+import hmac
+import json
+import os
+import secrets
+import socket
+import sys
+import threading
+from typing import IO, Any, Callable, Iterator, Optional
+
+# Seconds a client may take to send its request line
+REQUEST_TIMEOUT = 5
+# Seconds a reply write may block on a client that stopped reading
+SEND_TIMEOUT = 30
+# Longest request line accepted, in bytes
+MAX_REQUEST = 4 * 1024 * 1024
+# Requests handled at once; more are turned away as busy
+MAX_CLIENTS = 8
+
+Handler = Callable[[dict, Callable[[dict], None]], Any]
+
+class ControlError(Exception):
+  """Raised by the client when the instance cannot be reached or refuses a request."""
+
+def new_token() -> str:
+  return secrets.token_urlsafe(24)
+
+def restrict(lock: IO[str]) -> None:
+  """Make the lock file readable and writable by its owner only; raises OSError on failure."""
+  if os.name != 'nt':
+    os.fchmod(lock.fileno(), 0o600)
+    return
+
+  import ctypes
+  from ctypes import wintypes
+  advapi32 = ctypes.WinDLL('advapi32', use_last_error=True)
+  kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+  advapi32.ConvertStringSecurityDescriptorToSecurityDescriptorW.argtypes = (
+    wintypes.LPCWSTR, wintypes.DWORD, ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p)
+  advapi32.SetFileSecurityW.argtypes = (wintypes.LPCWSTR, wintypes.DWORD, ctypes.c_void_p)
+  kernel32.LocalFree.argtypes = (ctypes.c_void_p,)
+
+  # Protected DACL (nothing inherited from the folder) with one entry: full access for the owner
+  descriptor = ctypes.c_void_p()
+  if not advapi32.ConvertStringSecurityDescriptorToSecurityDescriptorW('D:P(A;;FA;;;OW)', 1, ctypes.byref(descriptor), None):
+    raise ctypes.WinError(ctypes.get_last_error())
+  try:
+    # 4 is DACL_SECURITY_INFORMATION
+    if not advapi32.SetFileSecurityW(os.path.abspath(lock.name), 4, descriptor):
+      raise ctypes.WinError(ctypes.get_last_error())
+  finally:
+    kernel32.LocalFree(descriptor)
+
+def publish(lock: IO[str], port: int, token: str) -> None:
+  """Record this process, its control port and token in the held lock file.
+
+  The token is as good as a password for the instance's API key, so the
+  file is restricted to its owner first; OSError if that fails.
+  """
+  restrict(lock)
+  lock.seek(0)
+  lock.truncate()
+  lock.write(f"{os.getpid()} {port} {token}\n")
+  lock.flush()
+
+def read_instance(lock_file: str) -> tuple[int, str]:
+  """Return the running instance's control port and token from its lock file."""
+  try:
+    with open(lock_file) as f:
+      _, port, token = f.readline().split()
+    return int(port), token
+  except (OSError, ValueError):
+    raise ControlError("no running instance found")
+
+class ControlServer:
+  """Serves control requests on a localhost port, one thread per connection.
+
+  handlers maps a command to a function taking the request and an emit
+  callback for streamed reply lines; its return value becomes the result.
+  """
+
+  def __init__(self, token: str, handlers: dict[str, Handler]) -> None:
+    self.token = token
+    self.handlers = handlers
+    self.slots = threading.BoundedSemaphore(MAX_CLIENTS)
+    self.server = socket.create_server(('127.0.0.1', 0))
+
+  @property
+  def port(self) -> int:
+    return self.server.getsockname()[1]
+
+  def start(self) -> None:
+    threading.Thread(target=self._accept, name='control', daemon=True).start()
+
+  def _accept(self) -> None:
+    while True:
+      conn, _ = self.server.accept()
+      if not self.slots.acquire(blocking=False):
+        with conn:
+          self._reply(conn, {'ok': False, 'error': 'busy'})
+        continue
+      threading.Thread(target=self._serve, args=(conn,), name='control-client', daemon=True).start()
+
+  def _serve(self, conn: socket.socket) -> None:
+    try:
+      with conn:
+        conn.settimeout(REQUEST_TIMEOUT)
+        try:
+          request = json.loads(conn.makefile('rb').readline(MAX_REQUEST))
+          if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        except (OSError, ValueError) as e:
+          self._reply(conn, {'ok': False, 'error': f"bad request: {e}"})
+          return
+
+        # Constant-time compare so the token cannot be guessed byte by byte
+        if not hmac.compare_digest(str(request.get('token', '')), self.token):
+          self._reply(conn, {'ok': False, 'error': 'bad token'})
+          return
+
+        command = request.get('command')
+        handler = self.handlers.get(command)
+        if handler is None:
+          self._reply(conn, {'ok': False, 'error': f"unknown command '{command}'"})
+          return
+
+        conn.settimeout(SEND_TIMEOUT)
+        try:
+          result = handler(request, lambda line: self._reply(conn, line))
+        except Exception as e:
+          self._reply(conn, {'ok': False, 'error': str(e) or type(e).__name__})
+        else:
+          self._reply(conn, {'ok': True, 'result': result})
+    except OSError as e:
+      print(f"Control client error: {e}")
+    finally:
+      self.slots.release()
+
+  def _reply(self, conn: socket.socket, line: dict) -> None:
+    conn.sendall(json.dumps(line, ensure_ascii=False, default=str).encode('utf-8') + b'\n')
+
+def request(lock_file: str, command: str, timeout: Optional[float] = 120, **fields: Any) -> Iterator[dict]:
+  """Send a command to the running instance and yield its reply lines.
+
+  The last line yielded has an 'ok' key; earlier ones carry 'delta' text.
+  """
+  port, token = read_instance(lock_file)
+  try:
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as conn:
+      conn.sendall(json.dumps({'token': token, 'command': command, **fields}).encode('utf-8') + b'\n')
+      for line in conn.makefile('rb'):
+        reply = json.loads(line)
+        yield reply
+        if 'ok' in reply:
+          return
+  except OSError as e:
+    raise ControlError(f"instance not reachable: {e}")
+  raise ControlError("instance closed the connection")
+
+def send_command(lock_file: str, command: str, on_delta: Optional[Callable[[str], None]] = None, **fields: Any) -> Any:
+  """Send a command and return its result, passing streamed text to on_delta."""
+  for reply in request(lock_file, command, **fields):
+    if 'delta' in reply:
+      if on_delta is not None:
+        on_delta(reply['delta'])
+    elif reply['ok']:
+      return reply['result']
+    else:
+      raise ControlError(reply['error'])
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Control the running Joker instance")
+  parser.add_argument('command', choices=['ask', 'repop', 'toggle', 'stats', 'reload'])
+  parser.add_argument('text', nargs='?', help="question for ask ('-' reads stdin)")
+  parser.add_argument('--stream', action='store_true', help="print the answer as it arrives")
+  parser.add_argument('--show', action='store_true', help="also show the answer in the popup")
+  parser.add_argument('--lock', default='joker.lock', help="lock file of the running instance")
+  args = parser.parse_args()
+
+  fields: dict[str, Any] = {}
+  if args.command == 'ask':
+    fields = {'text': sys.stdin.read() if args.text in (None, '-') else args.text,
+              'stream': args.stream, 'show': args.show}
+  try:
+    write = lambda delta: print(delta, end='', flush=True)
+    result = send_command(args.lock, args.command, write if args.stream else None, **fields)
+  except ControlError as e:
+    print(f"Error: {e}", file=sys.stderr)
+    sys.exit(1)
+  if args.command == 'ask' and args.stream:
+    print()
+  else:
+    print(result if isinstance(result, str) else json.dumps(result, indent=2))
@@ -0,0 +1,301 @@
+"""Resumable, parallel, checksum-verified file downloads for the installer.
+
+  python download.py URL OUT [--digest sha256:HEX] [--connections 4]
+
+The file is streamed to OUT.part. When the server supports HTTP Range
+requests it is fetched in segments over several connections, and progress
+is saved to OUT.part.json so an interrupted download picks up where it
+stopped. The result is checked against the expected digest before it is
+renamed into place, so OUT is either the complete, verified file or untouched.
+"""
+import argparse
+import hashlib
+import json
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Any, Callable, Optional
+
+CHUNK = 64 * 1024
+# Segments are at least this large so small files do not pay for many requests
+MIN_SEGMENT = 1024 * 1024
+TIMEOUT = 30
+RETRIES = 5
+USER_AGENT = 'Joker-Installer'
+
+class DownloadError(Exception):
+  """Raised when a download cannot be completed or fails verification."""
+
+class Progress:
+  """Thread-safe byte counter that prints a throttled one-line progress report."""
+
+  def __init__(self, total: int, done: int = 0, interval: float = 0.2) -> None:
+    self.total = total
+    self.done = done
+    self.resumed = done
+    self.interval = interval
+    self.lock = threading.Lock()
+    self.started = time.monotonic()
+    self.printed = 0.0
+
+  def add(self, count: int) -> None:
+    with self.lock:
+      self.done += count
+      now = time.monotonic()
+      if now - self.printed >= self.interval:
+        self.printed = now
+        self._print(now)
+
+  def finish(self) -> None:
+    with self.lock:
+      self._print(time.monotonic())
+    print()
+
+  def _print(self, now: float) -> None:
+    rate = (self.done - self.resumed) / max(0.001, now - self.started)
+    if self.total:
+      line = f"  {self.done * 100 // self.total:3d}% {self.done / 1048576:.1f}/{self.total / 1048576:.1f} MB"
+    else:
+      line = f"  {self.done / 1048576:.1f} MB"
+    print(f"\r{line}  {rate / 1048576:.1f} MB/s   ", end='', flush=True)
+
+def parse_digest(digest: str) -> tuple[str, str]:
+  """Split 'sha256:HEX' (or bare HEX, taken as sha256) into algorithm and lowercase hex."""
+  algorithm, _, value = digest.strip().rpartition(':')
+  algorithm = algorithm.lower() or 'sha256'
+  if algorithm not in hashlib.algorithms_available:
+    raise DownloadError(f"Unsupported digest algorithm '{algorithm}'")
+  return algorithm, value.lower()
+
+def file_digest(path: str, algorithm: str) -> str:
+  """Return the hex digest of a file."""
+  h = hashlib.new(algorithm)
+  with open(path, 'rb') as f:
+    for block in iter(lambda: f.read(CHUNK * 16), b''):
+      h.update(block)
+  return h.hexdigest()
+
+def open_url(url: str, start: int = 0, end: Optional[int] = None) -> Any:
+  """Open url, asking for bytes start..end (inclusive) when a range is given."""
+  request = urllib.request.Request(url, headers={'User-Agent': USER_AGENT})
+  if start or end is not None:
+    request.add_header('Range', f"bytes={start}-{'' if end is None else end}")
+  return urllib.request.urlopen(request, timeout=TIMEOUT)
+
+def probe(url: str) -> tuple[int, bool]:
+  """Return (size, ranges_supported) from a one-byte range request.
+
+  Size is 0 when the server does not say. Redirects (such as GitHub's to
+  its download host) are followed and keep the Range header.
+  """
+  with open_url(url, 0, 0) as response:
+    if response.status == 206:
+      total = response.headers.get('Content-Range', '').rpartition('/')[2]
+      if total.isdigit():
+        return int(total), True
+    return int(response.headers.get('Content-Length') or 0), False
+
+def retry_delay(attempt: int) -> float:
+  """Jittered exponential backoff between attempts, capped at 30 seconds."""
+  return random.uniform(0.5, 1.0) * min(30.0, 2 ** attempt)
+
+class SegmentedDownload:
+  """Range-request download split into segments shared by several worker threads.
+
+  state holds [start, end, done] per segment (end exclusive) and is saved
+  to the state file as segments progress, so a rerun resumes every segment.
+  """
+
+  def __init__(self, url: str, part_path: str, state_path: str, size: int, connections: int,
+               identity: dict[str, Any]) -> None:
+    self.url = url
+    self.part_path = part_path
+    self.state_path = state_path
+    self.size = size
+    self.connections = max(1, connections)
+    self.identity = identity
+    self.lock = threading.Lock()
+    self.failed: Optional[Exception] = None
+    self.segments = self._load()
+    self.saved = time.monotonic()
+
+  def _load(self) -> list[list[int]]:
+    try:
+      with open(self.state_path) as f:
+        state = json.load(f)
+      if (state.get('identity') == self.identity and os.path.exists(self.part_path)
+          and os.path.getsize(self.part_path) == self.size):
+        return state['segments']
+    except (OSError, ValueError, KeyError):
+      pass
+
+    # Fresh start: preallocate the file so every worker can write at its offset
+    with open(self.part_path, 'wb') as f:
+      f.truncate(self.size)
+    segment = max(MIN_SEGMENT, -(-self.size // (self.connections * 4)))
+    return [[start, min(start + segment, self.size), start] for start in range(0, self.size, segment)]
+
+  def _save(self, force: bool = False) -> None:
+    with self.lock:
+      now = time.monotonic()
+      if not force and now - self.saved < 1:
+        return
+      self.saved = now
+      temp = self.state_path + '.tmp'
+      with open(temp, 'w') as f:
+        json.dump({'identity': self.identity, 'segments': self.segments}, f)
+      os.replace(temp, self.state_path)
+
+  def run(self, progress: Progress) -> None:
+    pending: queue.Queue = queue.Queue()
+    for segment in self.segments:
+      if segment[2] < segment[1]:
+        pending.put(segment)
+
+    workers = [threading.Thread(target=self._worker, args=(pending, progress), name=f'download-{i}', daemon=True)
+               for i in range(min(self.connections, pending.qsize()))]
+    for worker in workers:
+      worker.start()
+    for worker in workers:
+      worker.join()
+    self._save(force=True)
+    if self.failed is not None:
+      raise self.failed
+
+  def _worker(self, pending: queue.Queue, progress: Progress) -> None:
+    # Unbuffered, so bytes counted in the state file have reached the OS even if we crash
+    with open(self.part_path, 'r+b', buffering=0) as f:
+      while self.failed is None:
+        try:
+          segment = pending.get_nowait()
+        except queue.Empty:
+          return
+        try:
+          self._fetch(segment, f, progress)
+        except Exception as e:
+          with self.lock:
+            self.failed = self.failed or e
+
+  def _fetch(self, segment: list[int], f: Any, progress: Progress) -> None:
+    start, end, _ = segment
+    attempt = 0
+    while segment[2] < end:
+      try:
+        with open_url(self.url, segment[2], end - 1) as response:
+          if response.status != 206:
+            raise DownloadError(f"Server ignored the range request (HTTP {response.status})")
+          f.seek(segment[2])
+          while segment[2] < end and self.failed is None:
+            block = response.read(min(CHUNK, end - segment[2]))
+            if not block:
+              break
+            f.write(block)
+            with self.lock:
+              segment[2] += len(block)
+            progress.add(len(block))
+            self._save()
+          if self.failed is not None:
+            return
+          if segment[2] < end:
+            raise ConnectionError("connection closed early")
+      except DownloadError:
+        raise
+      except (OSError, urllib.error.URLError, ConnectionError) as e:
+        attempt += 1
+        if attempt > RETRIES:
+          raise DownloadError(f"Segment at {start:,} failed after {RETRIES} retries: {e}")
+        time.sleep(retry_delay(attempt))
+
+def stream_download(url: str, part_path: str, progress: Progress) -> None:
+  """Fetch url in one response for servers without Range support, restarting on failure."""
+  for attempt in range(RETRIES + 1):
+    progress.done = progress.resumed = 0
+    try:
+      with open_url(url) as response, open(part_path, 'wb') as f:
+        length = int(response.headers.get('Content-Length') or 0)
+        received = 0
+        for block in iter(lambda: response.read(CHUNK), b''):
+          f.write(block)
+          received += len(block)
+          progress.add(len(block))
+        # A dropped connection just ends the body early, so check the length
+        if length and received < length:
+          raise ConnectionError(f"connection closed after {received:,} of {length:,} bytes")
+      return
+    except (OSError, urllib.error.URLError) as e:
+      if attempt == RETRIES:
+        raise DownloadError(f"Download failed after {RETRIES} retries: {e}")
+      time.sleep(retry_delay(attempt + 1))
+
+def download(url: str, path: str, digest: str = '', size: int = 0, connections: int = 4,
+             progress: Callable[[int, int], Progress] = Progress) -> str:
+  """Download url to path, verify it against digest and return the file's sha256.
+
+  digest is 'algorithm:hex' (GitHub's release asset `digest` format);
+  empty skips verification. size, if known, must match what the server
+  reports. Partial data is kept as path.part for the next attempt unless
+  it fails verification.
+  """
+  part_path = path + '.part'
+  state_path = part_path + '.json'
+  algorithm, expected = parse_digest(digest) if digest else ('sha256', '')
+
+  try:
+    total, ranges = probe(url)
+  except (OSError, urllib.error.URLError) as e:
+    raise DownloadError(f"Cannot reach {url}: {e}")
+  if size and total and size != total:
+    raise DownloadError(f"Server reports {total:,} bytes, release metadata says {size:,}")
+  total = total or size
+
+  if ranges and total:
+    identity = {'url': url, 'size': total, 'digest': digest}
+    job = SegmentedDownload(url, part_path, state_path, total, connections, identity)
+    done = sum(segment[2] - segment[0] for segment in job.segments)
+    if done:
+      print(f"  Resuming at {done * 100 // total}%")
+    meter = progress(total, done)
+    try:
+      job.run(meter)
+    finally:
+      meter.finish()
+  else:
+    meter = progress(total, 0)
+    try:
+      stream_download(url, part_path, meter)
+    finally:
+      meter.finish()
+
+  actual = os.path.getsize(part_path)
+  if total and actual != total:
+    raise DownloadError(f"Incomplete download: {actual:,} of {total:,} bytes")
+
+  hexdigest = file_digest(part_path, algorithm)
+  if expected and hexdigest != expected:
+    os.remove(part_path)
+    if os.path.exists(state_path):
+      os.remove(state_path)
+    raise DownloadError(f"Checksum mismatch: expected {algorithm}:{expected}, got {algorithm}:{hexdigest}")
+
+  os.replace(part_path, path)
+  if os.path.exists(state_path):
+    os.remove(state_path)
+  return hexdigest if algorithm == 'sha256' else file_digest(path, 'sha256')
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Resumable, verified download")
+  parser.add_argument('url')
+  parser.add_argument('out')
+  parser.add_argument('--digest', default='', help="expected digest as algorithm:hex, e.g. sha256:...")
+  parser.add_argument('--connections', type=int, default=4, help="parallel range requests (default: 4)")
+  args = parser.parse_args()
+  try:
+    print(f"sha256:{download(args.url, args.out, args.digest, connections=args.connections)}")
+  except DownloadError as e:
+    print(f"Download failed: {e}")
+    sys.exit(1)
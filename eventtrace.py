@@ -0,0 +1,163 @@
+"""Timestamped traces of listener input and the actions it caused.
+
+  python main.py --record trace.jsonl.gz
+  python bench.py replay trace.jsonl.gz [--speed 10]
+
+A trace is JSON lines, gzipped when the name ends in .gz. The first line
+is a header holding the [key] bindings in effect; every other line is one
+event, [ms since start, kind, ...]:
+
+  [t, "p", key, us]                     key press; us is how long the callback took
+  [t, "r", key, us]                     key release
+  [t, "m", x, y, button, pressed, us]   mouse click
+  [t, "c", text]                        clipboard changed
+  [t, "a", action]                      a bound action fired (pop, repop, ...)
+  [t, "u"]                              something was queued for the popup
+
+Keys are a character, "Key.<name>" or "#<vk>"; typed characters that are
+not bound to an action are recorded as "" so the trace holds no typed text.
+Clipboard text is kept, since replaying a question needs it.
+"""
+import gzip
+import json
+import queue
+import threading
+import time
+from typing import IO, Any, Callable, Optional
+
+from pynput import keyboard, mouse
+
+VERSION = 1
+# Seconds between clipboard polls while recording
+CLIPBOARD_POLL = 0.1
+# Seconds between flushes of the trace file
+FLUSH_INTERVAL = 1.0
+
+def open_trace(path: str, mode: str) -> IO[str]:
+  """Open a trace for reading ('r') or writing ('w'), gzipped for .gz names."""
+  if path.endswith('.gz'):
+    return gzip.open(path, mode + 't', encoding='utf-8')
+  return open(path, mode, encoding='utf-8')
+
+def encode_key(key: Any) -> str:
+  """Trace form of a pynput key: 'a', 'a#65', '#65' or 'Key.ctrl_l'."""
+  if isinstance(key, keyboard.KeyCode):
+    if key.char is None:
+      return '' if key.vk is None else f'#{key.vk}'
+    return key.char if key.vk is None else f'{key.char}#{key.vk}'
+  return f'Key.{key.name}'
+
+def decode_key(text: str) -> Any:
+  """The pynput key for encode_key's text; '' gives a key bound to nothing."""
+  if text.startswith('Key.'):
+    return keyboard.Key[text[4:]]
+  if len(text) <= 1:
+    return keyboard.KeyCode(char=text or None)
+  char, _, vk = text.rpartition('#')
+  return keyboard.KeyCode(vk=int(vk), char=char or None)
+
+def decode_button(name: str) -> Any:
+  return getattr(mouse.Button, name, name)
+
+def read_trace(path: str) -> tuple[list[tuple[str, str]], list[list]]:
+  """Return a trace's [key] bindings and its events."""
+  with open_trace(path, 'r') as f:
+    header = json.loads(f.readline())
+    if header.get('version') != VERSION:
+      raise ValueError(f"Unsupported trace version {header.get('version')} in '{path}'")
+    return [tuple(pair) for pair in header['keys']], [json.loads(line) for line in f if line.strip()]
+
+class TraceRecorder:
+  """Writes listener events, clipboard changes and fired actions to a trace file.
+
+  Callbacks only time themselves and queue a tuple; a writer thread encodes
+  and writes, so recording adds next to nothing to the listener's own
+  latency. keep(key) says whether a character key may be written as is
+  (bound keys); paste reads the clipboard, which is polled for changes.
+  """
+
+  def __init__(self, path: str, keys: Any, keep: Callable[[Any], bool], paste: Callable[[], str]) -> None:
+    self.keep = keep
+    self.paste = paste
+    self.started = time.perf_counter()
+    self.events: 'queue.SimpleQueue[Optional[tuple]]' = queue.SimpleQueue()
+    self.file = open_trace(path, 'w')
+    self.file.write(json.dumps({'version': VERSION, 'recorded': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                                'keys': [list(pair) for pair in keys]}) + '\n')
+    self.closed = threading.Event()
+    self.writer = threading.Thread(target=self._write, name='trace-writer', daemon=True)
+    self.writer.start()
+    threading.Thread(target=self._watch_clipboard, name='trace-clipboard', daemon=True).start()
+
+  def wrap_key(self, kind: str, callback: Callable[[Any], None]) -> Callable[[Any], None]:
+    """Return callback recording each call as kind ('p' press, 'r' release)."""
+    def on_key(key: Any) -> None:
+      started = time.perf_counter()
+      try:
+        callback(key)
+      finally:
+        self.events.put((started, kind, key, time.perf_counter() - started))
+    return on_key
+
+  def wrap_click(self, callback: Callable[[int, int, Any, bool], None]) -> Callable[[int, int, Any, bool], None]:
+    """Return a mouse click callback recording each call."""
+    def on_click(x: int, y: int, button: Any, pressed: bool) -> None:
+      started = time.perf_counter()
+      try:
+        callback(x, y, button, pressed)
+      finally:
+        self.events.put((started, 'm', (x, y, button, pressed), time.perf_counter() - started))
+    return on_click
+
+  def action(self, name: str) -> None:
+    self.events.put((time.perf_counter(), 'a', name, None))
+
+  def shown(self) -> None:
+    self.events.put((time.perf_counter(), 'u', None, None))
+
+  def close(self) -> None:
+    """Write out everything queued and close the file."""
+    if not self.closed.is_set():
+      self.closed.set()
+      self.events.put(None)
+      self.writer.join()
+
+  def _watch_clipboard(self) -> None:
+    seen = None
+    while not self.closed.wait(CLIPBOARD_POLL):
+      try:
+        text = self.paste()
+      except Exception:
+        continue
+      if text != seen:
+        seen = text
+        self.events.put((time.perf_counter(), 'c', text, None))
+
+  def _encode(self, started: float, kind: str, value: Any, duration: Optional[float]) -> list:
+    event: list = [round((started - self.started) * 1000, 2), kind]
+    if kind in ('p', 'r'):
+      if isinstance(value, keyboard.KeyCode) and not self.keep(value):
+        value = None
+      event += [encode_key(value) if value is not None else '', round(duration * 1e6)]
+    elif kind == 'm':
+      x, y, button, pressed = value
+      event += [x, y, getattr(button, 'name', str(button)), pressed, round(duration * 1e6)]
+    elif value is not None:
+      event.append(value)
+    return event
+
+  def _write(self) -> None:
+    flushed = time.monotonic()
+    while True:
+      try:
+        item = self.events.get(timeout=FLUSH_INTERVAL)
+      except queue.Empty:
+        item = ()
+      if item is None:
+        break
+      if item:
+        self.file.write(json.dumps(self._encode(*item), ensure_ascii=False) + '\n')
+      if time.monotonic() - flushed >= FLUSH_INTERVAL:
+        self.file.flush()
+        flushed = time.monotonic()
+    self.file.close()
@@ -0,0 +1,61 @@
+import re
+from typing import Optional
+
+# "1. ", "2) ", "Q3: ", "Question 4. " at the start of a line
+QUESTION_START = re.compile(r'\s*(q(?:uestion)?\s*)?(\d{1,3})\s*([.):])\s+(?=\S)', re.IGNORECASE)
+# A lettered (or roman-numeral) answer option on its own line
+OPTION = re.compile(r'^\s*(?:[a-h]|[ivx]{1,4})\s*[.)]\s+\S', re.IGNORECASE | re.MULTILINE)
+
+def split_questions(text: str, max_questions: int = 10) -> list[tuple[str, str]]:
+  """Split text holding several numbered questions into (number, question) pairs.
+
+  Questions are lines starting with consecutive numbers (1, 2, 3, ...) in
+  the style of the first one ("1." then "2.", "Q1:" then "Q2:"). Numbered
+  lines restarting at 1 under a question are its options; when an option's
+  number is also the next question's, the line only starts a question if
+  it ends in '?'. Text before the first question (instructions or a shared
+  passage) is prepended to each question so it can be answered alone.
+  Returns [] unless there are 2 to max_questions questions and every one
+  has a '?' or lettered options; the text is then sent as one prompt.
+  """
+  lines = text.split('\n')
+  starts: list[tuple[int, str]] = []
+  style = expected = None
+  # Numbered options seen so far under the current question
+  listed = 0
+  for i, line in enumerate(lines):
+    match = QUESTION_START.match(line)
+    if match is None:
+      continue
+    prefix, number, delimiter = match.groups()
+    current = ((prefix or '').strip().lower(), delimiter)
+    if style is not None:
+      if current != style:
+        continue
+      if int(number) == listed + 1 and (int(number) != expected or not line.rstrip().endswith('?')):
+        listed += 1
+        continue
+      if int(number) != expected:
+        continue
+    starts.append((i, number))
+    style = current
+    expected = int(number) + 1
+    listed = 0
+
+  if not 2 <= len(starts) <= max_questions:
+    return []
+
+  preamble = '\n'.join(lines[:starts[0][0]]).strip()
+  questions = []
+  for k, (first, number) in enumerate(starts):
+    last = starts[k + 1][0] if k + 1 < len(starts) else len(lines)
+    body = '\n'.join(lines[first:last]).strip()
+    if '?' not in body and not OPTION.search(body):
+      return []
+    questions.append((number, f"{preamble}\n\n{body}" if preamble else body))
+  return questions
+
+def merge_answers(numbers: list[str], answers: list[Optional[str]], pending: str = '…') -> str:
+  """One line per question in the original order; unanswered ones show pending."""
+  return '\n'.join(f"{number}. {' '.join(answer.split()) if answer is not None else pending}"
+                   for number, answer in zip(numbers, answers))
@@ -0,0 +1,152 @@
+import json
+import os
+import struct
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+# One little-endian unsigned 64-bit log offset per entry in the index file
+OFFSET = struct.Struct('<Q')
+
+class AnswerHistory:
+  """Recent question/answer pairs: a fixed-size ring plus an optional append-only log.
+
+  Entry i of the log starts at the offset stored at byte i * 8 of the index
+  file, so any entry is one seek away and nothing but the ring is kept in
+  memory, however long the process runs. A cursor walks back and forth
+  through all entries and jumps to the newest one whenever an answer is added.
+  """
+
+  def __init__(self, size: int = 50, path: Optional[str] = None) -> None:
+    self.size = max(1, size)
+    self.ring: list[Optional[tuple[str, str]]] = [None] * self.size
+    self.count = 0
+    self.cursor = -1
+    self.lock = threading.Lock()
+    self.path = path
+    self.log = None
+    self.index = None
+
+    if path:
+      self.log = open(path, 'ab+')
+      self.index = open(path + '.idx', 'ab+')
+      self._check_index()
+      self.count = self.index.seek(0, os.SEEK_END) // OFFSET.size
+      # Warm the ring with the newest entries from disk
+      for i in range(max(0, self.count - self.size), self.count):
+        self.ring[i % self.size] = self._read(i)
+      self.cursor = self.count - 1
+
+  def add(self, question: str, answer: str) -> None:
+    """Append a pair and point the cursor at it."""
+    with self.lock:
+      if self.log is not None:
+        offset = self.log.seek(0, os.SEEK_END)
+        line = json.dumps({'time': round(time.time()), 'question': question, 'answer': answer}, ensure_ascii=False)
+        self.log.write(line.encode('utf-8') + b'\n')
+        self.log.flush()
+        # The index is written second so a crash in between is caught by _check_index
+        self.index.seek(0, os.SEEK_END)
+        self.index.write(OFFSET.pack(offset))
+        self.index.flush()
+
+      self.ring[self.count % self.size] = (question, answer)
+      self.count += 1
+      self.cursor = self.count - 1
+
+  def step(self, delta: int) -> Optional[tuple[int, int, str, str]]:
+    """Move the cursor by delta and return (position, total, question, answer).
+
+    Positions count from 1. Returns None, leaving the cursor alone, when
+    the move would leave the history.
+    """
+    with self.lock:
+      target = self.cursor + delta
+      if target < self._oldest() or target >= self.count:
+        return None
+
+      question, answer = self._get(target)
+      self.cursor = target
+      return target + 1, self.count, question, answer
+
+  def search(self, prefix: str, limit: int = 10) -> list[tuple[str, str]]:
+    """Return up to limit pairs whose question starts with prefix, newest first."""
+    if self.path:
+      with self.lock:
+        self.log.flush()
+      return search_log(self.path, prefix, limit)
+
+    prefix = ' '.join(prefix.split()).lower()
+    with self.lock:
+      pairs = [self._get(i) for i in range(self.count - 1, self._oldest() - 1, -1)]
+    return [pair for pair in pairs if ' '.join(pair[0].split()).lower().startswith(prefix)][:limit]
+
+  def close(self) -> None:
+    """Close the log and index files, if any."""
+    with self.lock:
+      if self.log is not None:
+        self.log.close()
+        self.index.close()
+        self.log = self.index = None
+
+  def _oldest(self) -> int:
+    return 0 if self.log is not None else max(0, self.count - self.size)
+
+  def _get(self, i: int) -> tuple[str, str]:
+    if i >= self.count - self.size:
+      return self.ring[i % self.size]
+    return self._read(i)
+
+  def _read(self, i: int) -> tuple[str, str]:
+    self.index.seek(i * OFFSET.size)
+    offset, = OFFSET.unpack(self.index.read(OFFSET.size))
+    self.log.seek(offset)
+    entry = json.loads(self.log.readline())
+    return entry['question'], entry['answer']
+
+  def _check_index(self) -> None:
+    """Rebuild the index if it does not end exactly where the log does."""
+    log_size = self.log.seek(0, os.SEEK_END)
+    index_size = self.index.seek(0, os.SEEK_END)
+    if index_size % OFFSET.size == 0:
+      if index_size == 0 and log_size == 0:
+        return
+      if index_size:
+        self.index.seek(index_size - OFFSET.size)
+        offset, = OFFSET.unpack(self.index.read(OFFSET.size))
+        self.log.seek(offset)
+        if offset < log_size and offset + len(self.log.readline()) == log_size:
+          return
+
+    print("Rebuilding history index")
+    offsets = bytearray()
+    self.log.seek(0)
+    offset = 0
+    for line in self.log:
+      if not line.endswith(b'\n'):
+        break
+      offsets += OFFSET.pack(offset)
+      offset += len(line)
+    # Drop a half-written last line so the next entry starts cleanly
+    self.log.truncate(offset)
+    self.index.truncate(0)
+    self.index.write(offsets)
+    self.index.flush()
+
+def search_log(path: str, prefix: str, limit: int = 10) -> list[tuple[str, str]]:
+  """Scan a history log for questions starting with prefix (case and spacing ignored)."""
+  prefix = ' '.join(prefix.split()).lower()
+  matches: 'deque[tuple[str, str]]' = deque(maxlen=max(1, limit))
+  try:
+    with open(path, 'rb') as f:
+      for line in f:
+        try:
+          entry = json.loads(line)
+        except ValueError:
+          continue
+        if ' '.join(entry['question'].split()).lower().startswith(prefix):
+          matches.append((entry['question'], entry['answer']))
+  except FileNotFoundError:
+    return []
+  return list(reversed(matches))
@@ -12,6 +12,8 @@ hiddenimports = [
     'openai',
     'pynput',
     'pyperclip',
+    'tkinter',
+    'tkinter.font',
 ]
 
 # Exclude unnecessary modules to reduce size
@@ -0,0 +1,106 @@
+import hashlib
+import math
+from collections import OrderedDict
+from typing import Callable, Optional
+
+# Space kept free between the popup and the screen edges, in pixels
+MARGIN_RIGHT = 20
+MARGIN_BOTTOM = 40  # Taskbar
+# Text widget padding (padx/pady) on both sides, in pixels
+PADDING = 20
+
+class TextMeasure:
+  """Running measurement of text as it is appended.
+
+  Tracks the widest line and how many rows the text takes once lines
+  wider than wrap_px wrap, without keeping or re-reading the text itself.
+  Word wrapping can add a row here and there; the popup scrolls if so.
+  """
+
+  def __init__(self, measure: Callable[[str], int], wrap_px: int) -> None:
+    self.measure = measure
+    self.wrap_px = max(1, wrap_px)
+    self.widest = 0
+    self.closed_rows = 0
+    self.tail_px = 0
+
+  def extend(self, text: str) -> None:
+    """Account for text appended after everything measured so far."""
+    first, *rest = text.split('\n')
+    if first:
+      self.tail_px += self.measure(first)
+    for line in rest:
+      self.widest = max(self.widest, self.tail_px)
+      self.closed_rows += self._rows(self.tail_px)
+      self.tail_px = self.measure(line) if line else 0
+
+  @property
+  def width_px(self) -> int:
+    return max(self.widest, self.tail_px)
+
+  @property
+  def rows(self) -> int:
+    return self.closed_rows + self._rows(self.tail_px)
+
+  def _rows(self, px: int) -> int:
+    return max(1, math.ceil(px / self.wrap_px))
+
+class PopupLayout:
+  """Popup text area size from real font metrics, memoized per text, font and screen.
+
+  measure returns a string's width in pixels in the popup font; char_width
+  (the width of '0') and line_height convert pixels to the character and
+  line units a Tk Text widget is sized in.
+  """
+
+  def __init__(self, measure: Callable[[str], int], char_width: int, line_height: int, font: str,
+               cache_size: int = 64) -> None:
+    self.measure = measure
+    self.char_width = max(1, char_width)
+    self.line_height = max(1, line_height)
+    self.font = font
+    self.cache_size = cache_size
+    self.sizes: 'OrderedDict[tuple, tuple[int, int, bool]]' = OrderedDict()
+
+  def limits(self, screen_width: int, screen_height: int, x_offset: int, y_offset: int) -> tuple[int, int]:
+    """Return the largest text area that fits on screen, in characters and lines."""
+    max_chars = (screen_width - x_offset - MARGIN_RIGHT - PADDING) // self.char_width
+    max_lines = (screen_height - y_offset - MARGIN_BOTTOM - PADDING) // self.line_height
+    return max(1, max_chars), max(1, max_lines)
+
+  def start(self, screen_width: int, screen_height: int, x_offset: int, y_offset: int) -> TextMeasure:
+    """Begin measuring text that will be appended piece by piece."""
+    max_chars, _ = self.limits(screen_width, screen_height, x_offset, y_offset)
+    return TextMeasure(self.measure, max_chars * self.char_width)
+
+  def fit(self, measured: TextMeasure, screen_width: int, screen_height: int, x_offset: int,
+          y_offset: int) -> tuple[int, int, bool]:
+    """Return (width_in_chars, height_in_lines, scroll) for what was measured.
+
+    The size is capped to the screen; scroll is True when the text is
+    taller than that and needs a scrollbar rather than being clipped.
+    """
+    max_chars, max_lines = self.limits(screen_width, screen_height, x_offset, y_offset)
+    # One spare character keeps the widest line from wrapping early
+    width = min(max(30, math.ceil(measured.width_px / self.char_width) + 1), max_chars)
+    height = min(max(3, measured.rows), max_lines)
+    return width, height, measured.rows > height
+
+  def key(self, text: str, screen_width: int, screen_height: int, x_offset: int, y_offset: int) -> tuple:
+    """Memo key for a whole text shown on a given screen in this font."""
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+    return digest, self.font, screen_width, screen_height, x_offset, y_offset
+
+  def cached(self, key: tuple) -> Optional[tuple[int, int, bool]]:
+    """Return a remembered size, or None."""
+    size = self.sizes.get(key)
+    if size is not None:
+      self.sizes.move_to_end(key)
+    return size
+
+  def remember(self, key: tuple, size: tuple[int, int, bool]) -> None:
+    """Keep a size for key, dropping the least recently used beyond cache_size."""
+    self.sizes[key] = size
+    self.sizes.move_to_end(key)
+    if len(self.sizes) > self.cache_size:
+      self.sizes.popitem(last=False)
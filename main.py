@@ -1,209 +1,1883 @@
-import psutil
-from openai import OpenAI
-import pyperclip
+import time
+startup_started = time.perf_counter()
+
 from pynput import mouse, keyboard
-import configparser
-import tkinter as tk
+import argparse
+import atexit
+import gc
+import importlib
+import importlib.util
+import json
 import sys
 import os
-from typing import Optional
+import queue
+import threading
+from collections import deque
+from types import ModuleType
+from typing import IO, TYPE_CHECKING, Any, Callable, Iterable, Iterator, Optional
+from concurrent.futures import CancelledError, Future
+from cache import ResponseCache, cache_path, make_key, normalize_message
+from metrics import Metrics, serve_metrics, write_summaries
+from history import AnswerHistory, search_log
+from settings import Settings, load_config
+from layout import PopupLayout, TextMeasure
+from tokens import fit_message, token_counter
+from fanout import merge_answers, split_questions
+from policy import backoff_delay, retry_after
+from control import ControlError, ControlServer, new_token, publish, send_command
+from backends import Backend, Router, configured_backends
+from eventtrace import TraceRecorder
+
+if TYPE_CHECKING:
+  from openai import OpenAI
+
+class LazyModule:
+  """Stand-in for a heavy module that is only imported on first attribute access."""
+
+  def __init__(self, name: str) -> None:
+    self.name = name
+    self.module: Optional[ModuleType] = None
+
+  def load(self) -> ModuleType:
+    if self.module is None:
+      started = time.perf_counter()
+      self.module = importlib.import_module(self.name)
+      import_times[self.name] = time.perf_counter() - started
+    return self.module
+
+  def __getattr__(self, attr: str) -> Any:
+    return getattr(self.load(), attr)
+
+# Heavy modules, imported on first use to keep cold start and idle RSS low
+import_times: dict[str, float] = {}
+httpx = LazyModule('httpx')
+openai = LazyModule('openai')
+pyperclip = LazyModule('pyperclip')
+tk = LazyModule('tkinter')
+tkfont = LazyModule('tkinter.font')
 
 # Global state
 latest = ''
 disable = False
 config_name = 'config.ini'
-config: Optional[configparser.ConfigParser] = None
-client: Optional[OpenAI] = None
+lock_name = 'joker.lock'
+settings: Optional[Settings] = None
+# OpenAI clients by (base_url, api_key), all sharing one HTTP pool
+clients: dict[tuple[str, str], 'OpenAI'] = {}
+http_client: Any = None
+client_lock = threading.Lock()
+router: Optional[Router] = None
+router_lock = threading.Lock()
+dispatcher: Optional['Dispatcher'] = None
+prefetcher: Optional['Prefetcher'] = None
+cache: Optional[ResponseCache] = None
+history: Optional[AnswerHistory] = None
+recorder: Optional[TraceRecorder] = None
+last_activity = time.monotonic()
+# Hot-path stages timed for every answer, in milliseconds
+stage_metrics = Metrics(('key_event', 'clipboard', 'request_build', 'api_call', 'first_token', 'tk_render', 'popup_shown'))
+# Items are answers to redisplay (str), fresh answers (str, queued_at) or
+# streams (chunk queue, queued_at);
+# RELEASE_UI asks the UI thread to tear down Tk until the next item arrives
+ui_queue: queue.Queue = queue.Queue()
+ui_thread: Optional[threading.Thread] = None
+ui_built = False
+ui_lock = threading.Lock()
+RELEASE_UI = object()
+# Long answers are inserted this many characters per Tk tick, so the popup
+# appears after the first slice instead of after one huge insert
+LOAD_SLICE = 8192
+
+class Cancellation:
+  """Cancel flag for one request that also aborts its HTTP stream once attached."""
+
+  def __init__(self) -> None:
+    self.lock = threading.Lock()
+    self.event = threading.Event()
+    self.stream: Any = None
+
+  @property
+  def cancelled(self) -> bool:
+    return self.event.is_set()
+
+  def cancel(self) -> None:
+    with self.lock:
+      self.event.set()
+      stream = self.stream
+    if stream is not None:
+      try:
+        stream.close()
+      except Exception:
+        pass
+
+  def attach(self, stream: Any) -> None:
+    """Register the open response stream; closes it at once if already cancelled."""
+    with self.lock:
+      self.stream = stream
+    if self.cancelled:
+      self.cancel()
+
+class CancelGroup:
+  """Cancels a set of child requests together; attach it to their parent's Cancellation."""
+
+  def __init__(self) -> None:
+    self.lock = threading.Lock()
+    self.children: list[Cancellation] = []
+    self.closed = False
+
+  def child(self) -> Cancellation:
+    cancellation = Cancellation()
+    with self.lock:
+      self.children.append(cancellation)
+      closed = self.closed
+    if closed:
+      cancellation.cancel()
+    return cancellation
+
+  def close(self) -> None:
+    with self.lock:
+      self.closed = True
+      children = list(self.children)
+    for cancellation in children:
+      cancellation.cancel()
+
+class Rewrite(str):
+  """A stream chunk that replaces everything shown so far instead of being appended."""
+
+class Job:
+  """One queued generation; every caller asking the same question shares it.
+
+  A hidden job (a prefetch) keeps its popup content and answer back until
+  `reveal` is called, so it can run before anyone asked for it.
+  """
+
+  def __init__(self, message: str, key: str, hidden: bool = False) -> None:
+    self.message = message
+    self.key = key
+    self.queued_at = time.perf_counter()
+    self.callers = 1
+    self.future: Future = Future()
+    self.cancellation = Cancellation()
+    self.lock = threading.Lock()
+    self.revealed = not hidden
+    self.held: Any = None
+    self.answer: Optional[str] = None
+    # Set when generation gave up with an error message instead of an answer
+    self.failed = False
+
+  def present(self, content: Any) -> None:
+    """Queue an answer or chunk stream for the popup, or hold it until reveal."""
+    with self.lock:
+      if not self.revealed:
+        self.held = content
+        return
+    post_ui((content, self.queued_at))
+
+  def finish(self, answer: str) -> bool:
+    """Record the final answer. Returns True if it is visible and should become `latest`."""
+    with self.lock:
+      self.answer = answer
+      return self.revealed
+
+  def reveal(self) -> Optional[str]:
+    """Show a held job from now on. Returns its answer if it already finished."""
+    with self.lock:
+      if self.revealed:
+        return None
+      self.revealed = True
+      self.queued_at = time.perf_counter()
+      held, answer = self.held, self.answer
+    if held is not None:
+      post_ui((held, self.queued_at))
+    return answer
+
+class Dispatcher:
+  """Run generation jobs on a worker pool so the key listener never blocks.
+
+  `submit` only enqueues and returns; when the bounded queue is full the job is
+  dropped and counted instead of stalling the caller. A question that is
+  already queued or running is coalesced onto the existing job, and a new
+  question supersedes (cancels) whatever else is in flight.
+  """
+
+  def __init__(self, handler: Callable[[Job], str], workers: int = 2, queue_size: int = 4) -> None:
+    self.handler = handler
+    self.jobs: 'queue.Queue[Job]' = queue.Queue(maxsize=queue_size)
+    self.inflight: dict[str, Job] = {}
+    self.lock = threading.Lock()
+    self.submitted = 0
+    self.completed = 0
+    self.dropped = 0
+    self.coalesced = 0
+    self.cancelled = 0
+    self.max_depth = 0
+
+    for i in range(max(1, workers)):
+      threading.Thread(target=self._work, name=f'worker-{i}', daemon=True).start()
+
+  def submit(self, message: str, supersede: bool = True, hidden: bool = False) -> Optional[Job]:
+    """Queue a message for generation. Returns None if the queue is full.
+
+    A cancelled job (superseded, or a wasted prefetch) is replaced rather
+    than joined, and a visible caller joining a hidden job reveals it.
+    """
+    key = normalize_message(message)
+    with self.lock:
+      job = self.inflight.get(key)
+      if job is not None and not job.cancellation.cancelled:
+        job.callers += 1
+        self.coalesced += 1
+      else:
+        job = Job(message, key, hidden)
+        try:
+          self.jobs.put_nowait(job)
+        except queue.Full:
+          self.dropped += 1
+          return None
+
+        if supersede:
+          for other in self.inflight.values():
+            if not other.cancellation.cancelled:
+              other.cancellation.cancel()
+              self.cancelled += 1
+          self.inflight.clear()
+
+        self.inflight[key] = job
+        self.submitted += 1
+        self.max_depth = max(self.max_depth, self.jobs.qsize())
+        return job
+
+    if not hidden:
+      answer = job.reveal()
+      if answer is not None:
+        remember(job.message, answer)
+    return job
+
+  def stats(self) -> dict[str, int]:
+    """Return queue depth and job counters."""
+    with self.lock:
+      return {
+        'depth': self.jobs.qsize(),
+        'max_depth': self.max_depth,
+        'inflight': len(self.inflight),
+        'submitted': self.submitted,
+        'completed': self.completed,
+        'dropped': self.dropped,
+        'coalesced': self.coalesced,
+        'cancelled': self.cancelled
+      }
+
+  def _work(self) -> None:
+    while True:
+      job = self.jobs.get()
+      try:
+        # Superseded while still queued: skip without spending a request
+        if job.cancellation.cancelled:
+          job.future.cancel()
+          continue
+
+        job.future.set_running_or_notify_cancel()
+        try:
+          response = self.handler(job)
+        except Exception as e:
+          print(f"Worker error: {e}")
+          job.future.set_exception(e)
+        else:
+          if job.cancellation.cancelled:
+            job.future.set_exception(CancelledError())
+          else:
+            job.future.set_result(response)
+      finally:
+        with self.lock:
+          if self.inflight.get(job.key) is job:
+            del self.inflight[job.key]
+          self.completed += 1
+        self.jobs.task_done()
+
+def acquire_instance_lock(lock_file: str) -> Optional[IO[str]]:
+  """Take an exclusive OS lock on lock_file, or return None if another instance holds it.
+
+  The lock lives as long as the returned handle stays open. The OS drops it
+  when the process exits or crashes, so a leftover file is never stale.
+  """
+  handle = open(lock_file, 'a+')
+  try:
+    if os.name == 'nt':
+      import msvcrt
+      # Lock a byte past the pid/port line so other launches can still read it
+      handle.seek(4096)
+      msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+      import fcntl
+      fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except OSError:
+    handle.close()
+    return None
+
+  return handle
+
+class PopupWindow:
+  """The one response popup, built once and reused for every answer.
+
+  Owns a single Tk interpreter; create it and call every method on the UI
+  thread. Other threads talk to it only through `ui_queue`.
+  """
+
+  def __init__(self) -> None:
+    self.root = tk.Tk()
+    self.root.withdraw()
+
+    self.popup = tk.Toplevel(self.root)
+    self.popup.title("Response")
+    self.popup.overrideredirect(True)
+    self.alpha = settings.window.alpha
+    self.popup.attributes("-alpha", self.alpha)
+    self.popup.attributes("-topmost", True)
+    self.popup.withdraw()
+
+    # Add text widget with wrapping for long responses; the scrollbar is only
+    # packed when an answer is taller than the screen allows
+    self.text_widget = tk.Text(self.popup, wrap=tk.WORD, padx=10, pady=10)
+    self.text_widget.config(state=tk.DISABLED)
+    self.scrollbar = tk.Scrollbar(self.popup, command=self.text_widget.yview)
+    self.text_widget.config(yscrollcommand=self.scrollbar.set)
+    self.text_widget.pack(side=tk.LEFT)
+
+    # Size the text area from the font it actually renders with
+    font = tkfont.Font(root=self.root, font=self.text_widget.cget('font'))
+    self.layout = PopupLayout(font.measure, font.measure('0'), font.metrics('linespace'), repr(sorted(font.actual().items())))
+    self.measured: Optional[TextMeasure] = None
+    self.screen: tuple[int, int, int, int] = (0, 0, 0, 0)
+    self.size: Optional[tuple[int, int, bool]] = None
+    self.position = ''
+    self.size_key: Optional[tuple] = None
+    self.known_size: Optional[tuple[int, int, bool]] = None
+    self.pending = ''
+    self.pending_at = 0
+    self.load_job: Optional[str] = None
 
-def is_running() -> bool:
-  """Check if another instance of this script is already running."""
-  current_pid = os.getpid()
-  parent_pid = os.getppid()
-  file_name = os.path.basename(sys.argv[0])
+    self.hide_job: Optional[str] = None
+    self.stream: Optional['queue.Queue[Optional[str]]'] = None
+    self.stream_queued_at = 0.0
+    self.stream_shown = False
 
-  for proc in psutil.process_iter(['pid', 'name']):
+  def run(self) -> None:
+    """Start polling `ui_queue` and enter the Tk main loop until released."""
+    self.root.after(20, self.poll)
+    self.root.mainloop()
+
+  def poll(self) -> None:
+    """Apply queued answers and stream chunks, then reschedule."""
     try:
-      process_info = proc.info
-      if (process_info['name'] == file_name and 
-          process_info['pid'] not in (current_pid, parent_pid)):
-        return True
-    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-      pass
-
-  return False
-
-def load_config(config_file: str) -> configparser.ConfigParser:
-  """Load and validate configuration from INI file."""
-  if not os.path.exists(config_file):
-    raise FileNotFoundError(f"Configuration file '{config_file}' not found")
-  
-  config = configparser.ConfigParser()
-  config.read(config_file)
-  
-  # Define required sections and their keys
-  required_config = {
-    'key': ['key_exit', 'key_pop', 'key_repop'],
-    'openai': ['api_key', 'model', 'prompt_system', 'prompt_user'],
-    'window': ['alpha', 'display_time', 'position']
-  }
-  
-  # Keys that can be empty
-  optional_keys = {'prompt_system', 'prompt_user'}
-  
-  # Validate required sections and keys
-  for section, keys in required_config.items():
-    if not config.has_section(section):
-      raise ValueError(f"Missing required section '[{section}]' in config file")
-    
-    for key in keys:
-      if not config.has_option(section, key):
-        raise ValueError(f"Missing required key '{key}' in section '[{section}]'")
-      
-      # Only validate non-empty for keys that aren't optional
-      if key not in optional_keys:
-        value = config.get(section, key).strip()
-        if not value:
-          raise ValueError(f"Empty value for '{key}' in section '[{section}]'. Please configure it in {config_file}")
-  
-  return config
+      while True:
+        try:
+          item = ui_queue.get_nowait()
+        except queue.Empty:
+          break
+        if item is RELEASE_UI:
+          self.root.destroy()
+          return
+        self.handle(item)
 
-def calculate_window_dimensions(answer: str, screen_width: int, screen_height: int, position: str) -> tuple[int, int]:
-  """Calculate optimal window dimensions based on content and screen size.
-  
-  Args:
-    answer: The text content to display
-    screen_width: Screen width in pixels
-    screen_height: Screen height in pixels
-    position: Window position string (e.g., "+300+200")
-  
-  Returns:
-    Tuple of (width_in_chars, height_in_lines)
+      if self.stream is not None:
+        self.drain_stream()
+    except Exception as e:
+      print(f"Display error: {e}")
+
+    self.root.after(20, self.poll)
+
+  def handle(self, item: Any) -> None:
+    if isinstance(item, str):
+      self.show(item)
+    elif isinstance(item[0], str):
+      self.show(item[0])
+      stage_metrics.since('popup_shown', item[1])
+    else:
+      self.begin_stream(*item)
+
+  def show(self, answer: str) -> None:
+    """Replace the popup text and (re)start the hide timer."""
+    if not answer:
+      return
+
+    self.stream = None
+    self.set_text(answer)
+    self.reveal()
+    self.schedule_hide()
+
+  def begin_stream(self, chunks: 'queue.Queue[Optional[str]]', queued_at: float) -> None:
+    """Follow a new stream; the popup appears with its first chunk.
+
+    A None chunk ends the stream; display_time only starts counting after it.
+    A Rewrite chunk replaces the text instead of extending it.
+    """
+    self.stream = chunks
+    self.stream_queued_at = queued_at
+    self.stream_shown = False
+
+  def drain_stream(self) -> None:
+    received = []
+    rewrite: Optional[Rewrite] = None
+    finished = False
+    while True:
+      try:
+        chunk = self.stream.get_nowait()
+      except queue.Empty:
+        break
+      if chunk is None:
+        finished = True
+        break
+      if isinstance(chunk, Rewrite):
+        rewrite, received = chunk, []
+      else:
+        received.append(chunk)
+
+    text = (rewrite or '') + ''.join(received)
+    if rewrite is not None and self.stream_shown:
+      self.set_text(text, complete=False)
+      if self.size[2]:
+        self.text_widget.see(tk.END)
+    elif text:
+      if self.stream_shown:
+        self.append_text(text)
+        if self.size[2]:
+          self.text_widget.see(tk.END)
+      else:
+        self.stream_shown = True
+        self.cancel_hide()
+        self.set_text(text, complete=False)
+        self.reveal()
+        stage_metrics.since('popup_shown', self.stream_queued_at)
+        print(f"First token on screen after {(time.perf_counter() - self.stream_queued_at) * 1000:.0f} ms")
+
+    if finished:
+      self.stream = None
+      if self.stream_shown:
+        # Remember the final size so a repop of this answer skips measuring
+        answer = self.text_widget.get("1.0", "end-1c")
+        self.layout.remember(self.layout.key(answer, *self.screen), self.size)
+        self.schedule_hide()
+
+  def set_text(self, answer: str, complete: bool = True) -> None:
+    """Replace the popup text; complete is False for the start of a stream.
+
+    Only the first LOAD_SLICE characters go in right away; the rest follow
+    on later Tk ticks while the popup is already visible.
+    """
+    self.cancel_load()
+    self.text_widget.config(state=tk.NORMAL)
+    self.text_widget.delete("1.0", tk.END)
+    self.text_widget.config(state=tk.DISABLED)
+
+    window = settings.window
+    self.screen = (self.root.winfo_screenwidth(), self.root.winfo_screenheight(), window.x_offset, window.y_offset)
+    self.measured = self.layout.start(*self.screen)
+    self.size_key = self.layout.key(answer, *self.screen) if complete else None
+    self.known_size = self.layout.cached(self.size_key) if complete else None
+
+    self.pending = answer
+    self.pending_at = min(len(answer), LOAD_SLICE)
+    self.append_text(answer[:self.pending_at])
+    self.load_more(schedule_only=True)
+
+  def load_more(self, schedule_only: bool = False) -> None:
+    """Insert the next slice of a long answer and schedule the one after."""
+    self.load_job = None
+    if not schedule_only:
+      end = self.pending_at + LOAD_SLICE
+      self.append_text(self.pending[self.pending_at:end])
+      self.pending_at = end
+
+    if self.pending_at < len(self.pending):
+      self.load_job = self.root.after(1, self.load_more)
+      return
+
+    self.pending = ''
+    self.pending_at = 0
+    if self.size_key is not None and self.known_size is None:
+      self.layout.remember(self.size_key, self.size)
+
+  def cancel_load(self) -> None:
+    if self.load_job is not None:
+      self.root.after_cancel(self.load_job)
+      self.load_job = None
+    self.pending = ''
+    self.pending_at = 0
+
+  def append_text(self, chunk: str) -> None:
+    """Append text and resize the popup to fit everything shown so far.
+
+    Only the new chunk is measured; a remembered size skips measuring.
+    """
+    started = time.perf_counter()
+    self.text_widget.config(state=tk.NORMAL)
+    self.text_widget.insert(tk.END, chunk)
+    self.text_widget.config(state=tk.DISABLED)
+
+    if self.known_size is not None:
+      size = self.known_size
+    else:
+      self.measured.extend(chunk)
+      size = self.layout.fit(self.measured, *self.screen)
+
+    position = settings.window.position
+    if size != self.size or position != self.position:
+      width, height, scroll = size
+      self.text_widget.config(width=width, height=height)
+      if scroll:
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+      else:
+        self.scrollbar.pack_forget()
+
+      # Update window to get actual size, then position it
+      self.popup.update_idletasks()
+      self.popup.geometry(position)
+      self.size = size
+      self.position = position
+    stage_metrics.since('tk_render', started)
+
+  def reveal(self) -> None:
+    # Pick up a reloaded transparency
+    if self.alpha != settings.window.alpha:
+      self.alpha = settings.window.alpha
+      self.popup.attributes("-alpha", self.alpha)
+    self.popup.deiconify()
+    self.popup.lift()
+
+  def schedule_hide(self) -> None:
+    self.cancel_hide()
+    self.hide_job = self.popup.after(settings.window.display_time, self.hide)
+
+  def cancel_hide(self) -> None:
+    if self.hide_job is not None:
+      self.popup.after_cancel(self.hide_job)
+      self.hide_job = None
+
+  def hide(self) -> None:
+    self.hide_job = None
+    self.popup.withdraw()
+
+class ConnectionStats:
+  """Connection setup timings collected from httpcore trace events.
+
+  A request that never reaches `connect_tcp` went out on a pooled
+  connection, so `reused` shows how often API calls found the pool warm.
+  Keep-alive pings open connections too but are counted separately.
   """
-  # Parse position from config (e.g., "+300+200")
-  x_offset = int(position.split('+')[1]) if '+' in position else 300
-  y_offset = int(position.split('+')[2]) if position.count('+') >= 2 else 200
-  
-  # Calculate maximum available dimensions
-  max_width_pixels = screen_width - x_offset - 20  # 20px margin
-  max_height_pixels = screen_height - y_offset - 40  # 40px margin for taskbar
-  
-  # Convert pixels to approximate character/line dimensions
-  # Roughly 8 pixels per character, 20 pixels per line
-  max_width_chars = max_width_pixels // 8
-  max_height_lines = max_height_pixels // 20
-  
-  # Calculate dynamic dimensions based on text
-  lines = answer.split('\n')
-  max_line_length = max(len(line) for line in lines) if lines else 0
-  num_lines = len(lines)
-  
-  # Calculate width (characters) - Min 30, max based on screen size
-  width = min(max(30, max_line_length + 5), max_width_chars)
-  
-  # Calculate height (lines) - Min 3, max based on screen size
-  height = min(max(3, num_lines + 2), max_height_lines)
-  
-  return width, height
 
+  def __init__(self) -> None:
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.pings = 0
+    self.reused = 0
+    self.new_connections = 0
+    self.connect_ms = 0.0
+    self.tls_ms = 0.0
+    self.last: dict[str, Any] = {}
 
-def display_window(answer: str) -> None:
-  """Display a temporary popup window with the response."""
-  if not answer:
-    return
-  
-  root = tk.Tk()
-  root.withdraw()
-
-  popup = tk.Toplevel(root)
-  popup.title("Response")
-  popup.overrideredirect(True)
-  popup.attributes("-alpha", float(config["window"]["alpha"]))
-  popup.attributes("-topmost", True)
-
-  # Get screen dimensions
-  screen_width = root.winfo_screenwidth()
-  screen_height = root.winfo_screenheight()
-  position = config["window"]["position"]
-  
-  # Calculate optimal dimensions
-  width, height = calculate_window_dimensions(answer, screen_width, screen_height, position)
-  
-  # Add text widget with wrapping for long responses
-  text_widget = tk.Text(popup, wrap=tk.WORD, padx=10, pady=10, width=width, height=height)
-  text_widget.insert("1.0", answer)
-  text_widget.config(state=tk.DISABLED)
-  text_widget.pack()
-  
-  # Update window to get actual size, then position it
-  popup.update_idletasks()
-  popup.geometry(position)
+  def on_request(self, request: Any) -> None:
+    timing = {'started': time.perf_counter(), 'connect_ms': 0.0, 'tls_ms': 0.0, 'reused': True}
+    marks: dict[str, float] = {}
+
+    def trace(event: str, info: dict) -> None:
+      if event.endswith('.started'):
+        marks[event[:-8]] = time.perf_counter()
+      elif event == 'connection.connect_tcp.complete':
+        timing['connect_ms'] = (time.perf_counter() - marks['connection.connect_tcp']) * 1000
+        timing['reused'] = False
+      elif event == 'connection.start_tls.complete':
+        timing['tls_ms'] = (time.perf_counter() - marks['connection.start_tls']) * 1000
+
+    request.extensions['trace'] = trace
+    request.extensions['joker_timing'] = timing
+
+  def on_response(self, response: Any) -> None:
+    timing = response.request.extensions.get('joker_timing')
+    if timing is None:
+      return
+
+    headers_ms = (time.perf_counter() - timing['started']) * 1000
+    with self.lock:
+      if not timing['reused']:
+        self.new_connections += 1
+        self.connect_ms += timing['connect_ms']
+        self.tls_ms += timing['tls_ms']
+      if response.request.extensions.get('joker_ping'):
+        self.pings += 1
+        return
+
+      self.requests += 1
+      self.reused += timing['reused']
+      self.last = {
+        'reused': timing['reused'],
+        'connect_ms': round(timing['connect_ms'], 1),
+        'tls_ms': round(timing['tls_ms'], 1),
+        'headers_ms': round(headers_ms, 1),
+        'http_version': response.http_version
+      }
+
+  def stats(self) -> dict[str, Any]:
+    """Return reuse counters, average setup cost and the last request's timings."""
+    with self.lock:
+      fresh = max(1, self.new_connections)
+      return {
+        'requests': self.requests,
+        'pings': self.pings,
+        'new_connections': self.new_connections,
+        'reused': self.reused,
+        'avg_connect_ms': round(self.connect_ms / fresh, 1),
+        'avg_tls_ms': round(self.tls_ms / fresh, 1),
+        'last': dict(self.last)
+      }
+
+connection_stats = ConnectionStats()
+
+def build_http_client() -> Any:
+  """Create the shared, keep-alive HTTP pool used by the OpenAI client."""
+  http = settings.http
+  http2 = http.http2
+  if http2 and importlib.util.find_spec('h2') is None:
+    print("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1")
+    http2 = False
+
+  return openai.DefaultHttpxClient(
+    http2=http2,
+    limits=httpx.Limits(
+      max_connections=http.max_connections,
+      max_keepalive_connections=http.max_keepalive,
+      keepalive_expiry=http.keepalive_expiry
+    ),
+    event_hooks={'request': [connection_stats.on_request], 'response': [connection_stats.on_response]}
+  )
+
+def get_client(backend: Optional[Backend] = None) -> 'OpenAI':
+  """Return the OpenAI client for backend (default: [openai]), creating it on first use."""
+  global http_client
+
+  if backend is None:
+    endpoint = (settings.openai.base_url, settings.openai.api_key)
+  else:
+    endpoint = (backend.base_url, backend.api_key)
+  with client_lock:
+    client = clients.get(endpoint)
+    if client is None:
+      if http_client is None:
+        http_client = build_http_client()
+      client = clients[endpoint] = openai.OpenAI(
+        api_key=endpoint[1],
+        base_url=endpoint[0] or None,
+        http_client=http_client,
+        # generate_response retries within its own deadline instead
+        max_retries=0
+      )
+    return client
+
+def get_router() -> Router:
+  """Return the backend router, creating it on first use and tuning it to [policy]."""
+  global router
+
+  with router_lock:
+    if router is None:
+      router = Router(configured_backends(settings))
+  router.tune(settings.policy.breaker_failures, settings.policy.breaker_cooldown)
+  return router
+
+def keep_warm(interval: float) -> None:
+  """Open the API connections ahead of the first key press and keep them alive.
+
+  Pings go out over the shared pool to every backend, so generate_response
+  finds a pooled connection instead of paying for DNS, TCP and TLS. Released
+  clients are left alone until something else needs them again.
+  """
+  for backend in get_router().backends:
+    get_client(backend)
+  while True:
+    with client_lock:
+      pool = http_client
+      urls = sorted({str(client.base_url) for client in clients.values()})
+
+    for url in urls if pool is not None else []:
+      try:
+        pool.head(url, timeout=10, extensions={'joker_ping': True})
+      except Exception as e:
+        print(f"Keep-alive ping to {url} failed: {e}")
+
+    if interval <= 0:
+      return
+    time.sleep(interval)
+
+def stream_tokens(response: Any) -> Iterator[str]:
+  """Yield content deltas from a raw server-sent-events chat completion.
 
-  display_time = int(config["window"]["display_time"])
+  Reads on past [DONE] to the end of the body so the connection goes back to
+  the pool. The SDK's Stream closes the response at [DONE] instead, which
+  discards the connection and costs a fresh handshake on the next request.
+  """
+  for line in response.iter_lines():
+    if not line.startswith('data:'):
+      continue
+    data = line[5:].strip()
+    if data == '[DONE]':
+      continue
+
+    event = json.loads(data)
+    if event.get('error'):
+      raise RuntimeError(event['error'].get('message') or "An error occurred during streaming")
+    for choice in event.get('choices') or []:
+      token = (choice.get('delta') or {}).get('content')
+      if token:
+        yield token
+
+class HedgeStats:
+  """How often hedging fired, which attempt won and how much time it saved.
+
+  A cancelled primary never reports when it would have finished, so the
+  saving of a hedge win is estimated, conservatively, from the primary's
+  progress and the recent median time from first token to end of answer.
+  """
+
+  def __init__(self) -> None:
+    self.lock = threading.Lock()
+    self.requests = 0
+    self.hedged = 0
+    self.hedge_wins = 0
+    self.saved_ms = 0.0
+    self.tails: 'deque[float]' = deque(maxlen=64)
+
+  def record(self, primary: 'Attempt', winner: 'Attempt', hedged: bool) -> None:
+    with self.lock:
+      self.requests += 1
+      self.hedged += hedged
+      if winner is not primary:
+        self.hedge_wins += 1
+        if self.tails:
+          tail = sorted(self.tails)[len(self.tails) // 2]
+          if primary.first_token_at is None:
+            self.saved_ms += tail
+          else:
+            self.saved_ms += max(0.0, (primary.first_token_at - winner.finished_at) * 1000 + tail)
+      if winner.first_token_at is not None:
+        self.tails.append((winner.finished_at - winner.first_token_at) * 1000)
+
+  def stats(self) -> dict[str, Any]:
+    """Return how often hedging fired and won, and the estimated time saved."""
+    with self.lock:
+      return {
+        'requests': self.requests,
+        'hedged': self.hedged,
+        'hedge_rate': round(self.hedged / max(1, self.requests), 3),
+        'hedge_wins': self.hedge_wins,
+        'saved_ms': round(self.saved_ms, 1),
+        'avg_saved_ms': round(self.saved_ms / max(1, self.hedge_wins), 1)
+      }
+
+hedge_stats = HedgeStats()
+
+class Attempt:
+  """One streamed request in a hedged race, reporting tokens to the race's event queue.
+
+  The outcome is recorded against the attempt's backend. An attempt that
+  lost the race before its first token counts as at least as slow as it was;
+  one the race cut off at its deadline counts as failed.
+  """
+
+  def __init__(self, backend: Backend, request: dict[str, Any], events: queue.Queue) -> None:
+    self.backend = backend
+    self.model = backend.model
+    self.cancellation = Cancellation()
+    self.parts: list[str] = []
+    self.started_at = time.perf_counter()
+    self.first_token_at: Optional[float] = None
+    self.finished_at = 0.0
+    self.error: Optional[Exception] = None
+    self.overtaken = False
+    self.overran = False
+    threading.Thread(target=self._run, args=(backend_request(request, backend), events),
+                     name=f'attempt-{backend.name}', daemon=True).start()
+
+  def _run(self, request: dict[str, Any], events: queue.Queue) -> None:
+    try:
+      client = get_client(self.backend)
+      self.started_at = time.perf_counter()
+      with client.chat.completions.with_streaming_response.create(**request, stream=True) as response:
+        self.cancellation.attach(response)
+        for token in stream_tokens(response):
+          if self.cancellation.cancelled:
+            break
+          if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+          events.put((self, token))
+    except Exception as e:
+      self.error = e
+
+    if self.first_token_at is not None:
+      latency_ms = (self.first_token_at - self.started_at) * 1000
+    else:
+      latency_ms = (time.perf_counter() - self.started_at) * 1000 if self.overtaken else None
+    if self.overran:
+      self.backend.record(False, latency_ms)
+    elif self.cancellation.cancelled:
+      self.backend.release()
+      if latency_ms is not None:
+        self.backend.observe(latency_ms)
+    elif self.error is not None and is_throttled(self.error):
+      self.backend.release()
+    else:
+      self.backend.record(self.error is None or not is_failure(self.error), latency_ms)
+    events.put((self, None))
+
+class HedgedRace:
+  """Send a request to primary and, if no token arrives within delay_ms, a hedge to hedge.
+
+  The first complete answer wins and the other attempt is cancelled. When
+  tokens are shown as they arrive, the first attempt to produce one claims
+  the popup instead, since text already on screen cannot be taken back.
+  The race is attached to a job's Cancellation in place of a stream, so
+  cancelling the job cancels every attempt. With a deadline (a
+  time.monotonic() value) the race ends in TimeoutError once it passes.
+  """
+
+  def __init__(self, request: dict[str, Any], primary: Backend, hedge: Backend, delay_ms: float,
+               deadline: Optional[float] = None) -> None:
+    self.request = request
+    self.primary = primary
+    self.hedge = hedge
+    self.delay = delay_ms / 1000
+    self.deadline = deadline
+    self.events: queue.Queue = queue.Queue()
+    self.attempts: list[Attempt] = []
+    self.lock = threading.Lock()
+    self.closed = False
+    self.first_token_at: Optional[float] = None
+
+  def close(self) -> None:
+    """Cancel every attempt and wake the race so it returns ''."""
+    with self.lock:
+      self.closed = True
+      attempts = list(self.attempts)
+    for attempt in attempts:
+      attempt.cancellation.cancel()
+    self.events.put((None, None))
+
+  def run(self, on_token: Optional[Callable[[str], None]] = None) -> str:
+    """Return the winning answer, or raise the error that ended the race."""
+    started = time.perf_counter()
+    primary = self._start(self.primary)
+    hedge: Optional[Attempt] = None
+    owner: Optional[Attempt] = None
+    hedging = True
+    if primary is None:
+      return ''
+
+    while True:
+      timeout = None
+      if hedging and hedge is None and primary.first_token_at is None:
+        timeout = max(0.0, started + self.delay - time.perf_counter())
+      if self.deadline is not None:
+        left = self.deadline - time.monotonic()
+        if left <= 0:
+          self._overrun()
+        timeout = left if timeout is None else min(timeout, left)
+      try:
+        attempt, token = self.events.get(timeout=timeout)
+      except queue.Empty:
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+          self._overrun()
+        if hedge is not None or primary.first_token_at is not None:
+          continue
+        # The hedge is a request like any other: an open (or probing) breaker turns it away
+        if not self.hedge.breaker.allow():
+          print(f"Hedging: {self.hedge.name} is {self.hedge.breaker.state}, waiting for {primary.backend.name}")
+          hedging = False
+          continue
+        hedge = self._start(self.hedge)
+        if hedge is None:
+          self.hedge.release()
+          return ''
+        print(f"Hedging: no token from {primary.backend.name} after {self.delay * 1000:.0f} ms, "
+              f"asking {hedge.backend.name}")
+        continue
+
+      if attempt is None:
+        return ''
+
+      if token is not None:
+        if self.first_token_at is None:
+          self.first_token_at = attempt.first_token_at
+        attempt.parts.append(token)
+        if on_token is not None:
+          if owner is None:
+            owner = attempt
+            self._cancel_others(owner)
+          if attempt is owner:
+            on_token(token)
+        continue
+
+      # A cancelled loser finishing is expected; anything else ends or continues the race
+      attempt.finished_at = time.perf_counter()
+      if attempt.cancellation.cancelled:
+        continue
+      if attempt.error is not None:
+        if owner is None and any(other is not attempt and not other.finished_at for other in self.attempts):
+          print(f"Hedging: {attempt.backend.name} failed ({attempt.error}), waiting for the other attempt")
+          continue
+        raise attempt.error
+
+      self._cancel_others(attempt)
+      hedge_stats.record(primary, attempt, hedge is not None)
+      return ''.join(attempt.parts)
+
+  def _start(self, backend: Backend) -> Optional[Attempt]:
+    with self.lock:
+      if self.closed:
+        return None
+      attempt = Attempt(backend, self.request, self.events)
+      self.attempts.append(attempt)
+      return attempt
 
-  popup.after(display_time, lambda: (popup.destroy(), root.quit()))
-  root.mainloop()
+  def _overrun(self) -> None:
+    """Cut off every attempt still running as failed and raise TimeoutError."""
+    for attempt in self.attempts:
+      if not attempt.finished_at and not attempt.cancellation.cancelled:
+        attempt.overran = True
+        attempt.cancellation.cancel()
+    raise TimeoutError("no complete answer within the deadline")
 
-def generate_response(message: str) -> str:
-  """Generate AI response using OpenAI API."""
+  def _cancel_others(self, winner: Attempt) -> None:
+    for attempt in self.attempts:
+      if attempt is not winner:
+        attempt.overtaken = True
+        attempt.cancellation.cancel()
+
+def backend_request(request: dict[str, Any], backend: Backend) -> dict[str, Any]:
+  """request as sent to backend: its model, and for servers without OpenAI-only
+  parameters no reasoning_effort and max_tokens in place of max_completion_tokens."""
+  request = dict(request, model=backend.model)
+  if not backend.openai_params:
+    request.pop('reasoning_effort', None)
+    if 'max_completion_tokens' in request:
+      request['max_tokens'] = request.pop('max_completion_tokens')
+  return request
+
+def is_retryable(error: Exception) -> bool:
+  """Whether an error is the API's or the network's and may go away on retry."""
+  if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+    return True
+  status = getattr(error, 'status_code', None)
+  return status is not None and (status in (408, 409, 429) or status >= 500)
+
+def is_failure(error: Exception) -> bool:
+  """Whether an error counts against the backend: one it may recover from, or a deadline overrun."""
+  return isinstance(error, TimeoutError) or is_retryable(error)
+
+def is_throttled(error: Exception) -> bool:
+  """Whether the API turned a request away for rate limits or contention, which says nothing about its health."""
+  return getattr(error, 'status_code', None) in (409, 429)
+
+# What generate_response returns in place of an answer when it gives up
+CLIENT_ERROR = "Error: OpenAI client not initialized"
+GENERATE_ERROR = "Error generating response"
+
+def is_error(answer: str) -> bool:
+  """Whether generate_response's answer is an error, or ends in one after streaming had started."""
+  return answer.startswith((CLIENT_ERROR, GENERATE_ERROR)) or f"\n{GENERATE_ERROR}: " in answer
+
+def generate_response(message: str, on_token: Optional[Callable[[str], None]] = None,
+                      cancellation: Optional[Cancellation] = None, raise_errors: bool = False,
+                      stream: Optional[bool] = None, retries: Optional[int] = None) -> str:
+  """Generate AI response using OpenAI API.
+
+  With `stream` enabled in [openai] (or passed as True) and an `on_token`
+  callback, each chunk is passed to `on_token` as it arrives; the return
+  value is then always the concatenation of everything passed to it. A
+  cancellable request is always streamed so cancelling can abort it
+  mid-answer; it then returns ''. With `hedge_delay` set in [openai] the
+  request is raced against a delayed hedge.
+  With `raise_errors`, API errors are raised instead of returned as text.
+  The message is trimmed to `max_input_tokens` around its question first.
+  Each request must finish within the [policy] deadline; failures the API
+  may recover from are retried with jitter while time is left (up to
+  `retries` times, [policy] retries by default; 0 leaves it to the caller), and a
+  backend that keeps failing is skipped by its circuit breaker. Every
+  attempt goes to the backend currently expected to answer first.
+  """
   if not message or not message.strip():
     return "No text provided"
   
-  if client is None:
-    return "Error: OpenAI client not initialized"
+  try:
+    backends = get_router()
+  except Exception as e:
+    if raise_errors:
+      raise
+    return f"{CLIENT_ERROR}: {e}"
   
+  build_started = time.perf_counter()
+  options = settings.openai
+  model = options.model
+  prompt_system = options.prompt_system
+  prompt_user = options.prompt_user
+
+  # Whole copied pages are cut down to the input budget around the question
+  counter = token_counter(model)
+  original = message
+  message, original_tokens = fit_message(message, options.max_input_tokens, counter)
+
+  # Answers are cached on everything that shapes them; errors never are.
+  # Near-duplicate questions only share answers under the same model and prompts
+  key = make_key(model, prompt_system, prompt_user, message)
+  context = make_key(model, prompt_system, prompt_user, '')
+  if cache is not None:
+    answer = cache.get(key, message, context)
+    if answer is not None:
+      stats = cache.stats()
+      print(f"Cache hit ({stats['hits'] + stats['disk_hits'] + stats['near_hits']} hits, {stats['misses']} misses)")
+      return answer
+
+  show_tokens = on_token is not None and (options.stream if stream is None else stream)
+  hedge_delay = options.hedge_delay
+  stream = show_tokens or cancellation is not None
+  parts = []
+  # Constant text first (system prompt, then prompt_user) so every request
+  # shares the longest possible prefix for provider-side prompt caching
+  request: dict[str, Any] = {
+    'model': model,
+    'messages': [
+      {"role": "system", "content": prompt_system},
+      {"role": "user", "content": f'{prompt_user} {message}'}
+    ]
+  }
+  if options.max_output_tokens > 0:
+    request['max_completion_tokens'] = options.max_output_tokens
+  if options.reasoning_effort:
+    request['reasoning_effort'] = options.reasoning_effort
+  input_tokens = counter.count(prompt_system) + counter.count(f'{prompt_user} {message}')
+  policy = settings.policy
+  deadline = time.monotonic() + policy.deadline if policy.deadline > 0 else None
+  stage_metrics.since('request_build', build_started)
   try:
-    response = client.chat.completions.create(
-      model=config["openai"]["model"], 
-      messages=[
-        {"role": "system", "content": config["openai"]["prompt_system"]},
-        {"role": "user", "content": f'{config["openai"]["prompt_user"]} {message}'}
-      ]
-    )
+    call_started = time.perf_counter()
+    retry = 0
+    backend: Optional[Backend] = None
+    while True:
+      # A retry prefers a different backend when there is one
+      backend = backends.choose(avoid=backend)
+      race: Optional[HedgedRace] = None
+      if deadline is not None:
+        # Connecting and every read share what is left of the deadline
+        remaining = max(0.001, deadline - time.monotonic())
+        request['timeout'] = httpx.Timeout(remaining, connect=min(policy.connect_timeout, remaining))
+
+      first_token_at: Optional[float] = None
+      try:
+        # Client setup is not the backend's latency
+        client = get_client(backend)
+        attempt_started = time.perf_counter()
+        if hedge_delay > 0:
+          def show(token: str) -> None:
+            parts.append(token)
+            on_token(token)
+
+          # The hedge goes to hedge_model if set, else to the next fastest backend
+          if options.hedge_model:
+            hedge = backends.variant(backend, options.hedge_model)
+          else:
+            hedge = backends.runner_up(backend) or backend
+          race = HedgedRace(request, backend, hedge, hedge_delay, deadline)
+          if cancellation is not None:
+            cancellation.attach(race)
+          answer = race.run(show if show_tokens else None)
+          if race.first_token_at is not None:
+            stage_metrics.observe('first_token', (race.first_token_at - call_started) * 1000)
+        elif not stream:
+          response = client.chat.completions.create(**backend_request(request, backend))
+          # content is None when the model returns only a refusal or tool call
+          answer = response.choices[0].message.content or ''
+        else:
+          with client.chat.completions.with_streaming_response.create(**backend_request(request, backend),
+                                                                      stream=True) as response:
+            if cancellation is not None:
+              cancellation.attach(response)
+            for token in stream_tokens(response):
+              if cancellation is not None and cancellation.cancelled:
+                break
+              if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"no complete answer within the {policy.deadline:g}s deadline")
+              if not parts:
+                first_token_at = time.perf_counter()
+                stage_metrics.since('first_token', call_started)
+              parts.append(token)
+              if show_tokens:
+                on_token(token)
+          answer = ''.join(parts)
+      except Exception as e:
+        if cancellation is not None and cancellation.cancelled:
+          # A cancelled half-open probe must not keep the breaker waiting for its outcome
+          backend.release()
+          return ''
+        failed = is_failure(e)
+        # Any reply from the server, even a refusal, shows the backend is up, and
+        # rate limiting is not a failure of the backend; hedged attempts have
+        # recorded their own outcomes
+        if race is None:
+          if is_throttled(e):
+            backend.release()
+          else:
+            backend.record(not failed, (first_token_at - attempt_started) * 1000 if first_token_at else None)
+        # Wait at least as long as the server asked; an overrun has no time left to retry in
+        delay = max(backoff_delay(retry), retry_after(e) or 0)
+        if (not is_retryable(e) or retry >= (policy.retries if retries is None else retries) or (show_tokens and parts)
+            or (deadline is not None and time.monotonic() + delay >= deadline)):
+          raise
+        print(f"Retrying in {delay * 1000:.0f} ms after {backend.name} failed: {e}")
+        parts.clear()
+        if cancellation is not None:
+          if cancellation.event.wait(delay):
+            return ''
+        else:
+          time.sleep(delay)
+        retry += 1
+        continue
+
+      if cancellation is not None and cancellation.cancelled:
+        backend.release()
+      elif race is None:
+        backend.record(True, ((first_token_at or time.perf_counter()) - attempt_started) * 1000)
+      break
+
+    if cancellation is not None and cancellation.cancelled:
+      return ''
 
-    return response.choices[0].message.content
+    stage_metrics.since('api_call', call_started)
+    trimmed = f" (trimmed from {original_tokens})" if message is not original else ''
+    print(f"Tokens{'' if counter.exact else ' (estimated)'}: {input_tokens} in{trimmed}, {counter.count(answer)} out")
+    if cache is not None and answer:
+      cache.put(key, answer, message, context)
+    return answer
   except Exception as e:
-    return f"Error generating response: {e}"
+    if cancellation is not None and cancellation.cancelled:
+      return ''
+    if raise_errors:
+      raise
 
-def on_key_press(key) -> None:
-  """Handle keyboard press events."""
-  global disable, latest
+    error = f"{GENERATE_ERROR}: {e}"
+    if not parts or not show_tokens:
+      return error
+    # Keep the popup consistent with what was already streamed
+    on_token(f"\n{error}")
+    return ''.join(parts) + f"\n{error}"
+
+def answer_each(job: Job, questions: list[tuple[str, str]], concurrency: int) -> str:
+  """Answer numbered questions as separate, concurrent requests and merge them in order.
+
+  The popup opens with the first answer to land and shows one line per
+  question, each filling in as its own answer arrives. Cancelling the job
+  cancels every request still running.
+  """
+  numbers = [number for number, _ in questions]
+  answers: list[Optional[str]] = [None] * len(questions)
+  chunks: 'queue.Queue[Optional[str]]' = queue.Queue()
+  lock = threading.Lock()
+  slots = threading.Semaphore(max(1, concurrency))
+  group = CancelGroup()
+  job.cancellation.attach(group)
+  shown = False
+  print(f"Fan-out: {len(questions)} questions, {max(1, concurrency)} at a time")
+
+  def answer(i: int) -> None:
+    nonlocal shown
+    with slots:
+      if job.cancellation.cancelled:
+        return
+      text = generate_response(questions[i][1], None, group.child())
+    with lock:
+      answers[i] = text
+      if job.cancellation.cancelled:
+        return
+      if not shown:
+        shown = True
+        job.present(chunks)
+      chunks.put(Rewrite(merge_answers(numbers, answers)))
+
+  threads = [threading.Thread(target=answer, args=(i,), name=f'fanout-{i}', daemon=True) for i in range(len(questions))]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  if shown:
+    chunks.put(None)
+  return merge_answers(numbers, answers)
+
+def process_message(job: Job) -> str:
+  """Generate a response on a worker thread and hand it to the UI stage.
+
+  When streaming, the popup is queued as soon as the first token arrives.
+  A superseded job never reaches the popup or `latest`; a hidden one only
+  does once it is revealed.
+  """
+  global last_activity
+
+  last_activity = time.monotonic()
+  chunks: 'queue.Queue[Optional[str]]' = queue.Queue()
+  streaming = False
+
+  def on_token(token: str) -> None:
+    nonlocal streaming
+    if job.cancellation.cancelled:
+      return
+    if not streaming:
+      streaming = True
+      job.present(chunks)
+    chunks.put(token)
+
+  options = settings.fanout
+  questions = split_questions(job.message, options.max_questions) if options.enabled else []
+  if questions:
+    response = answer_each(job, questions, options.concurrency)
+    streaming = True
+  else:
+    response = generate_response(job.message, on_token, job.cancellation)
+    if streaming:
+      chunks.put(None)
+    job.failed = is_error(response)
+
+  if job.cancellation.cancelled:
+    print(f"Cancelled: {job.message[:50]}... (superseded)")
+    return response
+
+  if job.finish(response):
+    remember(job.message, response)
+  if not streaming:
+    job.present(response)
+  return response
+
+def ui_loop() -> None:
+  """Run the persistent popup; all Tk calls stay on this thread.
+
+  After an idle release the thread waits for the next item before building
+  a fresh Tk interpreter, so nothing Tk-related stays resident meanwhile.
+  """
+  global ui_built
+
+  while True:
+    item = ui_queue.get()
+    if item is RELEASE_UI:
+      continue
+
+    window = PopupWindow()
+    ui_built = True
+    window.handle(item)
+    window.run()
+    del window
+    gc.collect()
+
+def post_ui(item: Any) -> None:
+  """Queue an item for the UI thread, starting the thread on first use."""
+  global ui_thread
+
+  with ui_lock:
+    if ui_thread is None:
+      ui_thread = threading.Thread(target=ui_loop, name='ui', daemon=True)
+      ui_thread.start()
+  ui_queue.put(item)
+  if recorder is not None:
+    recorder.shown()
+
+def release_idle_state(idle_release: float) -> None:
+  """Drop the OpenAI client and Tk interpreter after idle_release seconds unused."""
+  global http_client, ui_built
+
+  while True:
+    time.sleep(max(1.0, min(idle_release / 4, 60.0)))
+    if time.monotonic() - last_activity < idle_release:
+      continue
+
+    released = []
+    with client_lock:
+      if clients:
+        for client in clients.values():
+          client.close()
+        clients.clear()
+        http_client = None
+        released.append('client')
+    with ui_lock:
+      if ui_built:
+        ui_built = False
+        ui_queue.put(RELEASE_UI)
+        released.append('ui')
+    if released:
+      gc.collect()
+      print(f"Idle: released {', '.join(released)}")
+
+def config_mtime() -> Optional[int]:
+  """Return the config file's modification time, or None while it is missing."""
+  try:
+    return os.stat(config_name).st_mtime_ns
+  except OSError:
+    return None
+
+reload_lock = threading.Lock()
+
+def reload_config() -> dict[str, list[str]]:
+  """Load config.ini and swap in the new settings snapshot.
+
+  Only what was built from changed fields is rebuilt: the hotkey table for
+  [key], the OpenAI clients for keys, endpoints or pool limits, the backend
+  router for [openai], [backend:NAME] or the fallback model. Everything
+  else is read from the snapshot on use, except sections that size state
+  created at startup; those are reported as needing a restart. Raises,
+  keeping the current settings, if the file is invalid.
+  """
+  global settings, hotkeys, http_client
+
+  with reload_lock:
+    new = load_config(config_name)
+    table = HotkeyTable(new.keys, hotkeys.key_state) if new.keys != settings.keys else None
+
+    old, settings = settings, new
+    rebuilt = []
+    if table is not None:
+      # Modifiers held across the swap stay held
+      table.held = set(hotkeys.held)
+      table.mask = hotkeys.mask
+      table.held_since = hotkeys.held_since
+      hotkeys = table
+      rebuilt.append('hotkeys')
+
+    backends = configured_backends(new)
+    endpoints_changed = ([backend.endpoint for backend in configured_backends(old)]
+                         != [backend.endpoint for backend in backends])
+    if old.http != new.http or endpoints_changed:
+      with client_lock:
+        if clients:
+          clients.clear()
+          http_client = None
+          rebuilt.append('client')
+    if endpoints_changed:
+      with router_lock:
+        if router is not None:
+          router.update(backends)
+          rebuilt.append('backends')
+
+  restart = [f'[{name}]' for name in ('dispatch', 'cache', 'history', 'prefetch', 'metrics')
+             if getattr(old, name) != getattr(new, name)]
+  if (old.startup.preload, old.startup.idle_release) != (new.startup.preload, new.startup.idle_release):
+    restart.append('[startup]')
+  if (old.http.preconnect, old.http.ping_interval) != (new.http.preconnect, new.http.ping_interval):
+    restart.append('[http] preconnect/ping_interval')
+
+  print(f"Config reloaded{' (rebuilt ' + ', '.join(rebuilt) + ')' if rebuilt else ''}")
+  if restart:
+    print(f"Restart to apply changes to {', '.join(restart)}")
+  return {'rebuilt': rebuilt, 'restart': restart}
+
+def watch_config(interval: float, mtime: Optional[int]) -> None:
+  """Reload config.ini whenever it changes.
+
+  mtime is the file's modification time when the current settings were loaded.
+  """
+  while True:
+    time.sleep(interval)
+    current = config_mtime()
+    if current is None or current == mtime:
+      continue
+    mtime = current
+
+    try:
+      reload_config()
+    except Exception as e:
+      print(f"Config reload failed, keeping the previous settings: {e}")
 
-  # Get the key name in a format that matches config
+def resident_memory() -> int:
+  """Return the current resident set size in bytes, or 0 if unknown."""
   try:
-    if hasattr(key, 'char') and key.char:
-      key_name = key.char
+    import psutil
+    return psutil.Process().memory_info().rss
+  except ImportError:
+    return 0
+
+def startup_report() -> None:
+  """Print import timing and RSS after each startup phase, then exit."""
+  global settings, hotkeys
+
+  phases = []
+  def phase(name: str) -> None:
+    phases.append((name, time.perf_counter() - startup_started, resident_memory()))
+
+  phase('module loaded')
+  settings = load_config(config_name)
+  hotkeys = HotkeyTable(settings.keys)
+  phase('config loaded')
+  keyboard_listener = keyboard.Listener(on_press=on_key_press, on_release=on_key_release)
+  mouse_listener = mouse.Listener(on_click=on_mouse_click)
+  keyboard_listener.start()
+  mouse_listener.start()
+  phase('listeners started (idle)')
+  pyperclip.load()
+  phase('pyperclip imported')
+  get_client()
+  phase('openai client created')
+  window = PopupWindow()
+  window.root.update_idletasks()
+  phase('tk popup created')
+  window.root.destroy()
+  for client in clients.values():
+    client.close()
+  clients.clear()
+  gc.collect()
+  phase('client and ui released')
+  keyboard_listener.stop()
+  mouse_listener.stop()
+
+  print(f"{'phase':<28}{'elapsed ms':>12}{'rss MB':>10}")
+  for name, elapsed, rss in phases:
+    print(f"{name:<28}{elapsed * 1000:>12.1f}{rss / 1048576:>10.1f}")
+  print()
+  print(f"{'import':<28}{'ms':>12}")
+  for name, seconds in import_times.items():
+    print(f"{name:<28}{seconds * 1000:>12.1f}")
+
+def open_cache() -> Optional[ResponseCache]:
+  """Create the answer cache from [cache], optionally persisted next to config.ini."""
+  options = settings.cache
+  if not options.enabled:
+    return None
+
+  return ResponseCache(
+    max_entries=options.max_entries,
+    max_bytes=options.max_bytes,
+    ttl=options.ttl,
+    path=cache_path(config_name, options.path) if options.persist else None,
+    similarity=options.similarity
+  )
+
+class Prefetcher:
+  """Start generating as soon as a right-click copy changes the clipboard.
+
+  The answer stays hidden until key_pop claims it. Only the latest prefetch
+  is kept: a newer copy, or key_pop on different text, cancels it and
+  counts it as wasted, as does one that finished with an error.
+  """
+
+  def __init__(self, wait_ms: float) -> None:
+    self.wait = wait_ms / 1000
+    self.lock = threading.Lock()
+    self.copied = threading.Event()
+    self.job: Optional[Job] = None
+    self.started = 0
+    self.hits = 0
+    self.ready_hits = 0
+    self.wasted = 0
+    self.dropped = 0
+    threading.Thread(target=self._watch, name='prefetch', daemon=True).start()
+
+  def trigger(self) -> None:
+    """Note that a copy was just sent; the watcher picks up the new text."""
+    self.copied.set()
+
+  def claim(self, text: str) -> Optional[Job]:
+    """Return the prefetch for text, if one is usable, and stop tracking it."""
+    with self.lock:
+      job, self.job = self.job, None
+    if job is None:
+      return None
+
+    # An errored prefetch is retried as a fresh request rather than shown
+    failed = (job.cancellation.cancelled or job.future.cancelled()
+              or (job.future.done() and (job.future.exception() or job.failed)))
+    if job.key != normalize_message(text) or failed:
+      self._waste(job)
+      return None
+
+    with self.lock:
+      self.hits += 1
+      self.ready_hits += job.future.done()
+    return job
+
+  def stats(self) -> dict[str, int]:
+    """Return prefetch counters; `ready_hits` were finished before key_pop."""
+    with self.lock:
+      return {
+        'started': self.started,
+        'hits': self.hits,
+        'ready_hits': self.ready_hits,
+        'wasted': self.wasted,
+        'dropped': self.dropped
+      }
+
+  def _watch(self) -> None:
+    seen = pyperclip.paste()
+    while True:
+      self.copied.wait()
+      self.copied.clear()
+
+      # The copy lands asynchronously; poll briefly for the new text
+      deadline = time.monotonic() + self.wait
+      text = pyperclip.paste()
+      while text == seen and time.monotonic() < deadline:
+        time.sleep(0.02)
+        text = pyperclip.paste()
+      if text == seen or disable:
+        continue
+
+      seen = text
+      if text.strip():
+        self._prefetch(text)
+
+  def _prefetch(self, text: str) -> None:
+    with self.lock:
+      previous, self.job = self.job, None
+    if previous is not None:
+      self._waste(previous)
+
+    job = dispatcher.submit(text, supersede=False, hidden=True)
+    with self.lock:
+      if job is None:
+        self.dropped += 1
+        return
+      self.job = job
+      self.started += 1
+    print(f"Prefetching: {text[:50]}...")
+
+  def _waste(self, job: Job) -> None:
+    # A job key_pop already shows (coalesced onto the prefetch) is never cancelled
+    if not job.revealed:
+      job.cancellation.cancel()
+    with self.lock:
+      self.wasted += 1
+
+def show_latest() -> bool:
+  """Queue the last answer for display. Returns False if there is none."""
+  global last_activity
+
+  last_activity = time.monotonic()
+  if not latest:
+    print("No previous response to display")
+    return False
+
+  post_ui(latest)
+  return True
+
+def remember(question: str, answer: str) -> None:
+  """Make answer the one key_repop shows and add it to the history."""
+  global latest
+
+  latest = answer
+  if history is not None:
+    history.add(question, answer)
+
+def step_history(delta: int) -> None:
+  """Show the answer delta steps away from the last one shown from history."""
+  global last_activity
+
+  last_activity = time.monotonic()
+  if history is None:
+    print("History is disabled")
+    return
+
+  entry = history.step(delta)
+  if entry is None:
+    print(f"No {'older' if delta < 0 else 'newer'} answer in history")
+    return
+
+  position, total, question, answer = entry
+  print(f"History {position}/{total}: {question[:50]}...")
+  post_ui(answer)
+
+def show_previous() -> None:
+  """Step back through the answer history."""
+  step_history(-1)
+
+def show_next() -> None:
+  """Step forward through the answer history."""
+  step_history(1)
+
+def toggle_disable() -> None:
+  """Switch every other action on or off."""
+  global disable
+
+  disable = not disable
+  print(f"{'Disabled' if disable else 'Active'}")
+
+def pop_clipboard() -> None:
+  """Show the prefetched answer for the clipboard text, or queue a new response."""
+  started = time.perf_counter()
+  copied_text = pyperclip.paste()
+  stage_metrics.since('clipboard', started)
+  if not copied_text:
+    print("No text in clipboard")
+    return
+
+  if prefetcher is not None:
+    job = prefetcher.claim(copied_text)
+    if job is not None:
+      answer = job.reveal()
+      if answer is not None:
+        remember(job.message, answer)
+      print(f"Prefetched: {copied_text[:50]}... ({'ready' if job.future.done() else 'in progress'})")
+      return
+
+  job = dispatcher.submit(copied_text)
+  if job is None:
+    print(f"Busy: request queue is full, dropped ({dispatcher.stats()['dropped']} total)")
+  elif job.callers > 1:
+    print(f"Already processing: {copied_text[:50]}...")
+  else:
+    print(f"Processing: {copied_text[:50]}... (queue depth {dispatcher.stats()['depth']})")
+
+def collect_stats() -> dict[str, Any]:
+  """Return dispatcher, cache, connection, backend and stage counters by section."""
+  stats = {'Queue': dispatcher.stats()}
+  if cache is not None:
+    stats['Cache'] = cache.stats()
+  stats['Connections'] = connection_stats.stats()
+  if router is not None:
+    stats['Backends'] = router.stats()
+  if prefetcher is not None:
+    stats['Prefetch'] = prefetcher.stats()
+  if settings.openai.hedge_delay > 0:
+    stats['Hedging'] = hedge_stats.stats()
+  stats['Stages (ms)'] = stage_metrics.summary()
+  return stats
+
+def show_stats() -> None:
+  """Print dispatcher, cache, connection and backend counters."""
+  for name, values in collect_stats().items():
+    print(f"{name}: {values}")
+
+def control_ask(request: dict, emit: Callable[[dict], None]) -> str:
+  """Answer a control client's question with the warm client and cache.
+
+  With show, the question goes through the dispatcher like key_pop and the
+  answer also pops up; otherwise nothing is shown and, with stream, tokens
+  are sent to the client as they arrive. A client that hangs up mid-stream
+  cancels its request.
+  """
+  global last_activity
+
+  last_activity = time.monotonic()
+  text = str(request.get('text') or '')
+  if request.get('show'):
+    job = dispatcher.submit(text)
+    if job is None:
+      raise RuntimeError("queue full")
+    try:
+      return job.future.result()
+    except CancelledError:
+      raise RuntimeError("superseded by a newer question")
+
+  cancellation = Cancellation()
+  def on_token(token: str) -> None:
+    try:
+      emit({'delta': token})
+    except OSError:
+      cancellation.cancel()
+
+  answer = generate_response(text, on_token if request.get('stream') else None, cancellation,
+                             raise_errors=True, stream=bool(request.get('stream')))
+  if cancellation.cancelled:
+    raise RuntimeError("cancelled")
+  return answer
+
+def control_toggle(request: dict, emit: Callable[[dict], None]) -> dict[str, bool]:
+  toggle_disable()
+  return {'disabled': disable}
+
+# Commands served to other processes over the control socket (see control.py)
+CONTROL_COMMANDS: dict[str, Callable[[dict, Callable[[dict], None]], Any]] = {
+  'ask': control_ask,
+  'repop': lambda request, emit: 'ok' if show_latest() else 'no previous response',
+  'toggle': control_toggle,
+  'stats': lambda request, emit: collect_stats(),
+  'reload': lambda request, emit: reload_config()
+}
+
+# Actions that can be bound in [key] as key_<name>
+ACTIONS: dict[str, Callable[[], Any]] = {
+  'exit': toggle_disable,
+  'pop': pop_clipboard,
+  'repop': show_latest,
+  'prev': show_previous,
+  'next': show_next,
+  'stats': show_stats
+}
+ACTION_NAMES = {action: name for name, action in ACTIONS.items()}
+
+# Modifier bits for chords; left/right variants count as the same modifier
+MODIFIERS = {'ctrl': 1, 'shift': 2, 'alt': 4, 'cmd': 8}
+MODIFIER_ALIASES = {'control': 'ctrl', 'win': 'cmd', 'super': 'cmd', 'alt_gr': 'alt'}
+# Seconds a modifier may stay down with no key pressed before its release is assumed lost
+STUCK_MODIFIER = 10
+
+def windows_key_state() -> Optional[Callable[[int], int]]:
+  """GetAsyncKeyState on Windows (bit 0x8000 set while a virtual key is down), else None."""
+  if os.name != 'nt':
+    return None
+  import ctypes
+  get_state = ctypes.windll.user32.GetAsyncKeyState
+  get_state.argtypes = (ctypes.c_int,)
+  get_state.restype = ctypes.c_short
+  return get_state
+
+def split_bindings(value: str) -> list[str]:
+  """Split a comma-separated list of bindings; a comma alone or after a modifier's '+' is the comma key itself."""
+  bindings = []
+  current = ''
+  for char in value:
+    binding = current.strip()
+    # '+' alone and 'ctrl++' are complete bindings of the plus key
+    literal = not binding or (binding.endswith('+') and binding != '+' and not binding.endswith('++'))
+    if char == ',' and not literal:
+      bindings.append(binding)
+      current = ''
     else:
-      # For special keys, format as "Key.name"
-      key_name = f"Key.{key.name}" if hasattr(key, 'name') else str(key)
-  except AttributeError:
-    key_name = str(key)
-  
-  # Cache config keys to avoid repeated dictionary access
-  key_exit = config["key"]["key_exit"]
-  key_pop = config["key"]["key_pop"]
-  key_repop = config["key"]["key_repop"]
-  
-  if key_name == key_exit:
-    disable = not disable
-    print(f"{'Disabled' if disable else 'Active'}")
-  elif key_name == key_pop and not disable:
-    copied_text = pyperclip.paste()
-    if copied_text:
-      print(f"Processing: {copied_text[:50]}...")
-      response = generate_response(copied_text)
-      latest = response
-      display_window(response)
+      current += char
+  if current.strip():
+    bindings.append(current.strip())
+  return bindings
+
+class HotkeyTable:
+  """The [key] bindings compiled into lookups keyed by what pynput delivers.
+
+  Character keys are matched on `KeyCode.char`, falling back to the Windows
+  virtual-key code when a modifier changes the character; special keys are
+  matched on the `Key` member itself. Each entry maps a modifier mask to an
+  action, so looking up an unbound key allocates nothing.
+
+  A modifier release is never delivered when the desktop switches away
+  mid-chord (Win+L, Ctrl+Alt+Del, an elevated window), so before a key is
+  matched under a modifier, key_state (windows_key_state) is asked whether
+  it is really down; without key_state, modifiers held STUCK_MODIFIER
+  seconds are dropped.
+  """
+
+  def __init__(self, bindings: Iterable[tuple[str, str]], key_state: Optional[Callable[[int], int]] = None) -> None:
+    self.chars: dict[str, dict[int, Callable[[], Any]]] = {}
+    self.vks: dict[int, dict[int, Callable[[], Any]]] = {}
+    self.specials: dict[keyboard.Key, dict[int, Callable[[], Any]]] = {}
+    self.modifiers: dict[keyboard.Key, int] = {}
+    self.held: set[keyboard.Key] = set()
+    self.mask = 0
+    self.key_state = key_state
+    self.held_since = 0.0
+
+    for key in keyboard.Key:
+      name = MODIFIER_ALIASES.get(key.name, key.name.split('_')[0])
+      if name in MODIFIERS:
+        self.modifiers[key] = MODIFIERS[name]
+
+    for option, value in bindings:
+      if not option.startswith('key_'):
+        continue
+      action = ACTIONS.get(option[4:])
+      if action is None:
+        raise ValueError(f"Unknown action '{option}' in section '[key]'. Available: "
+                         f"{', '.join('key_' + name for name in ACTIONS)}")
+      for binding in split_bindings(value):
+        self.bind(binding, action)
+
+  def bind(self, binding: str, action: Callable[[], Any]) -> None:
+    """Add a binding such as `1`, `Key.f2` or `ctrl+shift+1`."""
+    # A trailing '+' is the plus key itself, e.g. 'ctrl++'
+    if binding == '+':
+      modifiers, name = [], '+'
+    elif binding.endswith('++'):
+      modifiers, name = binding[:-2].split('+'), '+'
+    else:
+      *modifiers, name = binding.split('+')
+
+    mask = 0
+    for modifier in modifiers:
+      modifier = modifier.strip().lower()
+      modifier = MODIFIER_ALIASES.get(modifier, modifier)
+      if modifier not in MODIFIERS:
+        raise ValueError(f"Unknown modifier '{modifier}' in key binding '{binding}'")
+      mask |= MODIFIERS[modifier]
+
+    name = name.strip()
+    if name.startswith('Key.'):
+      try:
+        key = keyboard.Key[name[4:]]
+      except KeyError:
+        raise ValueError(f"Unknown special key '{name}' in key binding '{binding}'")
+      self.specials.setdefault(key, {})[mask] = action
+    elif len(name) == 1:
+      for char in {name, name.lower(), name.upper()}:
+        self.chars.setdefault(char, {})[mask] = action
+        # Typed symbols like '!' need shift on most layouts
+        if not name.isalnum():
+          self.chars[char][mask | MODIFIERS['shift']] = action
+      if name.isascii() and name.isalnum():
+        self.vks.setdefault(ord(name.upper()), {})[mask] = action
     else:
-      print("No text in clipboard")
-  elif key_name == key_repop and not disable:
-    if latest:
-      display_window(latest)
+      raise ValueError(f"Invalid key binding '{binding}': use a single character or Key.<name>")
+
+  def press(self, key: Any) -> Optional[Callable[[], Any]]:
+    """Track modifiers and return the action bound to key, if any."""
+    if self.mask and key not in self.modifiers:
+      self.drop_stuck()
+
+    if isinstance(key, keyboard.KeyCode):
+      bound = self.chars.get(key.char)
+      action = bound.get(self.mask) if bound is not None else None
+      if action is None and self.mask:
+        bound = self.vks.get(key.vk)
+        action = bound.get(self.mask) if bound is not None else None
+      return action
+
+    bound = self.specials.get(key)
+    action = bound.get(self.mask) if bound is not None else None
+
+    bit = self.modifiers.get(key)
+    if bit is not None:
+      self.held.add(key)
+      self.mask |= bit
+      self.held_since = time.monotonic()
+    return action
+
+  def drop_stuck(self) -> None:
+    """Forget held modifiers whose release was lost."""
+    if self.key_state is not None:
+      stuck = [key for key in self.held
+               if getattr(key.value, 'vk', None) is not None and not self.key_state(key.value.vk) & 0x8000]
+    elif time.monotonic() - self.held_since > STUCK_MODIFIER:
+      stuck = list(self.held)
     else:
-      print("No previous response to display")
+      return
+    for key in stuck:
+      self.release(key)
+
+  def bound(self, key: Any) -> bool:
+    """Whether any binding uses this character key."""
+    return key.char in self.chars or key.vk in self.vks
+
+  def release(self, key: Any) -> None:
+    """Forget a released modifier."""
+    if not isinstance(key, keyboard.KeyCode) and key in self.held:
+      self.held.discard(key)
+      self.mask = 0
+      for held in self.held:
+        self.mask |= self.modifiers[held]
+
+hotkeys: Optional[HotkeyTable] = None
+
+def on_key_press(key) -> None:
+  """Handle keyboard press events."""
+  action = hotkeys.press(key)
+  if action is None:
+    return
+
+  if disable and action is not toggle_disable:
+    return
+
+  if recorder is not None:
+    recorder.action(ACTION_NAMES[action])
+  started = time.perf_counter()
+  action()
+  stage_metrics.since('key_event', started)
 
 def on_key_release(key) -> None:
   """Handle keyboard release events."""
-  pass
+  hotkeys.release(key)
 
 def on_mouse_click(x: int, y: int, button, pressed: bool) -> None:
   """Handle mouse click events - auto-copy on right-click."""
@@ -212,31 +1886,168 @@ def on_mouse_click(x: int, y: int, button, pressed: bool) -> None:
     with keyboard_controller.pressed(keyboard.Key.ctrl):
       keyboard_controller.press('c')
       keyboard_controller.release('c')
+    if prefetcher is not None:
+      prefetcher.trigger()
 
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Joker AI assistant")
+  parser.add_argument('--repop', action='store_true', help="show the last response in the running instance")
+  parser.add_argument('--ask', metavar='TEXT', help="answer TEXT ('-' reads stdin) in the running instance and print it")
+  parser.add_argument('--stream', action='store_true', help="with --ask, print the answer as it arrives")
+  parser.add_argument('--toggle', action='store_true', help="toggle disable in the running instance")
+  parser.add_argument('--stats', action='store_true', help="print the running instance's counters")
+  parser.add_argument('--reload', action='store_true', help="make the running instance reload config.ini")
+  parser.add_argument('--startup-report', action='store_true', help="print import timing and RSS per startup phase and exit")
+  parser.add_argument('--history', metavar='PREFIX', help="print logged answers whose question starts with PREFIX and exit")
+  parser.add_argument('--batch', metavar='INPUT', help="answer a JSONL file of questions instead of listening for keys")
+  parser.add_argument('--out', default='answers.jsonl', help="where --batch writes answers (default: answers.jsonl)")
+  parser.add_argument('--concurrency', type=int, default=4, help="requests in flight in --batch mode (default: 4)")
+  parser.add_argument('--rate', type=float, default=0, help="max requests per second in --batch mode (default: unlimited)")
+  parser.add_argument('--burst', type=float, default=1, help="requests allowed at once before --rate applies (default: 1)")
+  parser.add_argument('--record', metavar='TRACE', help="record key, mouse and clipboard events and the actions they fire to TRACE")
+  args = parser.parse_args()
+
+  if args.startup_report:
+    startup_report()
+    sys.exit(0)
+
+  if args.history is not None:
+    try:
+      settings = load_config(config_name)
+      path = cache_path(config_name, settings.history.path)
+      for question, answer in search_log(path, args.history):
+        print(f"Q: {question}\nA: {answer}\n")
+    except Exception as e:
+      print(f"Fatal error: {e}")
+      sys.exit(1)
+    sys.exit(0)
+
+  # Batch mode shares the prompt settings and cache but not the hotkey daemon
+  if args.batch:
+    try:
+      settings = load_config(config_name)
+      cache = open_cache()
+      from batch import run_batch, should_retry
+      # Retries happen in one place: the batch waits out failures across the whole run
+      counts = run_batch(lambda question: generate_response(question, raise_errors=True, retries=0), args.batch, args.out,
+                         concurrency=args.concurrency, rate=args.rate, burst=args.burst,
+                         retryable=lambda e: should_retry(e) or is_retryable(e))
+    except Exception as e:
+      print(f"Fatal error: {e}")
+      sys.exit(1)
+    sys.exit(1 if counts['failed'] else 0)
+
+  # Drive the running instance over its control socket instead of starting one
+  command = next((name for name in ('toggle', 'stats', 'reload') if getattr(args, name)), None)
+  if args.ask is not None or command:
+    fields = {}
+    if args.ask is not None:
+      command = 'ask'
+      fields = {'text': sys.stdin.read() if args.ask == '-' else args.ask, 'stream': args.stream}
+    try:
+      write = lambda delta: print(delta, end='', flush=True)
+      result = send_command(lock_name, command, write if args.stream else None, **fields)
+    except ControlError as e:
+      print(f"Error: {e}")
+      sys.exit(1)
+    print('' if args.stream else result if isinstance(result, str) else json.dumps(result, indent=2))
+    sys.exit(0)
+
   # Prevent multiple instances
-  if is_running():
+  instance_lock = acquire_instance_lock(lock_name)
+  if instance_lock is None:
+    if args.repop:
+      try:
+        print(f"Running instance: {send_command(lock_name, 'repop')}")
+      except ControlError as e:
+        print(f"Running instance: {e}")
     print("Another instance is already running. Exiting.")
     sys.exit(0)
   
   try:
     # Load configuration
-    config = load_config(config_name)
-    
-    # Validate API key
-    api_key = config["openai"]["api_key"]
+    settings_mtime = config_mtime()
+    settings = load_config(config_name)
     
-    # Initialize OpenAI client
-    client = OpenAI(api_key=api_key)
+    # Heavy modules load on first use unless preloading is requested
+    if settings.startup.preload:
+      pyperclip.load()
+      get_client()
+      post_ui('')  # Builds the hidden popup without showing anything
+
+    # Pre-connect in the background so the first key press skips connection setup
+    if settings.http.preconnect:
+      threading.Thread(target=keep_warm, args=(settings.http.ping_interval,), name='keep-warm', daemon=True).start()
+
+    # Rolling stage summaries in a log file and an optional Prometheus endpoint
+    metrics_options = settings.metrics
+    if metrics_options.log:
+      threading.Thread(target=write_summaries,
+                       args=(stage_metrics, cache_path(config_name, metrics_options.log), metrics_options.log_interval),
+                       name='metrics-log', daemon=True).start()
+    if metrics_options.port:
+      serve_metrics(stage_metrics, metrics_options.port)
+      print(f"Metrics at http://127.0.0.1:{metrics_options.port}/metrics")
+
+    if settings.startup.idle_release > 0:
+      threading.Thread(target=release_idle_state, args=(settings.startup.idle_release,), name='idle', daemon=True).start()
+
+    # Answer cache in front of the API, optionally persisted next to config.ini
+    cache = open_cache()
+
+    # Recent answers for key_prev/key_next, optionally logged next to config.ini
+    history_options = settings.history
+    if history_options.size > 0:
+      history = AnswerHistory(
+        history_options.size,
+        cache_path(config_name, history_options.path) if history_options.persist else None
+      )
+      if history.count:
+        latest = history.step(0)[3]
+
+    # Generation runs on a worker pool, popups on a single UI thread
+    dispatcher = Dispatcher(
+      process_message,
+      workers=settings.dispatch.workers,
+      queue_size=settings.dispatch.queue_size
+    )
+
+    # Later launches and other tools drive this instance over a token-guarded local socket
+    control_server = ControlServer(new_token(), CONTROL_COMMANDS)
+    try:
+      publish(instance_lock, control_server.port, control_server.token)
+      control_server.start()
+    except OSError as e:
+      control_server.server.close()
+      print(f"Control socket disabled, could not restrict {lock_name}: {e}")
     
+    # Right-click copies start generating before key_pop is pressed
+    if settings.prefetch.enabled:
+      prefetcher = Prefetcher(settings.prefetch.wait)
+
+    hotkeys = HotkeyTable(settings.keys, windows_key_state())
+
+    # Apply edits to config.ini without a restart
+    if settings.startup.reload_interval > 0:
+      threading.Thread(target=watch_config, args=(settings.startup.reload_interval, settings_mtime), name='config-watch', daemon=True).start()
+
     print("Joker Assistant started successfully")
-    print(f"Press {config['key']['key_exit']} to toggle disable")
-    print(f"Press {config['key']['key_pop']} to generate response")
-    print(f"Press {config['key']['key_repop']} to show last response")
+    print(f"Press {settings.key('exit')} to toggle disable")
+    print(f"Press {settings.key('pop')} to generate response")
+    print(f"Press {settings.key('repop')} to show last response")
     
+    # Optionally trace listener input for replay with `bench.py replay`
+    on_press, on_release, on_click = on_key_press, on_key_release, on_mouse_click
+    if args.record:
+      recorder = TraceRecorder(args.record, settings.keys, lambda key: hotkeys.bound(key), lambda: pyperclip.paste())
+      atexit.register(recorder.close)
+      on_press, on_release = recorder.wrap_key('p', on_press), recorder.wrap_key('r', on_release)
+      on_click = recorder.wrap_click(on_click)
+      print(f"Recording input to {args.record}")
+
     # Start listeners
-    keyboard_listener = keyboard.Listener(on_press=on_key_press, on_release=on_key_release)
-    mouse_listener = mouse.Listener(on_click=on_mouse_click)
+    keyboard_listener = keyboard.Listener(on_press=on_press, on_release=on_release)
+    mouse_listener = mouse.Listener(on_click=on_click)
 
     keyboard_listener.start()
     mouse_listener.start()
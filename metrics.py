@@ -0,0 +1,137 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+  from http.server import ThreadingHTTPServer
+
+# Size at which the summary log moves to <log>.1 and starts over
+MAX_LOG_BYTES = 1024 * 1024
+# Upper bounds in milliseconds; the last bucket catches everything slower
+BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, float('inf'))
+
+class Histogram:
+  """Latency histogram with cumulative buckets plus a window of recent samples.
+
+  Buckets never reset and feed the Prometheus export; the bounded window
+  gives exact rolling percentiles for the log summary.
+  """
+
+  def __init__(self, window: int = 1024) -> None:
+    self.counts = [0] * len(BUCKETS)
+    self.count = 0
+    self.total = 0.0
+    self.recent: 'deque[float]' = deque(maxlen=window)
+
+  def observe(self, ms: float) -> None:
+    self.counts[bisect.bisect_left(BUCKETS, ms)] += 1
+    self.count += 1
+    self.total += ms
+    self.recent.append(ms)
+
+  def summary(self) -> dict[str, Any]:
+    ordered = sorted(self.recent)
+    if not ordered:
+      return {'count': self.count}
+
+    def rank(q: float) -> float:
+      return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+    return {
+      'count': self.count,
+      'p50': rank(0.50),
+      'p95': rank(0.95),
+      'p99': rank(0.99),
+      'max': round(ordered[-1], 1)
+    }
+
+class Metrics:
+  """Per-stage latency histograms shared by every thread in the process."""
+
+  def __init__(self, stages: tuple[str, ...]) -> None:
+    self.lock = threading.Lock()
+    self.histograms = {stage: Histogram() for stage in stages}
+    self.observed = 0
+
+  def observe(self, stage: str, ms: float) -> None:
+    """Record one duration in milliseconds for stage."""
+    with self.lock:
+      self.histograms[stage].observe(ms)
+      self.observed += 1
+
+  def since(self, stage: str, started: float) -> None:
+    """Record the time elapsed since a `time.perf_counter()` reading."""
+    self.observe(stage, (time.perf_counter() - started) * 1000)
+
+  def summary(self) -> dict[str, dict[str, Any]]:
+    """Return rolling p50/p95/p99/max for every stage that has samples."""
+    with self.lock:
+      return {stage: h.summary() for stage, h in self.histograms.items() if h.count}
+
+  def prometheus(self) -> str:
+    """Render all stages in the Prometheus text exposition format."""
+    lines = [
+      '# HELP joker_stage_ms Time spent in each stage of answering a key press, in milliseconds.',
+      '# TYPE joker_stage_ms histogram'
+    ]
+    with self.lock:
+      for stage, h in self.histograms.items():
+        cumulative = 0
+        for bound, count in zip(BUCKETS, h.counts):
+          cumulative += count
+          le = '+Inf' if bound == float('inf') else f'{bound:g}'
+          lines.append(f'joker_stage_ms_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'joker_stage_ms_sum{{stage="{stage}"}} {h.total:.3f}')
+        lines.append(f'joker_stage_ms_count{{stage="{stage}"}} {h.count}')
+    return '\n'.join(lines) + '\n'
+
+def write_summaries(metrics: Metrics, path: str, interval: float) -> None:
+  """Append a JSON line with the rolling summary every interval seconds with new samples.
+
+  Once the log reaches MAX_LOG_BYTES it replaces <path>.1, so at most two
+  files' worth is kept.
+  """
+  written = 0
+  while True:
+    time.sleep(interval)
+    if metrics.observed == written:
+      continue
+
+    written = metrics.observed
+    line = json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'stages': metrics.summary()})
+    try:
+      if os.path.exists(path) and os.path.getsize(path) >= MAX_LOG_BYTES:
+        os.replace(path, path + '.1')
+      with open(path, 'a') as f:
+        f.write(line + '\n')
+    except OSError as e:
+      print(f"Failed to write metrics log: {e}")
+
+def serve_metrics(metrics: Metrics, port: int) -> 'ThreadingHTTPServer':
+  """Expose GET /metrics on localhost in Prometheus text format."""
+  # Imported here: http.server costs ~30 ms of startup and is only needed with a metrics port
+  from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+  class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format: str, *args: Any) -> None:
+      pass
+
+    def do_GET(self) -> None:
+      if self.path.split('?')[0] != '/metrics':
+        self.send_error(404)
+        return
+      body = metrics.prometheus().encode()
+      self.send_response(200)
+      self.send_header('Content-Type', 'text/plain; version=0.0.4')
+      self.send_header('Content-Length', str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+  server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+  server.daemon_threads = True
+  threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+  return server
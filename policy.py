@@ -0,0 +1,99 @@
+import email.utils
+import random
+import threading
+import time
+from typing import Optional
+
+class CircuitOpenError(Exception):
+  """Raised instead of calling a model whose circuit breaker is open; retry_in is seconds until a probe."""
+
+  def __init__(self, message: str, retry_in: float = 0) -> None:
+    super().__init__(message)
+    self.retry_in = retry_in
+
+class CircuitBreaker:
+  """Stops calling a failing model for a cool-down period.
+
+  Closed: requests flow and consecutive failures are counted. After
+  `threshold` of them the breaker opens and every request fails fast for
+  `cooldown` seconds. It then half-opens and lets one probe through: a
+  success closes it, a failure opens it again; a probe that is cancelled
+  must be released so the next request can probe. Transitions are printed.
+  """
+
+  def __init__(self, name: str, threshold: int = 5, cooldown: float = 30) -> None:
+    self.name = name
+    self.threshold = threshold
+    self.cooldown = cooldown
+    self.lock = threading.Lock()
+    self.state = 'closed'
+    self.failures = 0
+    self.opened_at = 0.0
+    self.probing = False
+
+  def allow(self) -> bool:
+    """Return True if a request may go out now."""
+    with self.lock:
+      if self.state == 'closed':
+        return True
+      if self.state == 'open':
+        if time.monotonic() - self.opened_at < self.cooldown:
+          return False
+        self._move('half-open')
+      if self.probing:
+        return False
+      self.probing = True
+      return True
+
+  def record(self, success: bool) -> None:
+    """Report how an allowed request went."""
+    with self.lock:
+      self.probing = False
+      if success:
+        self.failures = 0
+        if self.state != 'closed':
+          self._move('closed')
+        return
+
+      self.failures += 1
+      if self.state == 'half-open' or (self.state == 'closed' and self.failures >= max(1, self.threshold)):
+        self.opened_at = time.monotonic()
+        self._move('open')
+
+  def release(self) -> None:
+    """Hand back an allowed request that ended without an outcome, e.g. because it was cancelled."""
+    with self.lock:
+      self.probing = False
+
+  def retry_in(self) -> float:
+    """Seconds until an open breaker lets a probe through."""
+    with self.lock:
+      return max(0.0, self.opened_at + self.cooldown - time.monotonic())
+
+  def _move(self, state: str) -> None:
+    detail = f" after {self.failures} failures, cooling down {self.cooldown:g}s" if state == 'open' else ''
+    print(f"Circuit breaker for {self.name}: {self.state} -> {state}{detail}")
+    self.state = state
+
+def backoff_delay(attempt: int, base: float = 0.25, cap: float = 4.0) -> float:
+  """Full-jitter exponential backoff: a random delay up to base * 2**attempt, capped."""
+  return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def retry_after(error: Exception) -> Optional[float]:
+  """Seconds the server asked to wait before retrying (retry-after-ms or Retry-After), if it said."""
+  headers = getattr(getattr(error, 'response', None), 'headers', None)
+  if headers is None:
+    return None
+  try:
+    if headers.get('retry-after-ms') is not None:
+      return max(0.0, float(headers['retry-after-ms']) / 1000)
+    value = headers.get('retry-after')
+    if value is None:
+      return None
+    try:
+      return max(0.0, float(value))
+    except ValueError:
+      # An HTTP date instead of a number of seconds
+      return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+  except (AttributeError, TypeError, ValueError):
+    return None
@@ -0,0 +1,216 @@
+import configparser
+import os
+from dataclasses import dataclass, field, fields
+from typing import Any
+
+# Smallest max_input_tokens that still leaves room for a question between the omission markers
+MIN_INPUT_TOKENS = 64
+
+@dataclass(frozen=True)
+class OpenAISettings:
+  api_key: str
+  model: str
+  prompt_system: str
+  prompt_user: str
+  stream: bool = False
+  base_url: str = ''
+  hedge_delay: float = 0
+  hedge_model: str = ''
+  max_input_tokens: int = 4000
+  max_output_tokens: int = 0
+  reasoning_effort: str = ''
+  # Whether base_url takes OpenAI-only request parameters (max_completion_tokens, reasoning_effort)
+  openai_params: bool = True
+
+  def __post_init__(self) -> None:
+    if 0 < self.max_input_tokens < MIN_INPUT_TOKENS:
+      raise ValueError(f"Invalid value for 'max_input_tokens' in section '[openai]': expected 0 (no limit) "
+                       f"or at least {MIN_INPUT_TOKENS}, got {self.max_input_tokens}")
+
+@dataclass(frozen=True)
+class BackendSettings:
+  name: str
+  base_url: str = ''
+  api_key: str = ''
+  model: str = ''
+  # Defaults to [openai]'s when base_url is unset; other servers get max_tokens instead
+  openai_params: bool = False
+
+@dataclass(frozen=True)
+class WindowSettings:
+  alpha: float
+  display_time: int
+  position: str
+  # Offsets parsed from position (e.g. "+300+200")
+  x_offset: int = field(init=False)
+  y_offset: int = field(init=False)
+
+  def __post_init__(self) -> None:
+    parts = self.position.split('+')
+    try:
+      object.__setattr__(self, 'x_offset', int(parts[1]) if len(parts) >= 2 else 300)
+      object.__setattr__(self, 'y_offset', int(parts[2]) if len(parts) >= 3 else 200)
+    except ValueError:
+      raise ValueError(f"Invalid value for 'position' in section '[window]': expected +X+Y, got '{self.position}'")
+
+@dataclass(frozen=True)
+class DispatchSettings:
+  workers: int = 2
+  queue_size: int = 4
+
+@dataclass(frozen=True)
+class CacheSettings:
+  enabled: bool = True
+  max_entries: int = 256
+  max_bytes: int = 1048576
+  ttl: float = 86400
+  persist: bool = False
+  path: str = 'cache.db'
+  similarity: float = 0
+
+@dataclass(frozen=True)
+class HistorySettings:
+  size: int = 50
+  persist: bool = True
+  path: str = 'history.jsonl'
+
+@dataclass(frozen=True)
+class StartupSettings:
+  preload: bool = False
+  idle_release: float = 0
+  reload_interval: float = 1
+
+@dataclass(frozen=True)
+class HttpSettings:
+  preconnect: bool = True
+  ping_interval: float = 45
+  max_connections: int = 10
+  max_keepalive: int = 5
+  keepalive_expiry: float = 300
+  http2: bool = False
+
+@dataclass(frozen=True)
+class PolicySettings:
+  deadline: float = 30
+  connect_timeout: float = 5
+  retries: int = 2
+  breaker_failures: int = 5
+  breaker_cooldown: float = 30
+  fallback_model: str = ''
+
+@dataclass(frozen=True)
+class PrefetchSettings:
+  enabled: bool = False
+  wait: float = 500
+
+@dataclass(frozen=True)
+class FanoutSettings:
+  enabled: bool = False
+  max_questions: int = 10
+  concurrency: int = 4
+
+@dataclass(frozen=True)
+class MetricsSettings:
+  log: str = ''
+  log_interval: float = 60
+  port: int = 0
+
+@dataclass(frozen=True)
+class Settings:
+  """Everything in config.ini, parsed and validated once.
+
+  Hot paths read typed fields from the current snapshot instead of going
+  through configparser. A reload builds a new snapshot and swaps it in
+  whole, so a reader never sees half of an old and half of a new file.
+  """
+  keys: tuple[tuple[str, str], ...]
+  openai: OpenAISettings
+  backends: tuple[BackendSettings, ...]
+  window: WindowSettings
+  dispatch: DispatchSettings
+  cache: CacheSettings
+  history: HistorySettings
+  startup: StartupSettings
+  http: HttpSettings
+  policy: PolicySettings
+  prefetch: PrefetchSettings
+  fanout: FanoutSettings
+  metrics: MetricsSettings
+
+  def key(self, action: str) -> str:
+    """Return the binding text for key_<action>, or '' if unbound."""
+    return dict(self.keys).get(f'key_{action}', '')
+
+# Keys that must be present, and those of them allowed to be empty
+REQUIRED = {
+  'key': ['key_exit', 'key_pop', 'key_repop'],
+  'openai': ['api_key', 'model', 'prompt_system', 'prompt_user'],
+  'window': ['alpha', 'display_time', 'position']
+}
+OPTIONAL_KEYS = {'prompt_system', 'prompt_user'}
+BACKEND_PREFIX = 'backend:'
+
+def parse_section(config: configparser.ConfigParser, name: str, cls: type, **fixed: Any) -> Any:
+  """Build a section dataclass, converting each option to its field's type.
+
+  Fields given in fixed are taken from there instead of the file.
+  """
+  getters = {bool: config.getboolean, int: config.getint, float: config.getfloat, str: config.get}
+  values = dict(fixed)
+  for f in fields(cls):
+    if not f.init or f.name in fixed or not config.has_option(name, f.name):
+      continue
+    try:
+      values[f.name] = getters[f.type](name, f.name)
+    except ValueError:
+      raise ValueError(f"Invalid value for '{f.name}' in section '[{name}]': expected {f.type.__name__}, "
+                       f"got '{config.get(name, f.name)}'")
+  return cls(**values)
+
+def load_config(config_file: str) -> Settings:
+  """Load and validate configuration from INI file."""
+  if not os.path.exists(config_file):
+    raise FileNotFoundError(f"Configuration file '{config_file}' not found")
+
+  config = configparser.ConfigParser()
+  config.read(config_file)
+
+  # Validate required sections and keys
+  for section, keys in REQUIRED.items():
+    if not config.has_section(section):
+      raise ValueError(f"Missing required section '[{section}]' in config file")
+
+    for key in keys:
+      if not config.has_option(section, key):
+        raise ValueError(f"Missing required key '{key}' in section '[{section}]'")
+
+      # Only validate non-empty for keys that aren't optional
+      if key not in OPTIONAL_KEYS:
+        value = config.get(section, key).strip()
+        if not value:
+          raise ValueError(f"Empty value for '{key}' in section '[{section}]'. Please configure it in {config_file}")
+
+  # Extra OpenAI-compatible endpoints, one [backend:NAME] section each
+  backends = []
+  for section in config.sections():
+    if section.startswith(BACKEND_PREFIX):
+      name = section[len(BACKEND_PREFIX):].strip()
+      if not name or name == 'openai':
+        raise ValueError(f"Invalid backend section '[{section}]': give it a name other than 'openai'")
+      backends.append(parse_section(config, section, BackendSettings, name=name))
+
+  return Settings(
+    keys=tuple(config.items('key')),
+    openai=parse_section(config, 'openai', OpenAISettings),
+    backends=tuple(backends),
+    window=parse_section(config, 'window', WindowSettings),
+    dispatch=parse_section(config, 'dispatch', DispatchSettings),
+    cache=parse_section(config, 'cache', CacheSettings),
+    history=parse_section(config, 'history', HistorySettings),
+    startup=parse_section(config, 'startup', StartupSettings),
+    http=parse_section(config, 'http', HttpSettings),
+    policy=parse_section(config, 'policy', PolicySettings),
+    prefetch=parse_section(config, 'prefetch', PrefetchSettings),
+    fanout=parse_section(config, 'fanout', FanoutSettings),
+    metrics=parse_section(config, 'metrics', MetricsSettings)
+  )
@@ -5,6 +5,7 @@ import urllib.request
 from configparser import ConfigParser
 from win32com.client import Dispatch
 import shutil
+from download import DownloadError, download
 
 def exit_sys(code: int = 0) -> None:
   """Exit the program after user confirmation."""
@@ -121,18 +122,80 @@ def config(script_path: str, config_name: str) -> bool:
     'key': {
       'key_exit': 'Key.esc',
       'key_pop': '1',
-      'key_repop': '2'
+      'key_repop': '2',
+      'key_prev': '3',
+      'key_next': '4'
     },
     'openai': {
       'api_key': '',
       'model': 'gpt-5',
       'prompt_system': 'You are a helpful assistant specialized in answering multiple-choice questions.',
-      'prompt_user': 'Give me only the correct answer and nothing else:'
+      'prompt_user': 'Give me only the correct answer and nothing else:',
+      'stream': 'false',
+      'hedge_delay': '0',
+      'hedge_model': '',
+      'max_input_tokens': '4000',
+      'max_output_tokens': '0',
+      'reasoning_effort': '',
+      'openai_params': 'true'
     },
     'window': {
       'alpha': '0.5',
       'display_time': '3000',
       'position': '+300+200'
+    },
+    'dispatch': {
+      'workers': '2',
+      'queue_size': '4'
+    },
+    'cache': {
+      'enabled': 'true',
+      'max_entries': '256',
+      'max_bytes': '1048576',
+      'ttl': '86400',
+      'persist': 'false',
+      'path': 'cache.db',
+      'similarity': '0'
+    },
+    'history': {
+      'size': '50',
+      'persist': 'true',
+      'path': 'history.jsonl'
+    },
+    'startup': {
+      'preload': 'false',
+      'idle_release': '0',
+      'reload_interval': '1'
+    },
+    'http': {
+      'preconnect': 'true',
+      'ping_interval': '45',
+      'max_connections': '10',
+      'max_keepalive': '5',
+      'keepalive_expiry': '300',
+      'http2': 'false'
+    },
+    'policy': {
+      'deadline': '30',
+      'connect_timeout': '5',
+      'retries': '2',
+      'breaker_failures': '5',
+      'breaker_cooldown': '30',
+      'fallback_model': ''
+    },
+    'prefetch': {
+      'enabled': 'false',
+      'wait': '500'
+    },
+    'fanout': {
+      'enabled': 'false',
+      'max_questions': '10',
+      'concurrency': '4'
+    },
+    'metrics': {
+      'log': '',
+      'log_interval': '60',
+      'port': '0'
     }
   }
   
@@ -185,6 +248,17 @@ def delete_setup(script_path: str, script_name: str) -> None:
   else:
     print("\n⚠ Uninstall completed with warnings.")
 
+def release_checksum(assets: list) -> str:
+  """Return 'sha256:HEX' from a joker.exe.sha256 release asset, or '' if there is none."""
+  for asset in assets:
+    if asset.get('name') == 'joker.exe.sha256':
+      try:
+        with urllib.request.urlopen(asset['browser_download_url'], timeout=30) as response:
+          return f"sha256:{response.read().decode().split()[0]}"
+      except Exception as e:
+        print(f"  ⚠ Could not read joker.exe.sha256: {e}")
+  return ''
+
 def download_exe(setup_path: str, script_name: str) -> bool:
   """Download the executable from GitHub repository latest release."""
   api_url = 'https://api.github.com/repos/Albadit/Joker/releases/latest'
@@ -199,13 +273,18 @@ def download_exe(setup_path: str, script_name: str) -> bool:
       import json
       release_data = json.loads(response.read().decode())
     
-    # Find joker.exe in assets
+    # Find joker.exe in assets, with its checksum if the release publishes one
     download_url = None
-    for asset in release_data.get('assets', []):
+    digest = ''
+    assets = release_data.get('assets', [])
+    for asset in assets:
       if asset.get('name') == 'joker.exe':
         download_url = asset.get('browser_download_url')
         file_size = asset.get('size', 0)
+        digest = asset.get('digest') or ''
         break
+    if download_url and not digest:
+      digest = release_checksum(assets)
     
     if not download_url:
       print(f"✗ joker.exe not found in latest release")
@@ -216,18 +295,25 @@ def download_exe(setup_path: str, script_name: str) -> bool:
     print(f"  Size: {file_size:,} bytes")
     print(f"\nDownloading {script_name}.exe...")
     print(f"  Source: {download_url}")
+    if not digest:
+      print(f"  ⚠ The release publishes no checksum; the download cannot be verified")
     
-    urllib.request.urlretrieve(download_url, exe_path)
+    # Interrupted downloads resume from exe_path + '.part' on the next run
+    sha256 = download(download_url, exe_path, digest, file_size)
     
-    if os.path.exists(exe_path):
-      actual_size = os.path.getsize(exe_path)
-      print(f"✓ Downloaded successfully ({actual_size:,} bytes)")
-      print(f"  Location: {exe_path}")
-      return True
+    actual_size = os.path.getsize(exe_path)
+    print(f"✓ Downloaded successfully ({actual_size:,} bytes)")
+    if digest:
+      print(f"  Verified: {digest}")
     else:
-      print(f"✗ File not found after download")
-      return False
+      print(f"  SHA-256: {sha256}")
+    print(f"  Location: {exe_path}")
+    return True
       
+  except DownloadError as e:
+    print(f"✗ Download failed: {e}")
+    print("  Run setup again to resume the download.")
+    return False
   except urllib.error.URLError as e:
     print(f"✗ Network error: {e}")
     print("  Please check your internet connection.")
@@ -0,0 +1,190 @@
+import heapq
+import random
+import re
+import threading
+import zlib
+from array import array
+from collections import OrderedDict
+from typing import Optional
+
+# Signature slots for bucketing; more make candidates more selective
+NUM_PERM = 64
+# Smallest shingle hashes kept to estimate similarity; exact for questions with fewer shingles
+SKETCH = 64
+# Bits of a shingle's mixed hash that pick its slot (2 ** SLOT_BITS == NUM_PERM)
+SLOT_BITS = 6
+# Words per shingle
+SHINGLE = 3
+# Leading bullets and option labels: "-", "•", "*", "a)", "(b)", "C.", "1.", "2)"
+MARKER = re.compile(r'^\s*(?:[-*•·‣◦▪●○]+|\(?[a-h]\)|[a-h][.:]|\(?\d{1,3}[.):])\s+', re.IGNORECASE)
+WORD = re.compile(r'\w+')
+# Words that flip what a question asks; near-duplicates must agree on these and on every number
+NEGATIONS = frozenset(['not', 'no', 'never', 'except', 'false', 'incorrect', 'least', 'neither', 'nor', 'without'])
+
+MASK = (1 << 64) - 1
+VALUE_BITS = 64 - SLOT_BITS
+VALUE_MASK = (1 << VALUE_BITS) - 1
+_random = random.Random(0x4A6F6B)
+# Multiply-shift mixing (odd multiplier); a fixed seed keeps signatures comparable between runs
+MULTIPLIER = _random.getrandbits(64) | 1
+INCREMENT = _random.getrandbits(64)
+# Added per slot of distance when an empty slot borrows a value
+BORROW_OFFSET = 0x9E3779B1
+
+def normalize_lines(text: str) -> list[list[str]]:
+  """Lowercase words of each non-empty line, with bullets, option labels and punctuation dropped."""
+  lines = []
+  for line in text.splitlines():
+    words = WORD.findall(MARKER.sub('', line).lower())
+    if words:
+      lines.append(words)
+  return lines
+
+def shingle_hashes(lines: list[list[str]]) -> set[int]:
+  """Hash every run of SHINGLE words within a line; shorter lines count as one shingle.
+
+  Shingles never span lines, so reordered options give the same set.
+  """
+  hashes = set()
+  for words in lines:
+    for i in range(max(1, len(words) - SHINGLE + 1)):
+      hashes.add(zlib.crc32(' '.join(words[i:i + SHINGLE]).encode('utf-8')))
+  return hashes
+
+def signature(hashes: set[int]) -> array:
+  """One-permutation MinHash signature of a non-empty shingle set.
+
+  Each shingle is hashed once: the top bits pick a slot and the slot keeps
+  the smallest remaining value, so a signature costs one pass over the
+  shingles instead of one per slot. Empty slots (short questions) borrow
+  from the next filled slot, offset by the distance, so equal slots still
+  mean a shared shingle.
+  """
+  slots = [VALUE_MASK + 1] * NUM_PERM
+  for h in hashes:
+    x = (MULTIPLIER * h + INCREMENT) & MASK
+    slot = x >> VALUE_BITS
+    if x & VALUE_MASK < slots[slot]:
+      slots[slot] = x & VALUE_MASK
+  # Walk backwards twice round so slots near the end can borrow from the start
+  values = [0] * NUM_PERM
+  value = distance = 0
+  for i in range(2 * NUM_PERM - 1, -1, -1):
+    if slots[i % NUM_PERM] <= VALUE_MASK:
+      value, distance = slots[i % NUM_PERM] >> (VALUE_BITS - 32), 0
+    else:
+      distance += 1
+    if i < NUM_PERM:
+      values[i] = (value + distance * BORROW_OFFSET) & 0xFFFFFFFF
+  return array('I', values)
+
+def sketch(hashes: set[int]) -> array:
+  """Bottom-k sketch: the SKETCH smallest shingle hashes, sorted."""
+  return array('I', heapq.nsmallest(SKETCH, hashes))
+
+def resemblance(a: array, b: array) -> float:
+  """Estimate the Jaccard similarity of two shingle sets from their bottom-k sketches."""
+  first, second = set(a), set(b)
+  union = heapq.nsmallest(SKETCH, first | second)
+  return sum(1 for h in union if h in first and h in second) / len(union)
+
+def guard(lines: list[list[str]]) -> frozenset:
+  """Numbers and negations in a question; two questions differing in these are never near-duplicates."""
+  return frozenset(word for words in lines for word in words if word.isdigit() or word in NEGATIONS)
+
+def band_rows(threshold: float) -> int:
+  """Rows per LSH band: the most selective split that still finds pairs at threshold 98% of the time."""
+  rows = 1
+  for candidate in (2, 4, 8, 16, 32):
+    bands = NUM_PERM // candidate
+    if 1 - (1 - threshold ** candidate) ** bands < 0.98:
+      break
+    rows = candidate
+  return rows
+
+class NearDuplicateIndex:
+  """MinHash/LSH index from questions to the cache keys of their answers.
+
+  A lookup hashes the question's shingles once, checks one bucket per LSH
+  band and confirms candidates by their Jaccard similarity (estimated
+  from bottom-k sketches, exact for short questions), so it costs about
+  the same however many questions are stored. Entries are kept in LRU
+  order up to max_entries, each about 2 KB including its buckets. context
+  (model and prompts) must match exactly, as must the question's numbers
+  and negations.
+  """
+
+  def __init__(self, threshold: float = 0.8, max_entries: int = 256) -> None:
+    self.threshold = threshold
+    self.max_entries = max(1, max_entries)
+    self.rows = band_rows(threshold)
+    self.buckets: list[dict[bytes, set[str]]] = [{} for _ in range(NUM_PERM // self.rows)]
+    # key -> (signature, sketch, guard, context)
+    self.entries: 'OrderedDict[str, tuple[array, array, frozenset, str]]' = OrderedDict()
+    self.lock = threading.Lock()
+
+  def add(self, key: str, question: str, context: str = '') -> None:
+    """Index question under key, replacing any earlier entry for key."""
+    lines = normalize_lines(question)
+    hashes = shingle_hashes(lines)
+    if not hashes:
+      return
+    entry = (signature(hashes), sketch(hashes), guard(lines), context)
+
+    with self.lock:
+      if key in self.entries:
+        self._remove(key)
+      self.entries[key] = entry
+      for bucket, band in zip(self.buckets, self._bands(entry[0])):
+        bucket.setdefault(band, set()).add(key)
+      while len(self.entries) > self.max_entries:
+        self._remove(next(iter(self.entries)))
+
+  def find(self, question: str, context: str = '') -> Optional[tuple[str, float]]:
+    """Return (key, estimated similarity) of the closest stored question at or above threshold."""
+    lines = normalize_lines(question)
+    hashes = shingle_hashes(lines)
+    if not hashes:
+      return None
+    sig = signature(hashes)
+    mins = sketch(hashes)
+    words = guard(lines)
+
+    best: Optional[tuple[str, float]] = None
+    with self.lock:
+      candidates: set[str] = set()
+      for bucket, band in zip(self.buckets, self._bands(sig)):
+        candidates.update(bucket.get(band, ()))
+      for key in candidates:
+        _, other, other_words, other_context = self.entries[key]
+        if other_context != context or other_words != words:
+          continue
+        similarity = resemblance(mins, other)
+        if similarity >= self.threshold and (best is None or similarity > best[1]):
+          best = (key, similarity)
+      if best is not None:
+        self.entries.move_to_end(best[0])
+    return best
+
+  def discard(self, key: str) -> None:
+    """Forget key, e.g. once its answer has left the cache."""
+    with self.lock:
+      if key in self.entries:
+        self._remove(key)
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def _bands(self, sig: array) -> list[bytes]:
+    raw = sig.tobytes()
+    width = self.rows * sig.itemsize
+    return [raw[i:i + width] for i in range(0, len(raw), width)]
+
+  def _remove(self, key: str) -> None:
+    sig = self.entries.pop(key)[0]
+    for bucket, band in zip(self.buckets, self._bands(sig)):
+      keys = bucket.get(band)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del bucket[band]
@@ -0,0 +1,150 @@
+import importlib.util
+import math
+import re
+import threading
+from typing import Any
+
+# Rough characters per token, used when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+# Stands in for text dropped to fit the input budget
+OMITTED = '[...]'
+# The first option of an inline answer list: "A) ", "(a) ", "A. ", "A: "
+FIRST_OPTION = re.compile(r'(?:^|\s)(?:\(?[Aa]\)|A[.:])\s')
+
+class TokenCounter:
+  """Counts tokens with tiktoken when it is installed, otherwise estimates them.
+
+  The estimate assumes CHARS_PER_TOKEN characters per token, which is close
+  for English prose and errs high for code and other languages.
+  """
+
+  def __init__(self, model: str) -> None:
+    self.encoding: Any = None
+    if importlib.util.find_spec('tiktoken') is not None:
+      import tiktoken
+      try:
+        try:
+          self.encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+          self.encoding = tiktoken.get_encoding('o200k_base')
+      except Exception as e:
+        # Encodings are downloaded on first use; offline we fall back to estimating
+        print(f"Token counts are estimated: could not load tiktoken encoding ({e})")
+
+  @property
+  def exact(self) -> bool:
+    return self.encoding is not None
+
+  def count(self, text: str) -> int:
+    if self.encoding is not None:
+      return len(self.encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+  def head(self, text: str, tokens: int) -> str:
+    """Return the longest start of text that fits in tokens."""
+    if self.encoding is not None:
+      return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[:max(0, tokens)])
+    return text[:max(0, tokens) * CHARS_PER_TOKEN]
+
+  def tail(self, text: str, tokens: int) -> str:
+    """Return the longest end of text that fits in tokens."""
+    if tokens <= 0:
+      return ''
+    if self.encoding is not None:
+      return self.encoding.decode(self.encoding.encode(text, disallowed_special=())[-tokens:])
+    return text[max(0, len(text) - tokens * CHARS_PER_TOKEN):]
+
+counters: dict[str, TokenCounter] = {}
+counters_lock = threading.Lock()
+
+def token_counter(model: str) -> TokenCounter:
+  """Return the shared counter for model, loading its encoding on first use."""
+  with counters_lock:
+    counter = counters.get(model)
+    if counter is None:
+      counter = counters[model] = TokenCounter(model)
+    return counter
+
+def fit_message(message: str, budget: int, counter: TokenCounter) -> tuple[str, int]:
+  """Trim message to at most budget tokens, keeping the text around the question.
+
+  Returns the trimmed text and the untrimmed token count. The question is
+  taken to be the last line with a '?' (else the last line). Lines after it
+  (usually the answer options) and before it (context) are added while they
+  fit, and dropped runs are marked with OMITTED. A question line that alone
+  exceeds the budget is windowed the same way by sentence, and a sentence
+  that still does not fit keeps the text just before its '?' (or before
+  an inline "A) ..." option list, else its end) and what follows.
+  """
+  total = counter.count(message)
+  if budget <= 0 or total <= budget:
+    return message, total
+
+  marker = counter.count(OMITTED) + 1
+  return window(message.split('\n'), '\n', budget - 2 * marker, counter), total
+
+def window(units: list[str], separator: str, budget: int, counter: TokenCounter) -> str:
+  """Keep the contiguous run of units around the question that fits budget."""
+  anchor = next((i for i in range(len(units) - 1, -1, -1) if '?' in units[i]), len(units) - 1)
+  costs = [counter.count(unit) + 1 for unit in units]
+  if costs[anchor] > budget:
+    if separator == '\n':
+      # Lines after an over-long question line (its options) keep up to half the budget
+      end, used = anchor + 1, counter.count(OMITTED) + 1
+      while end < len(units) and used + costs[end] <= budget // 2:
+        used += costs[end]
+        end += 1
+      sentences = re.split(r'(?<=[.!?])\s+', units[anchor])
+      if len(sentences) > 1:
+        kept = window(sentences, ' ', budget - used, counter)
+      else:
+        kept = clip(units[anchor], budget - used, counter)
+      return mark('\n'.join([kept, *units[anchor + 1:end]]), anchor > 0, end < len(units), separator)
+    # Sentences after the question (inline options) stay with it
+    return mark(clip(' '.join(units[anchor:]), budget, counter), anchor > 0, False, separator)
+
+  # Grow forward first: options follow the question, context precedes it
+  start, end, used = anchor, anchor + 1, costs[anchor]
+  grown = True
+  while grown:
+    grown = False
+    if end < len(units) and used + costs[end] <= budget:
+      used += costs[end]
+      end += 1
+      grown = True
+    if start > 0 and used + costs[start - 1] <= budget:
+      start -= 1
+      used += costs[start]
+      grown = True
+
+  kept = units[start:end]
+  if start > 0:
+    kept.insert(0, OMITTED)
+  if end < len(units):
+    kept.append(OMITTED)
+  return separator.join(kept)
+
+def clip(text: str, budget: int, counter: TokenCounter) -> str:
+  """Cut one over-long unit to budget tokens around its question, marking the cuts.
+
+  The question ends at the last '?' or, failing that, where an inline
+  option list starts, else at the end of the text. Up to half the budget
+  goes to what follows it (the options) and the rest to the text before.
+  """
+  question = text.rfind('?') + 1
+  if not question:
+    options = list(FIRST_OPTION.finditer(text))
+    question = options[-1].start() if options else len(text)
+  before, after = text[:question], text[question:]
+
+  kept_before = counter.tail(before, budget - min(counter.count(after), budget // 2))
+  kept_after = counter.head(after, budget - counter.count(kept_before))
+  return mark(kept_before + kept_after, kept_before != before, kept_after != after, ' ')
+
+def mark(text: str, before: bool, after: bool, separator: str) -> str:
+  """Add OMITTED where text was dropped before or after it, unless already there."""
+  if before and not text.startswith(OMITTED):
+    text = f"{OMITTED}{separator}{text}"
+  if after and not text.endswith(OMITTED):
+    text = f"{text}{separator}{OMITTED}"
+  return text